@@ -0,0 +1,535 @@
+#!/usr/bin/python
+"""
+Times the NumPy versions of some of Q2MM's slowest steps against the
+Python loops they replaced, and checks that both give the same answer.
+
+Uses random data, so no reference or MacroModel files are required. Files
+that need to be read are written to a temporary directory first.
+
+Ex.) Score 100,000 data points 10 times.
+
+python benchmark.py -s 100000 -r 10
+
+Ex.) Mass weight the Hessian and eigenvectors of a 150 atom structure.
+
+python benchmark.py -m 150
+
+Ex.) Read the Hessian from the MacroModel log of a 150 atom structure.
+
+python benchmark.py -l 150
+
+Ex.) Form the Jacobian of 200 parameters and 10,000 data points from the
+differentiation file.
+
+python benchmark.py -j 200 10000
+
+Ex.) Make the SVD trial parameter changes for 300 parameters and 3,000 data
+points.
+
+python benchmark.py -v 300 3000
+
+Ex.) Make the Lagrange trial parameter changes for 300 parameters and 20
+factors.
+
+python benchmark.py -d 300 20
+"""
+from __future__ import print_function
+from itertools import izip
+import argparse
+import copy
+import csv
+import logging
+import logging.config
+import numpy as np
+import os
+import re
+import shutil
+import sys
+import tempfile
+import timeit
+
+import compare
+import constants as co
+import datatypes
+import filetypes
+import gradient
+
+logger = logging.getLogger(__name__)
+
+def main(args):
+    parser = return_benchmark_parser()
+    opts = parser.parse_args(args)
+    results = []
+    if opts.score:
+        results.append(benchmark_score(opts.score, repeat=opts.repeat))
+    if opts.mass:
+        results.extend(benchmark_mass_weight(opts.mass, repeat=opts.repeat))
+    if opts.log:
+        results.append(benchmark_macromodel_log(opts.log, repeat=opts.repeat))
+    if opts.damp:
+        results.append(benchmark_damped(
+                opts.damp[0], opts.damp[1], repeat=opts.repeat))
+    if opts.svd:
+        results.append(benchmark_svd(
+                opts.svd[0], opts.svd[1], repeat=opts.repeat))
+    if opts.jacobian:
+        results.append(benchmark_jacobian(
+                opts.jacobian[0], opts.jacobian[1], repeat=opts.repeat))
+    pretty_results(results)
+
+def return_benchmark_parser():
+    """
+    Arguments parser for benchmark.
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--damp', '-d', type=int, nargs=2, metavar=('P', 'F'),
+        help=('Time making the Lagrange trial parameter changes for P '
+              'parameters and F factors.'))
+    parser.add_argument(
+        '--svd', '-v', type=int, nargs=2, metavar=('P', 'N'),
+        help=('Time making the SVD trial parameter changes for P parameters '
+              'and N data points.'))
+    parser.add_argument(
+        '--jacobian', '-j', type=int, nargs=2, metavar=('P', 'N'),
+        help=('Time forming the Jacobian of P parameters and N data points '
+              'from the differentiation file.'))
+    parser.add_argument(
+        '--log', '-l', type=int, metavar='N',
+        help=('Time reading the Hessian from the MacroModel log of a '
+              'structure with N atoms.'))
+    parser.add_argument(
+        '--mass', '-m', type=int, metavar='N',
+        help=('Time mass weighting the Hessian and eigenvectors of a '
+              'structure with N atoms.'))
+    parser.add_argument(
+        '--repeat', '-r', type=int, default=5, metavar='N',
+        help='Use the best time out of N runs. Default is 5.')
+    parser.add_argument(
+        '--score', '-s', type=int, metavar='N',
+        help='Time the objective function using N data points.')
+    return parser
+
+def time_it(func, repeat=5):
+    """
+    Returns the fastest time out of several calls of func and the value
+    returned by the last call.
+    """
+    best = None
+    for i in xrange(repeat):
+        start = timeit.default_timer()
+        result = func()
+        end = timeit.default_timer()
+        if best is None or end - start < best:
+            best = end - start
+    return best, result
+
+def score_loop(wht, r_val, c_val, typ):
+    """
+    The objective function as it was before `compare.objective_function`,
+    one data point at a time.
+    """
+    score_tot = 0.
+    for w, r, c, t in izip(wht, r_val, c_val, typ):
+        if t == 't':
+            diff = abs(r - c)
+            if diff > 180.:
+                diff = 360. - diff
+        else:
+            diff = r - c
+        score_tot += w**2 * diff**2
+    return score_tot
+
+def benchmark_score(num_data, repeat=5, seed=0):
+    """
+    Compares `score_loop` against `compare.objective_function`.
+
+    About a third of the data points are torsions. Their values are
+    spread from -180 to 180, so plenty of them need the periodicity
+    correction.
+
+    Returns
+    -------
+    tuple of (string, float, float, bool)
+        Name, loop time, NumPy time and whether the scores are identical.
+    """
+    random = np.random.RandomState(seed)
+    typ = random.choice(['b', 'a', 't', 'h', 'eig'], size=num_data)
+    wht = np.array([co.WEIGHTS.get(x, 0.05) for x in typ])
+    r_val = random.uniform(-180., 180., size=num_data)
+    c_val = r_val + random.normal(scale=20., size=num_data)
+    c_val[c_val > 180.] -= 360.
+    c_val[c_val < -180.] += 360.
+    # The loop worked on Python floats pulled from Datum objects.
+    wht_list = wht.tolist()
+    r_list = r_val.tolist()
+    c_list = c_val.tolist()
+    typ_list = typ.tolist()
+    time_loop, score_1 = time_it(
+        lambda: score_loop(wht_list, r_list, c_list, typ_list),
+        repeat=repeat)
+    is_tor = typ == 't'
+    time_vec, score_2 = time_it(
+        lambda: compare.objective_function(wht, r_val, c_val, is_tor),
+        repeat=repeat)
+    logger.log(5, 'LOOP SCORE: {!r} NUMPY SCORE: {!r}'.format(
+            score_1, score_2))
+    return ('Score {} data'.format(num_data), time_loop, time_vec,
+            score_1 == score_2)
+
+def mass_weight_hessian_loop(hess, atoms):
+    """
+    `datatypes.mass_weight_hessian` as it was before it used NumPy
+    broadcasting.
+    """
+    masses = [co.MASSES[x.element] for x in atoms if not x.is_dummy]
+    changes = []
+    for mass in masses:
+        changes.extend([1 / np.sqrt(mass)] * 3)
+    x, y = hess.shape
+    for i in xrange(0, x):
+        for j in xrange(0, y):
+            hess[i, j] = \
+                hess[i, j] * changes[i] * changes[j]
+
+def mass_weight_eigenvectors_loop(evecs, atoms):
+    """
+    `datatypes.mass_weight_eigenvectors` as it was before it used NumPy
+    broadcasting.
+    """
+    changes = []
+    for atom in atoms:
+        if not atom.is_dummy:
+            changes.extend([np.sqrt(atom.exact_mass)] * 3)
+    x, y = evecs.shape
+    for i in xrange(0, x):
+        for j in xrange(0, y):
+            evecs[i, j] *= changes[j]
+
+def benchmark_mass_weight(num_atoms, repeat=5, seed=0):
+    """
+    Compares the loops against `datatypes.mass_weight_hessian` and
+    `datatypes.mass_weight_eigenvectors` for a random structure made of
+    common organic elements.
+
+    Each timed call works on a fresh copy of the matrix, since both
+    functions change it in place. The copy is included in both timings.
+
+    Returns
+    -------
+    list of tuples
+        See `benchmark_score`.
+    """
+    random = np.random.RandomState(seed)
+    atoms = [filetypes.Atom(element=x) for x in random.choice(
+            ['H', 'C', 'N', 'O', 'S', 'P'], size=num_atoms)]
+    hess = random.normal(size=(num_atoms * 3, num_atoms * 3))
+    hess += hess.T
+    evecs = random.normal(size=(num_atoms * 3, num_atoms * 3))
+    results = []
+    for name, loop, vec, matrix in [
+        ('Hess.', mass_weight_hessian_loop,
+         datatypes.mass_weight_hessian, hess),
+        ('evecs', mass_weight_eigenvectors_loop,
+         datatypes.mass_weight_eigenvectors, evecs)]:
+        def call(func):
+            new_matrix = matrix.copy()
+            func(new_matrix, atoms)
+            return new_matrix
+        time_loop, matrix_1 = time_it(lambda: call(loop), repeat=repeat)
+        time_vec, matrix_2 = time_it(lambda: call(vec), repeat=repeat)
+        results.append((
+                'Mass weight {} ({})'.format(name, num_atoms), time_loop,
+                time_vec, np.array_equal(matrix_1, matrix_2)))
+    return results
+
+def macromodel_hessian_loop(path):
+    """
+    `filetypes.MacroModelLog.hessian` as it was before it jumped to the
+    Hessian section, one word at a time.
+    """
+    with open(path, 'r') as f:
+        lines = f.read()
+    num_atoms = int(re.search('Read\s+(\d+)\s+atoms.', lines).group(1))
+    hessian = np.zeros([num_atoms * 3, num_atoms * 3], dtype=float)
+    words = lines.split()
+    section_hessian = False
+    start_row = False
+    start_col = False
+    for i, word in enumerate(words):
+        if word == 'Mass-weighted':
+            section_hessian = True
+            continue
+        if word == 'Eigenvalues:':
+            for col_num, element in zip(col_nums, elements):
+                hessian[row_num - 1, col_num - 1] = element
+            section_hessian = False
+            break
+        if section_hessian and start_col and word == 'Element':
+            for col_num, element in zip(col_nums, elements):
+                hessian[row_num - 1, col_num - 1] = element
+            start_col = False
+            start_row = True
+            row_num = int(words[i + 1])
+            col_nums = []
+            elements = []
+            continue
+        if section_hessian and word == 'Element':
+            row_num = int(words[i + 1])
+            col_nums = []
+            elements = []
+            start_row = True
+            continue
+        if section_hessian and start_row and word == ':':
+            start_row = False
+            start_col = True
+            continue
+        if section_hessian and start_col and '.' not in word and \
+                word != 'NaN':
+            col_nums.append(int(word))
+            continue
+        if section_hessian and start_col and '.' in word or \
+                word == 'NaN':
+            elements.append(float(word))
+            continue
+    return hessian
+
+def write_macromodel_log(path, num_atoms, seed=0):
+    """
+    Writes a MacroModel log with a random mass-weighted Hessian.
+
+    Rows hold the lower triangle, 4 column numbers and elements per line,
+    and one element is NaN.
+    """
+    random = np.random.RandomState(seed)
+    size = num_atoms * 3
+    with open(path, 'w') as f:
+        f.write(' Read {:6d} atoms.\n'.format(num_atoms))
+        f.write(' Energy =    -12.3456\n\n')
+        f.write(' Mass-weighted Hessian Matrix:\n')
+        for row in xrange(1, size + 1):
+            f.write(' Element {:5d} :\n'.format(row))
+            pairs = []
+            for col in xrange(1, row + 1):
+                if row == size and col == 1:
+                    element = 'NaN'
+                else:
+                    element = '{:.6f}'.format(random.normal(scale=10.))
+                pairs.append('{:5d} {:>12s}'.format(col, element))
+            for i in xrange(0, len(pairs), 4):
+                f.write('  ' + '  '.join(pairs[i:i+4]) + '\n')
+        f.write('\n Eigenvalues:\n')
+        f.write('  '.join('{:.4f}'.format(x) for x in range(size)) + '\n')
+
+def benchmark_macromodel_log(num_atoms, repeat=5, seed=0):
+    """
+    Compares `macromodel_hessian_loop` against
+    `filetypes.MacroModelLog.hessian` on a log written by
+    `write_macromodel_log`.
+
+    Returns
+    -------
+    tuple of (string, float, float, bool)
+        See `benchmark_score`. NaN elements count as the same.
+    """
+    direc = tempfile.mkdtemp()
+    try:
+        path = os.path.join(direc, 'benchmark.log')
+        write_macromodel_log(path, num_atoms, seed=seed)
+        time_loop, hess_1 = time_it(
+            lambda: macromodel_hessian_loop(path), repeat=repeat)
+        # A new object each time, because it keeps the Hessian once read.
+        time_vec, hess_2 = time_it(
+            lambda: filetypes.MacroModelLog(path).hessian, repeat=repeat)
+    finally:
+        shutil.rmtree(direc)
+    same = hess_1.shape == hess_2.shape and \
+        np.array_equal(np.isnan(hess_1), np.isnan(hess_2)) and \
+        np.array_equal(hess_1[~np.isnan(hess_1)], hess_2[~np.isnan(hess_2)])
+    return ('MM log Hessian ({})'.format(num_atoms), time_loop, time_vec,
+            same)
+
+def jacobian_loop(jacob, par_file):
+    """
+    Forms the Jacobian from a text differentiation file, the way
+    `gradient.return_jacobian` did before the binary files.
+    """
+    with open(par_file, 'r') as f:
+        f.readline() # Labels.
+        whts = map(float, f.readline().split(',')) # Weights.
+        f.readline() # Reference values.
+        f.readline() # Original values.
+        ff_ind = 0
+        while True:
+            l1 = f.readline()
+            l2 = f.readline()
+            if not l2:
+                break
+            inc_data = map(float, l1.split(','))
+            dec_data = map(float, l2.split(','))
+            for data_ind, (inc_datum, dec_datum) in \
+                    enumerate(izip(inc_data, dec_data)):
+                dydp = (inc_datum - dec_datum) / 2
+                jacob[data_ind, ff_ind] = whts[data_ind] * dydp
+            ff_ind += 1
+    return jacob
+
+def benchmark_jacobian(num_params, num_data, repeat=5, seed=0):
+    """
+    Compares `jacobian_loop` on a text differentiation file against
+    `gradient.read_par_file` and `gradient.return_jacobian` on the binary
+    file holding the same values.
+
+    Returns
+    -------
+    tuple of (string, float, float, bool)
+        See `benchmark_score`.
+    """
+    np.random.seed(seed)
+    ref_data = datatypes.DataSet(num_data)
+    ref_data.wht = np.random.uniform(0., 100., num_data)
+    ref_data.val = np.random.uniform(-180., 180., num_data)
+    ff_data = datatypes.DataSet(num_data)
+    ff_data.val = ref_data.val + np.random.normal(0., 1., num_data)
+    rows = ff_data.val + np.random.normal(0., 0.1, (2 * num_params, num_data))
+    direc = tempfile.mkdtemp()
+    try:
+        path_txt = os.path.join(direc, 'par_diff_001.txt')
+        with open(path_txt, 'w') as f:
+            csv_writer = csv.writer(f)
+            csv_writer.writerow(['x'] * num_data)
+            csv_writer.writerow(ref_data.wht.tolist())
+            csv_writer.writerow(ref_data.val.tolist())
+            csv_writer.writerow(ff_data.val.tolist())
+            for row in rows:
+                csv_writer.writerow(row.tolist())
+        path_npy = os.path.join(direc, 'par_diff_002.npy')
+        store = gradient.open_par_store(
+            path_npy, ref_data, ff_data, 2 * num_params)
+        for i, row in enumerate(rows):
+            store[gradient.PAR_STORE_HEADER_ROWS + i] = row
+        del store
+        time_loop, jacob_1 = time_it(
+            lambda: jacobian_loop(
+                np.empty((num_data, num_params), dtype=float), path_txt),
+            repeat=repeat)
+        time_vec, jacob_2 = time_it(
+            lambda: gradient.return_jacobian(
+                *gradient.read_par_file(path_npy)),
+            repeat=repeat)
+    finally:
+        shutil.rmtree(direc)
+    same = np.array_equal(jacob_1, jacob_2)
+    return ('Jacobian ({}, {})'.format(num_params, num_data), time_loop,
+            time_vec, same)
+
+def damped_changes_loop(ma, vb, factors):
+    """
+    Solves (A + factor * I) . x = b one factor at a time, the way
+    `gradient.do_lagrange` did before `gradient.return_damped_changes`.
+    """
+    all_changes = []
+    for factor in factors:
+        mac = copy.deepcopy(ma)
+        ind = np.diag_indices_from(mac)
+        mac[ind] = mac[ind] + factor
+        all_changes.append(gradient.solver(mac, vb))
+    return np.array(all_changes)
+
+def benchmark_damped(num_params, num_factors, repeat=5, seed=0):
+    """
+    Compares `damped_changes_loop` against `gradient.return_damped_changes`
+    for a random Jacobian with 10 times as many data points as parameters.
+
+    Returns
+    -------
+    tuple of (string, float, float, bool)
+        See `benchmark_score`. Changes that agree to within rounding count
+        as the same.
+    """
+    np.random.seed(seed)
+    jacob = np.random.normal(0., 1., (10 * num_params, num_params))
+    resid = np.random.normal(0., 1., (10 * num_params, 1))
+    ma = jacob.T.dot(jacob)
+    vb = jacob.T.dot(resid)
+    factors = np.logspace(-3, 2, num_factors).tolist()
+    time_loop, changes_1 = time_it(
+        lambda: damped_changes_loop(ma, vb, factors), repeat=repeat)
+    time_vec, changes_2 = time_it(
+        lambda: gradient.return_damped_changes(ma, vb, factors),
+        repeat=repeat)
+    same = changes_1.shape == changes_2.shape and \
+        np.allclose(changes_1, changes_2)
+    return ('Damped changes ({}, {})'.format(num_params, num_factors),
+            time_loop, time_vec, same)
+
+def svd_changes_loop(mu, vs, mvt, resid):
+    """
+    Makes the parameter changes for dropping 0, 1, 2, etc. of the smallest
+    singular values one truncation at a time, the way
+    `gradient.do_svd_wo_thresholds` did before `gradient.return_svd_changes`.
+    """
+    all_changes = []
+    msi = np.diag(gradient.invert_vector(vs))
+    all_changes.append(mvt.T.dot(msi.dot(mu.T.dot(resid))).flatten())
+    for i in xrange(0, len(vs) - 1):
+        old_msi = copy.deepcopy(msi)
+        msi[-(i + 1), -(i + 1)] = 0.
+        if np.allclose(msi, old_msi):
+            continue
+        all_changes.append(mvt.T.dot(msi.dot(mu.T.dot(resid))).flatten())
+    return np.array(all_changes)
+
+def benchmark_svd(num_params, num_data, repeat=5, seed=0):
+    """
+    Compares `svd_changes_loop` against `gradient.return_svd_changes` for a
+    random Jacobian.
+
+    Returns
+    -------
+    tuple of (string, float, float, bool)
+        See `benchmark_score`. Changes that agree to within rounding count
+        as the same, since the sums are done in a different order.
+    """
+    np.random.seed(seed)
+    jacob = np.random.normal(0., 1., (num_data, num_params))
+    resid = np.random.normal(0., 1., (num_data, 1))
+    mu, vs, mvt = gradient.return_svd(jacob)
+    vsi = gradient.invert_vector(vs)
+    num = len(vs)
+    keep = np.arange(num) < (num - np.arange(num))[:, np.newaxis]
+    time_loop, changes_1 = time_it(
+        lambda: svd_changes_loop(mu, vs, mvt, resid), repeat=repeat)
+    time_vec, changes_2 = time_it(
+        lambda: gradient.return_svd_changes(mu, vsi, mvt, resid, keep),
+        repeat=repeat)
+    same = changes_1.shape == changes_2.shape and \
+        np.allclose(changes_1, changes_2)
+    return ('SVD changes ({}, {})'.format(num_params, num_data), time_loop,
+            time_vec, same)
+
+def pretty_results(results):
+    """
+    Prints a table of benchmark results.
+
+    Arguments
+    ---------
+    results : list of tuples
+              See `benchmark_score`.
+    """
+    print('--' + ' Benchmark '.ljust(26, '-') +
+          '--' + ' Loop (s) '.center(12, '-') +
+          '--' + ' NumPy (s) '.center(12, '-') +
+          '--' + ' Speedup '.center(9, '-') +
+          '--' + ' Same '.center(6, '-') + '--')
+    for name, time_loop, time_vec, same in results:
+        print('  {:26s}  {:12.6f}  {:12.6f}  {:9.1f}  {:^6s}'.format(
+                name, time_loop, time_vec, time_loop / time_vec,
+                'yes' if same else 'NO'))
+    print('-' * 79)
+
+if __name__ == '__main__':
+    logging.config.dictConfig(co.LOG_SETTINGS)
+    main(sys.argv[1:])
@@ -24,6 +24,7 @@ import sys
 # chain.from_iterable flattens a list of lists similar to:
 #   [child for parent in grandparent for child in parent]
 # However, I think chain.from_iterable works on any number of nested lists.
+from collections import OrderedDict
 from itertools import chain, izip
 from textwrap import TextWrapper
 
@@ -57,6 +58,16 @@ COM_MACROMODEL = ['ja', 'jb', 'jt',
 COM_OTHER = ['r']
 # All possible commands.
 COM_ALL = COM_GAUSSIAN + COM_JAGUAR + COM_MACROMODEL + COM_OTHER
+# Filetypes that are only ever reference data. These aren't changed by
+# the optimization, so they're shared between calls using
+# filetypes.PARSE_CACHE.
+CACHED_FILETYPES = (filetypes.GaussFormChk, filetypes.GaussLog,
+                    filetypes.JaguarIn, filetypes.JaguarOut)
+
+# Evaluation plans made by `return_plan`, keyed by the arguments used to
+# make them. Least recently used first. Only the last MAX_PLANS are kept.
+_PLANS = OrderedDict()
+MAX_PLANS = 8
 
 def main(args):
     """
@@ -66,95 +77,278 @@ def main(args):
            Evaluated using parser returned by return_calculate_parser(). If
            it's a string, it will be converted into a list of strings.
     """
+    return return_plan(args).evaluate()
+
+def preload(args, processes=1):
+    """
+    Parses the reference files used by a set of calculate arguments in a
+    pool of processes, so that `main` finds them already parsed. See
+    `EvaluationPlan.preload`.
+
+    Arguments
+    ---------
+    args : string or list of strings
+           Arguments for `main`.
+    processes : int
+    """
+    return return_plan(args).preload(processes=processes)
+
+def return_plan(args):
+    """
+    Returns the `EvaluationPlan` for a set of calculate arguments.
+
+    The optimizers call `main` with the same arguments for every trial FF,
+    so plans are kept and reused. A plan is only made again if one of the
+    command files it wrote changed or is gone, or if one of its .mae files
+    changed. Only the `MAX_PLANS` most recently used plans are kept.
+
+    Arguments
+    ---------
+    args : string or list of strings
+           Arguments for `main`.
+    """
     # Should be a list of strings for use by argparse. Ensure that's the case.
     if isinstance(args, basestring):
-        args.split()
-    parser = return_calculate_parser()
-    opts = parser.parse_args(args)
-    # This makes a dictionary that only contains the arguments related to
-    # extracting data from everything in the argparse dictionary, opts.
-    # commands looks like:
-    # {'me': [['a1.01.mae', 'a2.01.mae', 'a3.01.mae'], 
-    #         ['b1.01.mae', 'b2.01.mae']],
-    #  'mb': [['a1.01.mae'], ['b1.01.mae']],
-    #  'jeig': [['a1.01.in,a1.out', 'b1.01.in,b1.out']]
-    # }
-    commands = {key: value for key, value in opts.__dict__.iteritems() if key
-                in COM_ALL and value}
-    # Add in the empty commands. I'd rather not do this, but it makes later
-    # coding when collecting data easier.
-    for command in COM_ALL:
-        if command not in commands:
-            commands.update({command: []})
-    pretty_all_commands(commands)
-    # This groups all of the data type commands associated with one file.
-    # commands_for_filenames looks like:
-    # {'a1.01.mae': ['me', 'mb'],
-    #  'a1.01.in': ['jeig'],
-    #  'a1.out': ['jeig'],
-    #  'a2.01.mae': ['me'],
-    #  'a3.01.mae': ['me'],
-    #  'b1.01.mae': ['me', 'mb'],
-    #  'b1.01.in': ['jeig'],
-    #  'b1.out': ['jeig'],
-    #  'b2.01.mae': ['me']
-    # }
-    commands_for_filenames = sort_commands_by_filename(commands)
-    pretty_commands_for_files(commands_for_filenames)
-    # This dictionary associates the filename that the user supplied with
-    # the command file that has to be used to execute some backend software
-    # calculate in order to retrieve the data that the user requested.
-    # inps looks like:
-    # {'a1.01.mae': <__main__.Mae object at 0x1110e10>,
-    #  'a1.01.in': None,
-    #  'a1.out': None,
-    #  'a2.01.mae': <__main__.Mae object at 0x1733b23>,
-    #  'a3.01.mae': <__main__.Mae object at 0x1853e12>,
-    #  'b1.01.mae': <__main__.Mae object at 0x2540e10>,
-    #  'b1.01.in': None,
-    #  'b1.out': None,
-    #  'b2.01.mae': <__main__.Mae object at 0x1353e11>,
-    # }
-    inps = {}
-    # This generates any of the necessary command files. It uses
-    # commands_for_filenames, which contains all of the data types associated
-    # with the given file.
-    for filename, commands_for_filename in commands_for_filenames.iteritems():
-        # These next two if statements will break down what command files
-        # have to be written by the backend software package.
-        if any(x in COM_MACROMODEL for x in commands_for_filename):
-            if os.path.splitext(filename)[1] == '.mae':
-                inps[filename] = filetypes.Mae(
-                    os.path.join(opts.directory, filename))
-                inps[filename].commands = commands_for_filename
-                inps[filename].write_com(sometext=opts.append)
-        # In this case, no command files have to be written.
-        else:
-            inps[filename] = None
-    # Check whether or not to skip calculations.
-    if opts.norun:
-        logger.log(15, "  -- Skipping backend calculations.")
+        args = args.split()
+    key = tuple(args)
+    plan = _PLANS.pop(key, None)
+    if plan is None or not plan.is_current():
+        plan = EvaluationPlan(args)
     else:
-        for filename, some_class in inps.iteritems():
-            # Works if some class is None too.
-            if hasattr(some_class, 'run'):
-                # Ideally this can be the same for each software backend,
-                # but that means we're going to have to make some changes
-                # so that this token argument is handled properly.
-                some_class.run(check_tokens=opts.check)
-    # This is a list comprised of datatypes.Datum objects.
-    # If we remove/with sorting removed, the Datum class is less
-    # useful. We may want to reduce this to a N x 3 matrix or
-    # 3 vectors (labels, weights, values).
-    data = collect_data(commands, inps, direc=opts.directory,
-                        invert=opts.invert)
-    # Adds weights to the data points in the data list.
-    if opts.weight:
-        compare.import_weights(data)
-    # Optional printing or logging of data.
-    if opts.doprint:
-        pretty_data(data, log_level=None)
-    return data
+        logger.log(5, '  -- Reusing evaluation plan.')
+    _PLANS[key] = plan
+    while len(_PLANS) > MAX_PLANS:
+        _PLANS.popitem(last=False)
+    return plan
+
+class EvaluationPlan(object):
+    """
+    Everything `main` works out from its arguments before running the
+    backend software: the parsed options, the commands for each file and
+    the command files (ex. MacroModel .com files).
+
+    Making the plan writes the command files. After that, each call to
+    `evaluate` only runs the backend and extracts the data.
+
+    Arguments
+    ---------
+    args : list of strings
+           Evaluated using parser returned by return_calculate_parser().
+
+    Attributes
+    ----------
+    opts : argparse.Namespace
+    commands : dict
+    commands_for_filenames : dict
+    inps : dict
+    stamps : dict
+             Modification time and size of each .mae file when the plan was
+             made.
+    """
+    def __init__(self, args):
+        parser = return_calculate_parser()
+        self.opts = opts = parser.parse_args(args)
+        if opts.cache:
+            filetypes.use_disk_cache(opts.cache)
+        # This makes a dictionary that only contains the arguments related to
+        # extracting data from everything in the argparse dictionary, opts.
+        # commands looks like:
+        # {'me': [['a1.01.mae', 'a2.01.mae', 'a3.01.mae'], 
+        #         ['b1.01.mae', 'b2.01.mae']],
+        #  'mb': [['a1.01.mae'], ['b1.01.mae']],
+        #  'jeig': [['a1.01.in,a1.out', 'b1.01.in,b1.out']]
+        # }
+        commands = {key: value for key, value in opts.__dict__.iteritems()
+                    if key in COM_ALL and value}
+        # Add in the empty commands. I'd rather not do this, but it makes later
+        # coding when collecting data easier.
+        for command in COM_ALL:
+            if command not in commands:
+                commands.update({command: []})
+        pretty_all_commands(commands)
+        self.commands = commands
+        # This groups all of the data type commands associated with one file.
+        # commands_for_filenames looks like:
+        # {'a1.01.mae': ['me', 'mb'],
+        #  'a1.01.in': ['jeig'],
+        #  'a1.out': ['jeig'],
+        #  'a2.01.mae': ['me'],
+        #  'a3.01.mae': ['me'],
+        #  'b1.01.mae': ['me', 'mb'],
+        #  'b1.01.in': ['jeig'],
+        #  'b1.out': ['jeig'],
+        #  'b2.01.mae': ['me']
+        # }
+        commands_for_filenames = sort_commands_by_filename(commands)
+        pretty_commands_for_files(commands_for_filenames)
+        self.commands_for_filenames = commands_for_filenames
+        # This dictionary associates the filename that the user supplied with
+        # the command file that has to be used to execute some backend
+        # software calculate in order to retrieve the data that the user
+        # requested.
+        # inps looks like:
+        # {'a1.01.mae': <__main__.Mae object at 0x1110e10>,
+        #  'a1.01.in': None,
+        #  'a1.out': None,
+        #  'a2.01.mae': <__main__.Mae object at 0x1733b23>,
+        #  'a3.01.mae': <__main__.Mae object at 0x1853e12>,
+        #  'b1.01.mae': <__main__.Mae object at 0x2540e10>,
+        #  'b1.01.in': None,
+        #  'b1.out': None,
+        #  'b2.01.mae': <__main__.Mae object at 0x1353e11>,
+        # }
+        inps = {}
+        self.stamps = {}
+        # Contents of each command file the plan wrote. The name of a
+        # command file only depends on its .mae, so another plan using the
+        # same .mae with other commands writes over it.
+        self.coms = {}
+        # This generates any of the necessary command files. It uses
+        # commands_for_filenames, which contains all of the data types
+        # associated with the given file.
+        for filename, commands_for_filename in \
+                commands_for_filenames.iteritems():
+            # These next two if statements will break down what command files
+            # have to be written by the backend software package.
+            if any(x in COM_MACROMODEL for x in commands_for_filename):
+                if os.path.splitext(filename)[1] == '.mae':
+                    inps[filename] = filetypes.Mae(
+                        os.path.join(opts.directory, filename))
+                    inps[filename].commands = commands_for_filename
+                    inps[filename].write_com(sometext=opts.append)
+                    self.stamps[inps[filename].path] = \
+                        datatypes.return_stamp(inps[filename].path)
+                    path_com = os.path.join(
+                        inps[filename].directory, inps[filename].name_com)
+                    with open(path_com, 'r') as f:
+                        self.coms[path_com] = f.read()
+            # In this case, no command files have to be written.
+            else:
+                inps[filename] = None
+        self.inps = inps
+    def preload(self, processes=1):
+        """
+        Parses the reference files given to the commands in a pool of
+        processes. The parsed objects go into filetypes.PARSE_CACHE, where
+        `check_outs` finds them during `evaluate`.
+
+        Only the files described by each command's `Extractor.preload` are
+        parsed. The data is still extracted in one process and in the usual
+        order, so it's the same as without preloading.
+
+        Returns
+        -------
+        int
+            Number of files parsed.
+        """
+        # Keys are (path, classtype). Values are the attributes to read.
+        jobs = OrderedDict()
+        for extractor in EXTRACTORS.itervalues():
+            if not extractor.preload:
+                continue
+            filenames = chain.from_iterable(self.commands[extractor.command])
+            for comma_sep_filenames in filenames:
+                for filename, spec in izip(
+                        comma_sep_filenames.split(','), extractor.preload):
+                    if spec is None:
+                        continue
+                    classtype, attrs = spec
+                    path = os.path.join(self.opts.directory, filename)
+                    jobs.setdefault((path, classtype), set()).update(attrs)
+        return filetypes.parse_files(
+            [(path, classtype, sorted(attrs))
+             for (path, classtype), attrs in jobs.iteritems()],
+            processes=processes)
+    def is_current(self):
+        """
+        Returns False if a command file written by the plan changed or is
+        gone, or if a .mae file changed since the plan was made.
+        """
+        for path, stamp in self.stamps.iteritems():
+            if datatypes.return_stamp(path) != stamp:
+                return False
+        for path, com in self.coms.iteritems():
+            try:
+                with open(path, 'r') as f:
+                    if f.read() != com:
+                        return False
+            except IOError:
+                return False
+        return True
+    def evaluate(self):
+        """
+        Runs the backend calculations and collects the data.
+
+        Returns
+        -------
+        `datatypes.DataSet`
+        """
+        opts = self.opts
+        inps = self.inps
+        # Check whether or not to skip calculations.
+        if opts.norun:
+            logger.log(15, "  -- Skipping backend calculations.")
+        elif opts.jobs > 1:
+            # Launches the MacroModel jobs at the same time. Returns once all
+            # of them are done, so collect_data is safe to read the output.
+            filetypes.run_pool(
+                [x for x in inps.itervalues() if hasattr(x, 'run')],
+                jobs=opts.jobs, check_tokens=opts.check)
+        else:
+            for filename, some_class in inps.iteritems():
+                # Works if some class is None too.
+                if hasattr(some_class, 'run'):
+                    # Ideally this can be the same for each software backend,
+                    # but that means we're going to have to make some changes
+                    # so that this token argument is handled properly.
+                    some_class.run(check_tokens=opts.check)
+        # This is a datatypes.DataSet, which stores the values, weights,
+        # labels, etc. of every data point as NumPy arrays.
+        data = collect_data(self.commands, inps, direc=opts.directory,
+                            invert=opts.invert)
+        # Adds weights to the data points in the data list.
+        if opts.weight:
+            compare.import_weights(data)
+        # Optional printing or logging of data.
+        if opts.doprint:
+            pretty_data(data, log_level=None)
+        return data
+
+def return_directory(args):
+    """
+    Returns the directory used by a set of calculate arguments.
+
+    Arguments
+    ---------
+    args : list of strings
+           Arguments for `main`.
+    """
+    opts = return_calculate_parser().parse_args(args)
+    return opts.directory
+
+def replace_directory(args, direc):
+    """
+    Returns a copy of the calculate arguments with the directory option
+    changed to `direc`. Adds the directory option if it's missing.
+
+    Arguments
+    ---------
+    args : list of strings
+           Arguments for `main`.
+    direc : string
+    """
+    if isinstance(args, basestring):
+        args = args.split()
+    new_args = list(args)
+    for i, arg in enumerate(new_args):
+        if arg in ['-d', '--directory']:
+            new_args[i + 1] = direc
+            return new_args
+        if arg.startswith('--directory='):
+            new_args[i] = '--directory={}'.format(direc)
+            return new_args
+    new_args.extend(['-d', direc])
+    return new_args
 
 def return_calculate_parser(add_help=True, parents=None):
     '''
@@ -185,6 +379,11 @@ def return_calculate_parser(add_help=True, parents=None):
     opts.add_argument(
         '--append', '-a', type=str, metavar='sometext',
         help='Append this text to command files generated by Q2MM.')
+    opts.add_argument(
+        '--cache', type=str, metavar='somepath',
+        help=('Save data read from Gaussian and Jaguar files in this '
+              'directory. Later runs load it from here instead of reading '
+              'those files again, as long as the files are unchanged.'))
     opts.add_argument(
         '--directory', '-d', type=str, metavar='somepath', default=os.getcwd(),
         help=('Directory searched for files '
@@ -203,6 +402,11 @@ def return_calculate_parser(add_help=True, parents=None):
         help=("This option will invert the smallest eigenvalue to be whatever "
               "value is specified by this argument whenever a Hessian is "
               "read."))
+    opts.add_argument(
+        '--jobs', type=int, metavar='N', default=1,
+        help=('Run up to N MacroModel calculations at the same time. The '
+              'number of jobs is reduced if there are not enough Schrodinger '
+              'tokens available. Default is 1.'))
     opts.add_argument(
         '--nocheck', '-nc', action='store_false', dest='check', default=True,
         help=("By default, Q2MM checks whether MacroModel tokens are "
@@ -387,12 +591,18 @@ def check_outs(filename, outs, classtype, direc):
     Reads a file if necessary. Checks the output dictionary first in
     case the file has already been loaded.
 
+    Reference filetypes (see CACHED_FILETYPES) also go through
+    filetypes.PARSE_CACHE, so they're only read again if they change.
+
     Could work on easing the use of this by somehow reducing number of
     arguments required.
     """
     if filename not in outs:
-        outs[filename] = \
-            classtype(os.path.join(direc, filename))
+        path = os.path.join(direc, filename)
+        if issubclass(classtype, CACHED_FILETYPES):
+            outs[filename] = filetypes.PARSE_CACHE.get(path, classtype)
+        else:
+            outs[filename] = classtype(path)
     return outs[filename]
 
 def collect_reference(path):
@@ -422,36 +632,70 @@ def collect_reference(path):
             lbl, wht, val = cols
             datum = datatypes.Datum(lbl=lbl, wht=float(wht), val=float(val))
             data.append(datum)
-    return np.array(data)
+    return datatypes.DataSet.from_data(data)
 
 # Must be rewritten to go in a particular order of data types every time.
 def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
     """
+    Collects the data for every command given.
+
+    Each command has an `Extractor` in `EXTRACTORS`. Only the commands that
+    have filenames are run, and their data is joined in the order of
+    `EXTRACTORS`, so the layout of the data never depends on the order the
+    commands were given in.
+
     Arguments
     ---------
+    coms : dict
+           Keys are commands and values are lists of lists of filenames.
+    inps : dict
+    direc : string
+    sub_names : list of strings
     invert : None or float
              If given, will modify the smallest value of the Hessian to
              this value.
+
+    Returns
+    -------
+    `datatypes.DataSet`
     """
     # outs looks like:
     # {'filename1': <some class for filename1>,
     #  'filename2': <some class for filename2>,
     #  'filename3': <some class for filename3>
     # }
+    # Shared by the extractors, which run one after another. The file
+    # objects parse lazily and aren't safe to read from many threads, and
+    # the extractors are mostly bound by the GIL anyway.
     outs = {}
-    # List of Datum objects.
+    results = [x.func(coms[x.command], inps, outs, direc, sub_names, invert)
+               for x in EXTRACTORS.itervalues() if coms.get(x.command)]
+    data = datatypes.DataSet.concatenate(
+        [x if isinstance(x, datatypes.DataSet)
+         else datatypes.DataSet.from_data(x) for x in results])
+    logger.log(15, 'TOTAL DATA POINTS: {}'.format(len(data)))
+    return data
+
+def collect_r(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Reference data text files.
+    """
     data = []
-    # REFERENCE DATA TEXT FILES
     # No grouping is necessary for this data type, so flatten the list of
     # lists.
-    filenames = chain.from_iterable(coms['r'])
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         # Unlike most datatypes, these Datum only get the attributes _lbl,
         # val and wht. This is to ensure that making and working with these
         # reference text files isn't too cumbersome.
-        data.extend(collect_reference(os.path.join(direc, filename)))
-    # JAGUAR ENERGIES
-    filenames_s = coms['je']
+        data.append(collect_reference(os.path.join(direc, filename)))
+    return datatypes.DataSet.concatenate(data)
+
+def collect_je(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar energies.
+    """
+    data = []
     # idx_1 is the number used to group sets of relative energies.
     for idx_1, filenames in enumerate(filenames_s):
         temp = []
@@ -477,9 +721,14 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         for datum in temp:
             datum.val -= zero
         data.extend(temp)
-    # GAUSSIAN ENERGIES
-    filename_s = coms['ge']
-    for idx_1, filenames in enumerate(filename_s):
+    return data
+
+def collect_ge(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Gaussian energies.
+    """
+    data = []
+    for idx_1, filenames in enumerate(filenames_s):
         temp = []
         for filename in filenames:
             log = check_outs(filename, outs, filetypes.GaussLog, direc)
@@ -596,8 +845,13 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         for datum in temp:
             datum.val -= zero
         data.extend(temp)
-    # MACROMODEL ENERGIES
-    filenames_s = coms['me']
+    return data
+
+def collect_me(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel energies.
+    """
+    data = []
     ind = 'pre'
     for idx_1, filenames in enumerate(filenames_s):
         for filename in filenames:
@@ -616,8 +870,13 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
                         src_1=inps[filename].name_mae,
                         idx_1=idx_1 + 1,
                         idx_2=idx_2 + 1))
-    # JAGUAR AVERAGE ENERGIES
-    filenames_s = coms['jea']
+    return data
+
+def collect_jea(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar average energies.
+    """
+    data = []
     # idx_1 is the number used to group sets of relative energies.
     for idx_1, filenames in enumerate(filenames_s):
         temp = []
@@ -643,9 +902,14 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         for datum in temp:
             datum.val -= avg
         data.extend(temp)
-    # GAUSSIAN AVERAGE ENERGIES
-    filename_s = coms['gea']
-    for idx_1, filenames in enumerate(filename_s):
+    return data
+
+def collect_gea(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Gaussian average energies.
+    """
+    data = []
+    for idx_1, filenames in enumerate(filenames_s):
         temp = []
         for filename in filenames:
             log = check_outs(filename, outs, filetypes.GaussLog, direc)
@@ -675,8 +939,13 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         for datum in temp:
             datum.val -= avg
         data.extend(temp)
-    # MACROMODEL AVERAGE ENERGIES
-    filenames_s = coms['mea']
+    return data
+
+def collect_mea(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel average energies.
+    """
+    data = []
     ind = 'pre'
     # idx_1 is the number used to group sets of relative energies.
     for idx_1, filenames in enumerate(filenames_s):
@@ -701,8 +970,13 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         for datum in temp:
             datum.val -= avg
         data.extend(temp)
-    # JAGUAR ENERGIES COMPARED TO OPTIMIZED MM
-    filenames_s = coms['jeo']
+    return data
+
+def collect_jeo(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar energies compared to optimized MM.
+    """
+    data = []
     # idx_1 is the number used to group sets of relative energies.
     for idx_1, filenames in enumerate(filenames_s):
         temp = []
@@ -728,9 +1002,14 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         for datum in temp:
             datum.val -= zero
         data.extend(temp)
-    # GAUSSIAN ENERGIES RELATIVE TO OPTIMIZED MM
-    filename_s = coms['geo']
-    for idx_1, filenames in enumerate(filename_s):
+    return data
+
+def collect_geo(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Gaussian energies relative to optimized MM.
+    """
+    data = []
+    for idx_1, filenames in enumerate(filenames_s):
         temp = []
         for filename in filenames:
             log = check_outs(filename, outs, filetypes.GaussLog, direc)
@@ -759,8 +1038,13 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         for datum in temp:
             datum.val -= zero
         data.extend(temp)
-    # MACROMODEL OPTIMIZED ENERGIES
-    filenames_s = coms['meo']    
+    return data
+
+def collect_meo(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel optimized energies.
+    """
+    data = []
     ind = 'opt'
     for idx_1, filenames in enumerate(filenames_s):
         for filename in filenames:
@@ -777,8 +1061,13 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
                         src_1=inps[filename].name_mae,
                         idx_1=idx_1 + 1,
                         idx_2=idx_2 + 1))
-    # JAGUAR ENERGIES RELATIVE TO AVERAGE COMPARED TO OPTIMIZED MM
-    filenames_s = coms['jeao']
+    return data
+
+def collect_jeao(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar energies relative to average compared to optimized MM.
+    """
+    data = []
     # idx_1 is the number used to group sets of relative energies.
     for idx_1, filenames in enumerate(filenames_s):
         temp = []
@@ -803,9 +1092,14 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         for datum in temp:
             datum.val -= avg
         data.extend(temp)
-    # GAUSSIAN AVERAGE ENERGIES RELATIVE TO OPTIMIZED MM
-    filename_s = coms['geao']
-    for idx_1, filenames in enumerate(filename_s):
+    return data
+
+def collect_geao(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Gaussian average energies relative to optimized MM.
+    """
+    data = []
+    for idx_1, filenames in enumerate(filenames_s):
         temp = []
         for filename in filenames:
             log = check_outs(filename, outs, filetypes.GaussLog, direc)
@@ -834,8 +1128,13 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         for datum in temp:
             datum.val -= avg
         data.extend(temp)
-    # MACROMODEL OPTIMIZED ENERGIES RELATIVE TO AVERAGE
-    filenames_s = coms['meao']
+    return data
+
+def collect_meao(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel optimized energies relative to average.
+    """
+    data = []
     ind = 'opt'
     for idx_1, filenames in enumerate(filenames_s):
         temp = []
@@ -857,38 +1156,80 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         for datum in temp:
             datum.val -= avg
         data.extend(temp)
-    # JAGUAR BONDS
-    filenames = chain.from_iterable(coms['jb'])
+    return data
+
+def collect_jb(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar bonds.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         data.extend(collect_structural_data_from_mae(
                 filename, inps, outs, direc, sub_names, 'jb', 'pre', 'bonds'))
-    # MACROMODEL BONDS
-    filenames = chain.from_iterable(coms['mb'])
+    return data
+
+def collect_mb(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel bonds.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         data.extend(collect_structural_data_from_mae(
                 filename, inps, outs, direc, sub_names, 'mb', 'opt', 'bonds'))
-    # JAGUAR ANGLES
-    filenames = chain.from_iterable(coms['ja'])
+    return data
+
+def collect_ja(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar angles.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         data.extend(collect_structural_data_from_mae(
                 filename, inps, outs, direc, sub_names, 'ja', 'pre', 'angles'))
-    # MACROMODEL BONDS
-    filenames = chain.from_iterable(coms['ma'])
+    return data
+
+def collect_ma(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel angles.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         data.extend(collect_structural_data_from_mae(
                 filename, inps, outs, direc, sub_names, 'ma', 'opt', 'angles'))
-    # JAGUAR BONDS
-    filenames = chain.from_iterable(coms['jt'])
+    return data
+
+def collect_jt(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar torsions.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         data.extend(collect_structural_data_from_mae(
                 filename, inps, outs, direc, sub_names, 'jt', 'pre', 'torsions'))
-    # MACROMODEL BONDS
-    filenames = chain.from_iterable(coms['mt'])
+    return data
+
+def collect_mt(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel torsions.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         data.extend(collect_structural_data_from_mae(
                 filename, inps, outs, direc, sub_names, 'mt', 'opt', 'torsions'))
-    # JAGUAR CHARGES
-    filenames = chain.from_iterable(coms['jq'])
+    return data
+
+def collect_jq(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar charges.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         mae = check_outs(filename, outs, filetypes.Mae, direc)
         for idx_1, structure in enumerate(mae.structures):
@@ -906,8 +1247,14 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
                             src_1=filename,
                             idx_1=idx_1 + 1,
                             atm_1=atom.index))
-    # MACROMODEL CHARGES
-    filenames = chain.from_iterable(coms['mq'])
+    return data
+
+def collect_mq(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel charges.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         name_mae = inps[filename].name_mae
         mae = check_outs(name_mae, outs, filetypes.Mae, direc)
@@ -927,8 +1274,14 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
                             src_1=filename,
                             idx_1=idx_1 + 1,
                             atm_1=atom.index))
-    # JAGUAR CHARGES EXCLUDING ALIPHATIC HYDROGENS
-    filenames = chain.from_iterable(coms['jqh'])
+    return data
+
+def collect_jqh(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar charges excluding aliphatic hydrogens.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         mae = check_outs(filename, outs, filetypes.Mae, direc)
         for idx_1, structure in enumerate(mae.structures):
@@ -948,8 +1301,14 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
                             src_1=filename,
                             idx_1=idx_1 + 1,
                             atm_1=atom.index))
-    # MACROMODEL CHARGES EXCLUDING ALIPHATIC HYDROGENS
-    filenames = chain.from_iterable(coms['mqh'])
+    return data
+
+def collect_mqh(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel charges excluding aliphatic hydrogens.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         name_mae = inps[filename].name_mae
         mae = check_outs(name_mae, outs, filetypes.Mae, direc)
@@ -971,8 +1330,14 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
                             src_1=filename,
                             idx_1=idx_1 + 1,
                             atm_1=atom.index))
-    # JAGUAR CHARGES EXCLUDING ALL SINGLE BONDED HYDROGENS
-    filenames = chain.from_iterable(coms['jqa'])
+    return data
+
+def collect_jqa(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar charges excluding all single bonded hydrogens.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         mae = check_outs(filename, outs, filetypes.Mae, direc)
         for idx_1, structure in enumerate(mae.structures):
@@ -997,8 +1362,14 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
                             src_1=filename,
                             idx_1=idx_1 + 1,
                             atm_1=atom.index))
-    # MACROMODEL CHARGES EXCLUDING ALL SINGLE BONDED HYDROGENS
-    filenames = chain.from_iterable(coms['mqa'])
+    return data
+
+def collect_mqa(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel charges excluding all single bonded hydrogens.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         name_mae = inps[filename].name_mae
         mae = check_outs(name_mae, outs, filetypes.Mae, direc)
@@ -1026,33 +1397,36 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
                             src_1=filename,
                             idx_1=idx_1 + 1,
                             atm_1=atom.index))
-    # JAGUAR HESSIAN
-    filenames = chain.from_iterable(coms['jh'])
+    return data
+
+def collect_jh(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar Hessian.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         jin = check_outs(filename, outs, filetypes.JaguarIn, direc)
-        hess = jin.hessian
+        # Copy since the parsed file may be used again.
+        hess = jin.hessian.copy()
         datatypes.mass_weight_hessian(hess, jin.structures[0].atoms)
         if invert:
             evals, evecs = np.linalg.eigh(hess)
             datatypes.replace_minimum(evals, value=invert)
             hess = evecs.dot(np.diag(evals).dot(evecs.T))
         datatypes.replace_minimum(hess, value=invert)
-        low_tri_idx = np.tril_indices_from(hess)
-        low_tri = hess[low_tri_idx]
-        data.extend([datatypes.Datum(
-                    val=e,
-                    com='jh',
-                    typ='h',
-                    src_1=jin.filename,
-                    idx_1=x + 1,
-                    idx_2=y + 1)
-                     for e, x, y in izip(
-                    low_tri, low_tri_idx[0], low_tri_idx[1])])
-    # GAUSSIAN HESSIAN
-    filenames = chain.from_iterable(coms['gh'])
+        data.append(return_matrix_data(
+                hess, com='jh', typ='h', src_1=jin.filename))
+    return datatypes.DataSet.concatenate(data)
+
+def collect_gh(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Gaussian Hessian.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         log = check_outs(filename, outs, filetypes.GaussLog, direc)
-        log.read_archive()
         # For now, the Hessian is stored on the structures inside the filetype.
         hess = log.structures[0].hess
         if invert:
@@ -1065,19 +1439,16 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
             hess = evecs.dot(np.diag(evals).dot(evecs.T))
         # Oh crap, just realized this probably needs to be mass weighted.
         # WARNING: This option may need to be mass weighted!
-        low_tri_idx = np.tril_indices_from(hess)
-        low_tri = hess[low_tri_idx]
-        data.extend([datatypes.Datum(
-                    val=e,
-                    com='gh',
-                    typ='h',
-                    src_1=log.filename,
-                    idx_1=x + 1,
-                    idx_2=y + 1)
-                     for e, x, y in izip(
-                    low_tri, low_tri_idx[0], low_tri_idx[1])])
-    # MACROMODEL HESSIAN
-    filenames = chain.from_iterable(coms['mh'])
+        data.append(return_matrix_data(
+                hess, com='gh', typ='h', src_1=log.filename))
+    return datatypes.DataSet.concatenate(data)
+
+def collect_mh(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel Hessian.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         # Get the .log for the .mae.
         name_log = inps[filename].name_log
@@ -1089,25 +1460,23 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         dummies = mae.structures[0].get_dummy_atom_indices()
         hess_dummies = datatypes.get_dummy_hessian_indices(dummies)
         hess = datatypes.check_mm_dummy(hess, hess_dummies)
-        low_tri_idx = np.tril_indices_from(hess)
-        low_tri = hess[low_tri_idx]
-        data.extend([datatypes.Datum(
-                    val=e,
-                    com='mh',
-                    typ='h',
-                    src_1=mae.filename,
-                    idx_1=x + 1,
-                    idx_2=y + 1)
-                     for e, x, y in izip(
-                    low_tri, low_tri_idx[0], low_tri_idx[1])])
-    # JAGUAR EIGENMATRIX
-    filenames = chain.from_iterable(coms['jeigz'])
+        data.append(return_matrix_data(
+                hess, com='mh', typ='h', src_1=mae.filename))
+    return datatypes.DataSet.concatenate(data)
+
+def collect_jeigz(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Jaguar eigenmatrix.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for comma_sep_filenames in filenames:
         name_in, name_out = comma_sep_filenames.split(',')
         jin = check_outs(name_in, outs, filetypes.JaguarIn, direc)
         out = check_outs(name_out, outs, filetypes.JaguarOut, direc)
-        hess = jin.hessian
-        evec = out.eigenvectors
+        # Copy since the parsed files may be used again.
+        hess = jin.hessian.copy()
+        evec = out.eigenvectors.copy()
         datatypes.mass_weight_hessian(hess, jin.structures[0].atoms)
         datatypes.mass_weight_eigenvectors(evec, out.structures[0].atoms)
         try:
@@ -1129,20 +1498,17 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
             datatypes.replace_minimum(eigenmatrix, value=invert)
         # Turn back into a full matrix.
         eigenmatrix = np.diag(eigenmatrix)
-        low_tri_idx = np.tril_indices_from(eigenmatrix)
-        low_tri = eigenmatrix[low_tri_idx]
-        data.extend([datatypes.Datum(
-                    val=e,
-                    com='jeigz',
-                    typ='eig',
-                    src_1=jin.filename,
-                    src_2=out.filename,
-                    idx_1=x + 1,
-                    idx_2=y + 1)
-                     for e, x, y in izip(
-                    low_tri, low_tri_idx[0], low_tri_idx[1])])
-    # GAUSSIAN EIGENMATRIX
-    filenames = chain.from_iterable(coms['geigz'])
+        data.append(return_matrix_data(
+                eigenmatrix, com='jeigz', typ='eig', src_1=jin.filename,
+                src_2=out.filename))
+    return datatypes.DataSet.concatenate(data)
+
+def collect_geigz(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    Gaussian eigenmatrix.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for filename in filenames:
         log = check_outs(filename, outs, filetypes.GaussLog, direc)
         evals = log.evals * co.HESSIAN_CONVERSION
@@ -1150,19 +1516,16 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         if invert:
             datatypes.replace_minimum(evals, value=invert)
         eigenmatrix = np.diag(evals)
-        low_tri_idx = np.tril_indices_from(eigenmatrix)
-        low_tri = eigenmatrix[low_tri_idx]
-        data.extend([datatypes.Datum(
-                    val=e,
-                    com='geigz',
-                    typ='eig',
-                    src_1=log.filename,
-                    idx_1=x + 1,
-                    idx_2=y + 1)
-                     for e, x, y in izip(
-                    low_tri, low_tri_idx[0], low_tri_idx[1])])
-    # MACROMODEL EIGENMATRIX USING JAGUAR EIGENVECTORS
-    filenames = chain.from_iterable(coms['mjeig'])
+        data.append(return_matrix_data(
+                eigenmatrix, com='geigz', typ='eig', src_1=log.filename))
+    return datatypes.DataSet.concatenate(data)
+
+def collect_mjeig(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel eigenmatrix using Jaguar eigenvectors.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for comma_sep_filenames in filenames:
         name_mae, name_out = comma_sep_filenames.split(',')
         name_log = inps[name_mae].name_log
@@ -1173,7 +1536,7 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
         dummies = mae.structures[0].get_dummy_atom_indices()
         hess_dummies = datatypes.get_dummy_hessian_indices(dummies)
         hess = datatypes.check_mm_dummy(hess, hess_dummies)
-        evec = out.eigenvectors
+        evec = out.eigenvectors.copy()
         datatypes.mass_weight_eigenvectors(evec, out.structures[0].atoms)
         try:
             eigenmatrix = np.dot(np.dot(evec, hess), evec.T)
@@ -1184,20 +1547,17 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
             logger.warning('Eigenvectors retrieved from {}: {}'.format(
                     name_out, evec.shape))
             raise
-        low_tri_idx = np.tril_indices_from(eigenmatrix)
-        low_tri = eigenmatrix[low_tri_idx]
-        data.extend([datatypes.Datum(
-                    val=e,
-                    com='mjeig',
-                    typ='eig',
-                    src_1=mae.filename,
-                    src_2=out.filename,
-                    idx_1=x + 1,
-                    idx_2=y + 1)
-                     for e, x, y in izip(
-                    low_tri, low_tri_idx[0], low_tri_idx[1])])
-    # MACROMODEL EIGENMATRIX USING GAUSSIAN EIGENVECTORS
-    filenames = chain.from_iterable(coms['mgeig'])
+        data.append(return_matrix_data(
+                eigenmatrix, com='mjeig', typ='eig', src_1=mae.filename,
+                src_2=out.filename))
+    return datatypes.DataSet.concatenate(data)
+
+def collect_mgeig(filenames_s, inps, outs, direc, sub_names, invert):
+    """
+    MacroModel eigenmatrix using Gaussian eigenvectors.
+    """
+    data = []
+    filenames = chain.from_iterable(filenames_s)
     for comma_filenames in filenames:
         name_mae, name_gau_log = comma_filenames.split(',')
         name_mae_log = inps[name_mae].name_log
@@ -1218,21 +1578,104 @@ def collect_data(coms, inps, direc='.', sub_names=['OPT'], invert=None):
             logger.warning('Eigenvectors retrieved from {}: {}'.format(
                     name_gau_log, evec.shape))
             raise
-        low_tri_idx = np.tril_indices_from(eigenmatrix)
-        low_tri = eigenmatrix[low_tri_idx]
-        data.extend([datatypes.Datum(
-                    val=e,
-                    com='mgeig',
-                    typ='eig',
-                    src_1=name_mae,
-                    src_2=name_gau_log,
-                    idx_1=x + 1,
-                    idx_2=y + 1)
-                     for e, x, y in izip(
-                    low_tri, low_tri_idx[0], low_tri_idx[1])])
-    logger.log(15, 'TOTAL DATA POINTS: {}'.format(len(data)))
-    return np.array(data, dtype=datatypes.Datum)
+        data.append(return_matrix_data(
+                eigenmatrix, com='mgeig', typ='eig', src_1=name_mae,
+                src_2=name_gau_log))
+    return datatypes.DataSet.concatenate(data)
+
+def return_matrix_data(matrix, com, typ, src_1, src_2=None):
+    """
+    Makes a data point for each element in the lower triangle of a matrix,
+    such as a Hessian or an eigenmatrix. idx_1 and idx_2 are the row and
+    column, counting from 1.
+
+    Returns
+    -------
+    `datatypes.DataSet`
+    """
+    low_tri_idx = np.tril_indices_from(matrix)
+    data = datatypes.DataSet(len(low_tri_idx[0]))
+    data.val = matrix[low_tri_idx].astype(float)
+    data.typ = np.array([typ] * len(data), dtype=str)
+    data.com[:] = com
+    data.src_1[:] = src_1
+    data.src_2[:] = src_2
+    data.idx_1 = low_tri_idx[0] + 1
+    data.idx_2 = low_tri_idx[1] + 1
+    return data
+
+class Extractor(object):
+    """
+    Extracts the data for one command in `collect_data`.
+
+    Attributes
+    ----------
+    command : string
+              Ex.) 'mb'.
+    func : function
+           Called with the lists of filenames given for the command, inps,
+           outs, direc, sub_names and invert (see `collect_data`). Returns a
+           list of `datatypes.Datum` or a `datatypes.DataSet`.
+    preload : tuple
+              Reference files that can be parsed ahead of time in other
+              processes (see `EvaluationPlan.preload`). Has one element
+              for each part of a comma separated filename given to the
+              command. Each is either None or a tuple of the filetype and
+              the names of the attributes func uses.
+    """
+    __slots__ = ['command', 'func', 'preload']
+    def __init__(self, command, func, preload=()):
+        self.command = command
+        self.func = func
+        self.preload = preload
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.command)
 
+# Every command's extractor, in the order their data is collected.
+EXTRACTORS = OrderedDict(
+    (x.command, x) for x in [
+        Extractor('r', collect_r),
+        Extractor('je', collect_je),
+        Extractor('ge', collect_ge,
+                  ((filetypes.GaussLog, ('structures',)),)),
+        Extractor('me', collect_me),
+        Extractor('jea', collect_jea),
+        Extractor('gea', collect_gea,
+                  ((filetypes.GaussLog, ('structures',)),)),
+        Extractor('mea', collect_mea),
+        Extractor('jeo', collect_jeo),
+        Extractor('geo', collect_geo,
+                  ((filetypes.GaussLog, ('structures',)),)),
+        Extractor('meo', collect_meo),
+        Extractor('jeao', collect_jeao),
+        Extractor('geao', collect_geao,
+                  ((filetypes.GaussLog, ('structures',)),)),
+        Extractor('meao', collect_meao),
+        Extractor('jb', collect_jb),
+        Extractor('mb', collect_mb),
+        Extractor('ja', collect_ja),
+        Extractor('ma', collect_ma),
+        Extractor('jt', collect_jt),
+        Extractor('mt', collect_mt),
+        Extractor('jq', collect_jq),
+        Extractor('mq', collect_mq),
+        Extractor('jqh', collect_jqh),
+        Extractor('mqh', collect_mqh),
+        Extractor('jqa', collect_jqa),
+        Extractor('mqa', collect_mqa),
+        Extractor('jh', collect_jh, ((filetypes.JaguarIn, ('hessian',)),)),
+        Extractor('gh', collect_gh,
+                  ((filetypes.GaussLog, ('structures',)),)),
+        Extractor('mh', collect_mh),
+        Extractor('jeigz', collect_jeigz,
+                  ((filetypes.JaguarIn, ('hessian',)),
+                   (filetypes.JaguarOut, ('eigenvectors',)))),
+        Extractor('geigz', collect_geigz,
+                  ((filetypes.GaussLog, ('evals',)),)),
+        Extractor('mjeig', collect_mjeig,
+                  (None, (filetypes.JaguarOut, ('eigenvectors',)))),
+        Extractor('mgeig', collect_mgeig,
+                  (None, (filetypes.GaussLog, ('evecs',))))])
 
 def collect_structural_data_from_mae(
     name_mae, inps, outs, direc, sub_names, com, ind, typ):
@@ -1403,7 +1846,7 @@ def pretty_data(data, log_level=20):
 
     Arguments
     ---------
-    data : list of Datum
+    data : `datatypes.DataSet`
     log_level : int
     """
     # Really, this should check every data point instead of only the 1st.
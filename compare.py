@@ -160,19 +160,60 @@ def correlate_energies(r_data, c_data):
 
     Determines the minimum energy in the reference data set, and sets that to
     zero in the FF data set.
+
+    The groups only depend on the layout of the data, so they're stored in
+    the reference data set's cache the first time and reused for every
+    FF data set after that.
+
+    Arguments
+    ---------
+    r_data : `datatypes.DataSet`
+    c_data : `datatypes.DataSet`
+    """
+    groups = r_data.cache.get('energy_groups')
+    if groups is None or groups.num_data != len(c_data):
+        groups = EnergyGroups(r_data, c_data)
+        r_data.cache['energy_groups'] = groups
+    groups.zero(c_data)
+
+class EnergyGroups(object):
+    """
+    Index of the groups of energies in a pair of aligned data sets.
+
+    Attributes
+    ----------
+    indices : np.ndarray of ints
+              Index of every energy that belongs to a group.
+    zero_indices : np.ndarray of ints
+                   For each element in `indices`, the index of the energy that
+                   is the minimum of that group in the reference data.
+    num_data : int
+               Length of the data sets used to make the index.
     """
-    for indices in select_group_of_energies(c_data):
-        # Search based on FF data because the reference data may be read from
-        # a file and lack some of the necessary attributes.
-        zero, zero_ind = min(
-            (x.val, i) for i, x in enumerate(r_data[indices]))
-        zero_ind = indices[zero_ind]
-        # Now, we need to get that same sub list, and update the calculated
-        # data. As long as they are sorted the same, the indices should
-        # match up.
-        zero = c_data[zero_ind].val
-        for ind in indices:
-            c_data[ind].val -= zero
+    def __init__(self, r_data, c_data):
+        indices = []
+        zero_indices = []
+        for group in select_group_of_energies(c_data):
+            # Search based on FF data because the reference data may be read
+            # from a file and lack some of the necessary attributes.
+            zero_ind = group[np.argmin(r_data.val[group])]
+            indices.append(group)
+            zero_indices.append(np.repeat(zero_ind, len(group)))
+        if indices:
+            self.indices = np.concatenate(indices)
+            self.zero_indices = np.concatenate(zero_indices)
+        else:
+            self.indices = np.array([], dtype=int)
+            self.zero_indices = np.array([], dtype=int)
+        self.num_data = len(c_data)
+    def zero(self, c_data):
+        """
+        Subtracts the energy at the zero index of each group from the
+        energies in that group.
+        """
+        # Gather every zero before changing anything, so the zero of a group
+        # is subtracted from itself too.
+        c_data.val[self.indices] -= c_data.val[self.zero_indices]
 
 # This is outdated now. Most of this is handled inside calculate.
 # 6/29/16 - Actually, now this should be unnecessary simply because the new
@@ -202,16 +243,12 @@ def select_group_of_energies(data):
     """
     for energy_type in ['e', 'eo']:
         # Get all energy indices.
-        indices = np.where([x.typ == energy_type for x in data])[0]
+        is_type = data.typ == energy_type
         # Get the unique group numbers.
-        unique_group_nums = set([x.idx_1 for x in data[indices]])
-        for unique_group_num in unique_group_nums:
+        for unique_group_num in np.unique(data.idx_1[is_type]):
             # Get all the indicies for the given energy type and for a single
             # group.
-            more_indices = np.where(
-                [x.typ == energy_type and x.idx_1 == unique_group_num
-                 for x in data])[0]
-            yield more_indices
+            yield np.where(is_type & (data.idx_1 == unique_group_num))[0]
 
 def import_weights(data):
     """
@@ -219,62 +256,103 @@ def import_weights(data):
 
     Weights can be set in constants.WEIGHTS.
 
-    Checks whether the 1st data point has a weight. If it does, it assumes that
-    all other data points also already have weights. Operates in this fashion in
-    order to save time.
+    Only data points that don't already have a weight (NaN) are changed, so
+    this is safe to use on data that mixes reference data text files with
+    other data types.
 
-    There is a commented method below that checks each data point individually.
+    Arguments
+    ---------
+    data : `datatypes.DataSet`
     """
-    # Check if the 1st data point has a weight. If it does, assume all others do
-    # as well.
-    if data[0].wht is None:
-        for datum in data:
-            if datum.typ == 'eig':
-                if datum.idx_1 == datum.idx_2 == 1:
-                    datum.wht = co.WEIGHTS['eig_i']
-                elif datum.idx_1 == datum.idx_2:
-                    datum.wht = co.WEIGHTS['eig_d']
-                elif datum.idx_1 != datum.idx_2:
-                    datum.wht = co.WEIGHTS['eig_o']
-            else:
-                datum.wht = co.WEIGHTS[datum.typ]
-
-    # Check each data point individually for weights.
-    # for datum in data:
-    #     if datum.wht is None:
-    #         if datum.typ == 'eig':
-    #             if datum.idx_1 == datum.idx_2 == 1:
-    #                 datum.wht = co.WEIGHTS['eig_i']
-    #             elif datum.idx_1 == datum.idx_2:
-    #                 datum.wht = co.WEIGHTS['eig_d']
-    #             elif datum.idx_1 != datum.idx_2:
-    #                 datum.wht = co.WEIGHTS['eig_o']
-    #         else:
-    #             datum.wht = co.WEIGHTS[datum.typ]
+    missing = np.isnan(data.wht)
+    if not missing.any():
+        return
+    is_eig = missing & (data.typ == 'eig')
+    is_diag = data.idx_1 == data.idx_2
+    data.wht[is_eig & is_diag & (data.idx_1 == 1)] = co.WEIGHTS['eig_i']
+    data.wht[is_eig & is_diag & (data.idx_1 != 1)] = co.WEIGHTS['eig_d']
+    data.wht[is_eig & ~is_diag] = co.WEIGHTS['eig_o']
+    missing &= ~is_eig
+    for typ in np.unique(data.typ[missing]):
+        data.wht[missing & (data.typ == typ)] = co.WEIGHTS[typ]
 
-def calculate_score(r_data, c_data):
+def calculate_score(r_data, c_data, return_resid=False):
     """
     Calculates the objective function score.
+
+    Arguments
+    ---------
+    r_data : `datatypes.DataSet`
+    c_data : `datatypes.DataSet`
+    return_resid : bool
+                   If True, also return the weighted residual of every data
+                   point. See `objective_function`.
     """
-    score_tot = 0.
-    for r_datum, c_datum in izip(r_data, c_data):
-        # Could add a check here to assure that the data points are aligned.
-        # Ex.) assert r_datum.ind_1 == c_datum.ind_1, 'Oh no!'
-        
-        # For torsions, ensure the difference between -179 and 179 is 2, not
-        # 358.
-        if r_datum.typ == 't':
-            diff = abs(r_datum.val - c_datum.val)
-            if diff > 180.:
-                diff = 360. - diff
-        else:
-            diff = r_datum.val - c_datum.val
+    assert len(r_data) == len(c_data), \
+        'Reference and FF data have different lengths ({} and {}).'.format(
+        len(r_data), len(c_data))
+    result = objective_function(
+        r_data.wht, r_data.val, c_data.val, r_data.typ == 't',
+        return_resid=return_resid)
+    if return_resid:
+        logger.log(5, 'SCORE: {}'.format(result[0]))
+    else:
+        logger.log(5, 'SCORE: {}'.format(result))
+    return result
+
+def objective_function(wht, r_val, c_val, is_tor, return_resid=False):
+    """
+    Calculates the objective function score from arrays.
+
+    Gives exactly the same floats as summing w**2 * (x_r - x_c)**2 one data
+    point at a time in Python. Two things make that true.
+
+    1. The squares use pow, like Python does, rather than the x * x NumPy
+       uses for `x**2`. The two differ in the last bit now and then.
+    2. The total is a running sum (np.cumsum). np.sum adds in pairs,
+       which changes the rounding.
 
-        score_ind = r_datum.wht**2 * diff**2
-        score_tot += score_ind
-        # logger.log(1, '>>> {} {} {}'.format(r_datum, c_datum, score_ind))
+    Arguments
+    ---------
+    wht : np.ndarray of floats
+    r_val : np.ndarray of floats
+            Reference values.
+    c_val : np.ndarray of floats
+            Calculated values.
+    is_tor : np.ndarray of bools
+             True for torsions. For these, the difference between -179 and
+             179 is 2, not 358.
+    return_resid : bool
+                   If True, also return the weighted residuals,
+                   w * (x_r - x_c). These keep their sign, and the torsion
+                   differences are wrapped into (-180, 180], so from 179 to
+                   -179 is -2.
 
-    logger.log(5, 'SCORE: {}'.format(score_tot))
+    Returns
+    -------
+    float, or tuple of (float, np.ndarray of floats)
+    """
+    diff = r_val - c_val
+    if return_resid:
+        resid = diff.copy()
+        tor = resid[is_tor]
+        is_out = np.abs(tor) > 180.
+        tor[is_out] -= 360. * np.sign(tor[is_out])
+        tor[tor == -180.] = 180.
+        resid[is_tor] = tor
+        resid *= wht
+    diff[is_tor] = np.abs(diff[is_tor])
+    is_over = is_tor & (diff > 180.)
+    diff[is_over] = 360. - diff[is_over]
+    two = np.empty(diff.shape, dtype=float)
+    two.fill(2.)
+    scores = np.power(wht, two) * np.power(diff, two)
+    if len(scores):
+        score_tot = float(np.cumsum(scores)[-1])
+    else:
+        score_tot = 0.
+    if return_resid:
+        return score_tot, resid
     return score_tot
             
 if __name__ == '__main__':
@@ -32,6 +32,7 @@ LOG_SETTINGS = {
             'formatter': 'basic', 'level': 'NOTSET'}
         },
     'loggers': {'__main__': {'level': 5, 'propagate': True},
+                'benchmark': {'level': 20, 'propagate': True},
                 'calculate': {'level': 20, 'propagate': True},
                 'compare': {'level': 10, 'propagate': True},
                 'constants': {'level': 20, 'propagate': True},
@@ -166,6 +167,12 @@ LIC_MACRO = re.compile('{}\s+(\d+)\sof\s\d+\stokens\s'
 MIN_SUITE_TOKENS = 2
 MIN_MACRO_TOKENS = 2
 
+# PARSE CACHE
+# Parsed reference files are kept in memory between evaluations (see
+# filetypes.ParseCache). This limits the total size (bytes) of the files
+# behind the kept objects.
+PARSE_CACHE_BYTES = 500 * 1024**2
+
 # MASSES
 # Used for mass weighting.
 MASSES = OrderedDict(
@@ -2,6 +2,7 @@
 Contains basic data structures used throughout the rest of Q2MM.
 """
 from __future__ import print_function
+from itertools import izip
 import copy
 import logging
 import numpy as np
@@ -22,6 +23,10 @@ P_2_START = 34
 P_2_END = 44
 P_3_START = 45
 P_3_END = 55
+# Start and end of the parameters for each mm3_col.
+P_COLS = {1: (P_1_START, P_1_END),
+          2: (P_2_START, P_2_END),
+          3: (P_3_START, P_3_END)}
 
 class ParamError(Exception):
     pass
@@ -117,6 +122,16 @@ class Param(object):
                 "{} isn't allowed to have a value of {}! "
                 "({} <= x <= {})".format(
                     str(self), value, self.allowed_range[0], self.allowed_range[1]))
+    def copy(self):
+        """
+        Returns a shallow copy. Much faster than copy.deepcopy, and nothing
+        inside a parameter is changed in place anyway.
+        """
+        new = self.__class__.__new__(self.__class__)
+        for cls in self.__class__.__mro__:
+            for attr in cls.__dict__.get('__slots__', []):
+                setattr(new, attr, getattr(self, attr))
+        return new
     
 # Need a general index scheme/method/property to compare the equalness of two
 # parameters, rather than having to rely on some expression that compares
@@ -144,16 +159,139 @@ class ParamMM3(Param):
             self.__class__.__name__, self.ptype, self.mm3_row, self.mm3_col,
             self.value)
 
+class ParamTable(object):
+    """
+    Everything about a set of parameters except their values.
+
+    Every `ParamVector` copied from the same vector points to the same
+    table, so treat it as read only.
+
+    Attributes
+    ----------
+    params : list of `datatypes.Param` (or subclass)
+             Templates used to make Param objects from the values.
+    ptypes : np.ndarray of strings
+    mm3_rows : np.ndarray of ints
+               0 for parameters that aren't MM3* parameters.
+    mm3_cols : np.ndarray of ints
+               0 for parameters that aren't MM3* parameters.
+    lower : np.ndarray of floats
+            Lowest allowed value of each parameter.
+    upper : np.ndarray of floats
+            Highest allowed value of each parameter.
+    """
+    def __init__(self, params):
+        self.params = list(params)
+        self.ptypes = np.array([x.ptype for x in self.params], dtype=str)
+        self.mm3_rows = np.array(
+            [getattr(x, 'mm3_row', None) or 0 for x in self.params], dtype=int)
+        self.mm3_cols = np.array(
+            [getattr(x, 'mm3_col', None) or 0 for x in self.params], dtype=int)
+        self.lower = np.array(
+            [x.allowed_range[0] for x in self.params], dtype=float)
+        self.upper = np.array(
+            [x.allowed_range[1] for x in self.params], dtype=float)
+    def __len__(self):
+        return len(self.params)
+
+class ParamVector(object):
+    """
+    Values of a set of parameters stored as one array, along with a shared
+    `ParamTable`.
+
+    Making a trial FF from another only takes a copy of the values. Param
+    objects are only made if something asks for them (see `FF.params`).
+
+    Attributes
+    ----------
+    table : `datatypes.ParamTable`
+    values : np.ndarray of floats
+    """
+    __slots__ = ['table', 'values']
+    def __init__(self, table, values):
+        self.table = table
+        self.values = np.array(values, dtype=float)
+        assert len(self.values) == len(table), \
+            'Got {} values for {} parameters.'.format(
+            len(self.values), len(table))
+    def __len__(self):
+        return len(self.values)
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, len(self))
+    @classmethod
+    def from_params(cls, params):
+        return cls(ParamTable(params), [x.value for x in params])
+    def copy(self):
+        return self.__class__(self.table, self.values)
+    def check(self, index=None):
+        """
+        Does the same as setting every `Param.value`. Raises ParamError if a
+        value is outside of its allowed range, and folds angles above 180.
+
+        If index is given, only that value is checked, like setting a single
+        `Param.value`.
+        """
+        bad = ~((self.table.lower <= self.values) &
+                (self.values <= self.table.upper))
+        is_over = (self.table.ptypes == 'ae') & (self.values > 180.)
+        if index is not None:
+            only = np.zeros(len(self), dtype=bool)
+            only[index] = True
+            bad &= only
+            is_over &= only
+        if bad.any():
+            i = np.flatnonzero(bad)[0]
+            raise ParamError(
+                "{} isn't allowed to have a value of {}! "
+                "({} <= x <= {})".format(
+                    str(self.table.params[i]), self.values[i],
+                    self.table.lower[i], self.table.upper[i]))
+        self.values[is_over] = 180. - np.abs(180. - self.values[is_over])
+    def clip(self):
+        """
+        Moves values outside of their allowed ranges to the nearest allowed
+        value.
+        """
+        np.clip(self.values, self.table.lower, self.table.upper,
+                out=self.values)
+    def return_steps(self):
+        """
+        Returns the step size of every parameter (see `Param.step`) using
+        these values.
+        """
+        steps = []
+        for param, value in izip(self.table.params, self.values.tolist()):
+            step = param.step
+            if isinstance(param._step, basestring):
+                step = float(param._step) * value
+            steps.append(step)
+        return np.array(steps, dtype=float)
+    def return_param(self, i):
+        param = self.table.params[i].copy()
+        param._value = float(self.values[i])
+        return param
+    def to_params(self):
+        """
+        Returns a new list of `datatypes.Param` (or subclass).
+        """
+        params = []
+        for template, value in izip(self.table.params, self.values.tolist()):
+            param = template.copy()
+            param._value = value
+            params.append(param)
+        return params
+
 class Datum(object):
     '''
     Class for a reference or calculated data point.
     '''
     __slots__ = ['_lbl', 'val', 'wht', 'typ', 'com', 'src_1', 'src_2', 'idx_1',
-                 'idx_2', 'atm_1', 'atm_2', 'atm_3', 'atm_4']
+                 'idx_2', 'atm_1', 'atm_2', 'atm_3', 'atm_4', 'ff_row']
     def __init__(self, lbl=None, val=None, wht=None, typ=None, com=None,
                  src_1=None, src_2=None,
                  idx_1=None, idx_2=None,
-                 atm_1=None, atm_2=None, atm_3=None, atm_4=None):
+                 atm_1=None, atm_2=None, atm_3=None, atm_4=None,
+                 ff_row=None):
         self._lbl  = lbl
         self.val   = val
         self.wht   = wht
@@ -167,25 +305,177 @@ class Datum(object):
         self.atm_2 = atm_2
         self.atm_3 = atm_3
         self.atm_4 = atm_4
+        # Row of the FF used by a bond, angle or torsion in a .mmo file.
+        self.ff_row = ff_row
     def __repr__(self):
         return '{}({:7.4f})'.format(self.lbl, self.val)
     @property
     def lbl(self):
         if self._lbl is None:
-            a = self.typ
-            if self.src_1:
-                b = re.split('[.]+', self.src_1)[0]
-            # Why would it ever not have src_1?
-            else:
-                b = None
-            c = '-'.join(map(str, remove_none(
-                        self.idx_1, self.idx_2)))
-            d = '-'.join(map(str, remove_none(
-                        self.atm_1, self.atm_2, self.atm_3, self.atm_4)))
-            abcd = remove_none(a, b, c, d)
-            self._lbl = '_'.join(abcd)
+            self._lbl = make_lbl(
+                self.typ, self.src_1, self.idx_1, self.idx_2,
+                self.atm_1, self.atm_2, self.atm_3, self.atm_4)
+        return self._lbl
+
+def make_lbl(typ, src_1, idx_1, idx_2, atm_1, atm_2, atm_3, atm_4):
+    """
+    Makes the label for a data point, ex. b_methanol_1_1-2.
+    """
+    a = typ
+    if src_1:
+        b = re.split('[.]+', src_1)[0]
+    # Why would it ever not have src_1?
+    else:
+        b = None
+    c = '-'.join(map(str, remove_none(idx_1, idx_2)))
+    d = '-'.join(map(str, remove_none(atm_1, atm_2, atm_3, atm_4)))
+    abcd = remove_none(a, b, c, d)
+    return '_'.join(abcd)
+
+class DataSet(object):
+    """
+    Many reference or calculated data points stored as columns.
+
+    Has the same attributes as `Datum`, except each is a NumPy array with one
+    element per data point. This way the objective function, the energy
+    zeroing and the weights work on whole arrays at once rather than on
+    thousands of individual `Datum` objects.
+
+    Missing values are stored as NaN for `wht`, 0 for `idx_1`, `idx_2`,
+    `atm_1` through `atm_4` and `ff_row` (these always start from 1), an
+    empty string for `typ` and None for `com`, `src_1` and `src_2`.
+
+    Indexing with an integer or iterating returns `Datum` objects. These are
+    copies, so changing them doesn't change the data set. Indexing with a
+    slice or an array of indices returns a new `DataSet`.
+
+    Attributes
+    ----------
+    val : np.ndarray of floats
+    wht : np.ndarray of floats
+    typ : np.ndarray of strings
+          Fixed width strings, so comparisons like `data.typ == 't'` are
+          done by NumPy.
+    com, src_1, src_2 : np.ndarray of objects
+    idx_1, idx_2, atm_1, atm_2, atm_3, atm_4 : np.ndarray of integers
+    ff_row : np.ndarray of integers
+             Row of the FF used by each bond, angle or torsion read from a
+             .mmo file. Used to tell which parameters a data point depends on
+             (see `gradient.Dependencies`).
+    lbl : np.ndarray of strings
+          Only made when it's first used.
+    cache : dictionary
+            Things that only depend on the layout of the data set and are
+            worth keeping between evaluations, such as the energy groups used
+            by `compare.correlate_energies`.
+    """
+    cols_int = ['idx_1', 'idx_2', 'atm_1', 'atm_2', 'atm_3', 'atm_4',
+                'ff_row']
+    cols_obj = ['com', 'src_1', 'src_2']
+    def __init__(self, size=0):
+        self.val = np.zeros(size, dtype=float)
+        self.wht = np.empty(size, dtype=float)
+        self.wht.fill(np.nan)
+        self.typ = np.zeros(size, dtype='S1')
+        for col in self.cols_obj:
+            setattr(self, col, np.empty(size, dtype=object))
+        for col in self.cols_int:
+            setattr(self, col, np.zeros(size, dtype=int))
+        # Labels given by the user, such as those in reference data text
+        # files. None where the label should be made from the other
+        # attributes.
+        self._lbl_given = np.empty(size, dtype=object)
+        self._lbl = None
+        self.cache = {}
+    def __len__(self):
+        return len(self.val)
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, len(self))
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.return_datum(i)
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, np.integer)):
+            return self.return_datum(key)
+        data = DataSet()
+        data.val = self.val[key]
+        data.wht = self.wht[key]
+        data.typ = self.typ[key]
+        for col in self.cols_obj + self.cols_int:
+            setattr(data, col, getattr(self, col)[key])
+        data._lbl_given = self._lbl_given[key]
+        if self._lbl is not None:
+            data._lbl = self._lbl[key]
+        return data
+    @classmethod
+    def from_data(cls, data):
+        """
+        Makes a data set from a list of `Datum`.
+        """
+        data = list(data)
+        data_set = cls(len(data))
+        if not data:
+            return data_set
+        data_set.val = np.array([x.val for x in data], dtype=float)
+        data_set.wht = np.array(
+            [np.nan if x.wht is None else x.wht for x in data], dtype=float)
+        data_set.typ = np.array(
+            ['' if x.typ is None else x.typ for x in data], dtype=str)
+        for col in cls.cols_obj:
+            column = np.empty(len(data), dtype=object)
+            column[:] = [getattr(x, col) for x in data]
+            setattr(data_set, col, column)
+        for col in cls.cols_int:
+            setattr(data_set, col, np.array(
+                    [getattr(x, col) or 0 for x in data], dtype=int))
+        data_set._lbl_given[:] = [x._lbl for x in data]
+        return data_set
+    @classmethod
+    def concatenate(cls, data_sets):
+        """
+        Joins data sets end to end into a new data set.
+        """
+        data_set = cls()
+        if not data_sets:
+            return data_set
+        data_set.val = np.concatenate([x.val for x in data_sets])
+        data_set.wht = np.concatenate([x.wht for x in data_sets])
+        data_set.typ = np.concatenate([x.typ for x in data_sets])
+        for col in cls.cols_obj + cls.cols_int:
+            setattr(data_set, col, np.concatenate(
+                    [getattr(x, col) for x in data_sets]))
+        data_set._lbl_given = np.concatenate(
+            [x._lbl_given for x in data_sets])
+        return data_set
+    def copy(self):
+        return self[np.arange(len(self))]
+    @property
+    def lbl(self):
+        if self._lbl is None:
+            lbl = np.empty(len(self), dtype=object)
+            for i in xrange(len(self)):
+                lbl[i] = self._lbl_given[i]
+                if lbl[i] is None:
+                    datum = self.return_datum(i)
+                    lbl[i] = datum.lbl
+            self._lbl = lbl
         return self._lbl
-        
+    def return_datum(self, i):
+        """
+        Returns a `Datum` with the values of the data point at index i.
+        """
+        wht = self.wht[i]
+        datum = Datum(
+            lbl=self._lbl_given[i],
+            val=self.val[i],
+            wht=None if np.isnan(wht) else wht,
+            typ=self.typ[i] or None)
+        for col in self.cols_obj:
+            setattr(datum, col, getattr(self, col)[i])
+        for col in self.cols_int:
+            setattr(datum, col, int(getattr(self, col)[i]) or None)
+        return datum
+
 def remove_none(*args):
     return [x for x in args if (x is not None and x is not '')]
 
@@ -200,19 +490,52 @@ class FF(object):
     """
     Class for any type of force field.
     
-    path   - Self explanatory.
-    data   - List of Datum objects.
-    method - String describing method used to generate this FF.
-    params - List of Param objects.
-    score  - Float which is the objective function score.
+    path         - Self explanatory.
+    data         - DataSet of the calculated data points.
+    method       - String describing method used to generate this FF.
+    params       - List of Param objects.
+    param_vector - The same parameters as a ParamVector.
+    score        - Float which is the objective function score.
     """
     def __init__(self, path=None, data=None, method=None, params=None,
                  score=None):
         self.path = path
         self.data = data
         self.method = method
+        self._params = None
+        self._param_vector = None
         self.params = params
         self.score = score
+    @property
+    def params(self):
+        # FFs made from a ParamVector only make their Param objects when
+        # they're needed. After that, the Param objects are what counts.
+        if self._params is None and self._param_vector is not None:
+            self._params = self._param_vector.to_params()
+            self._param_vector = None
+        return self._params
+    @params.setter
+    def params(self, x):
+        self._params = x
+        self._param_vector = None
+    @property
+    def param_vector(self):
+        """
+        Returns the parameters as a `datatypes.ParamVector`.
+
+        Unless the FF was given a vector and `params` hasn't been used since,
+        this is a new vector made from `params`. Changing it won't change
+        the FF, so set `param_vector` instead.
+        """
+        if self._param_vector is not None:
+            return self._param_vector
+        if self._params is None:
+            return None
+        return ParamVector.from_params(self._params)
+    @param_vector.setter
+    def param_vector(self, x):
+        self._param_vector = x
+        self._params = None
     def copy_attributes(self, ff):
         """
         Copies some general attributes to another force field.
@@ -616,10 +939,85 @@ class MM3(FF):
                     section_vdw = True
                     continue
         logger.log(15, '  -- Read {} parameters.'.format(len(self.params)))
+    def return_fields(self, params=None):
+        """
+        Returns the formatted parameter values that export_ff writes.
+
+        Parameters
+        ----------
+        params : list of `datatypes.ParamMM3`
+                 Uses this FF's parameters if not given.
+
+        Returns
+        -------
+        dict
+            Keys are (mm3_row, mm3_col) and values are 10 character strings.
+        """
+        if params is None and self._params is None and \
+                self._param_vector is not None:
+            # Don't make Param objects only to write them.
+            vector = self._param_vector
+            rows = vector.table.mm3_rows.tolist()
+            cols = vector.table.mm3_cols.tolist()
+            values = vector.values.tolist()
+            return_param = vector.return_param
+        else:
+            if params is None:
+                params = self.params
+            rows = [x.mm3_row for x in params]
+            cols = [x.mm3_col for x in params]
+            values = [x.value for x in params]
+            return_param = params.__getitem__
+        fields = {}
+        for i, (row, col, value) in enumerate(izip(rows, cols, values)):
+            # There are some problems with this. Probably an optimization
+            # technique gave you these crazy parameter values. Ideally, this
+            # entire trial FF should be discarded.
+            # Someday export_ff should raise an exception when these values
+            # get too rediculous, and this exception should be handled by the
+            # optimization techniques appropriately.
+            if abs(value) > 999.:
+                logger.warning(
+                    'Value of {} is too high! Skipping write.'.format(
+                        return_param(i)))
+            elif col in P_COLS:
+                fields[row, col] = '{:10.4f}'.format(value)
+        return fields
+    def return_lines(self, params=None, lines=None, fields=None):
+        """
+        Returns a new list of lines with the parameter values written in.
+        The lines given aren't changed.
+
+        Parameters
+        ----------
+        params : list of `datatypes.ParamMM3`
+        lines : list of strings
+                This is what is generated when you read mm3.fld using
+                readlines().
+        fields : dict, optional
+                 From `return_fields`. Made from `params` if not given.
+        """
+        if lines is None:
+            lines = self.lines
+        if fields is None:
+            fields = self.return_fields(params)
+        new_lines = list(lines)
+        for (row, col), field in fields.iteritems():
+            line = new_lines[row - 1]
+            start, end = P_COLS[col]
+            new_lines[row - 1] = line[:start] + field + line[end:]
+        return new_lines
     def export_ff(self, path=None, params=None, lines=None):
         """
         Exports the force field to a file, typically mm3.fld.
 
+        The lines given are used as a template and aren't changed, so
+        parameter values from one export never leak into the next.
+
+        If the file was last written here using the same lines and hasn't
+        been touched since, only the parameter fields that differ are written
+        (see `ExportedFile`). Otherwise the whole file is written.
+
         Parameters
         ----------
         path : string
@@ -631,39 +1029,115 @@ class MM3(FF):
         """
         if path is None:
             path = self.path
-        if params is None:
-            params = self.params
         if lines is None:
             lines = self.lines
-        for param in params:
-            logger.log(1, '>>> param: {} param.value: {}'.format(
-                    param, param.value))
-            line = lines[param.mm3_row - 1]
-            # There are some problems with this. Probably an optimization
-            # technique gave you these crazy parameter values. Ideally, this
-            # entire trial FF should be discarded.
-            # Someday export_ff should raise an exception when these values
-            # get too rediculous, and this exception should be handled by the
-            # optimization techniques appropriately.
-            if abs(param.value) > 999.:
-                logger.warning(
-                    'Value of {} is too high! Skipping write.'.format(param))
-            elif param.mm3_col == 1:
-                lines[param.mm3_row - 1] = (line[:P_1_START] +
-                                            '{:10.4f}'.format(param.value) +
-                                            line[P_1_END:])
-            elif param.mm3_col == 2:
-                lines[param.mm3_row - 1] = (line[:P_2_START] +
-                                            '{:10.4f}'.format(param.value) +
-                                            line[P_2_END:])
-            elif param.mm3_col == 3:
-                lines[param.mm3_row - 1] = (line[:P_3_START] +
-                                            '{:10.4f}'.format(param.value) +
-                                            line[P_3_END:])
+        fields = self.return_fields(params)
+        exported = _EXPORTED.get(os.path.abspath(path))
+        if exported is not None and exported.matches(path, lines):
+            num_written = exported.patch(path, fields)
+            if num_written is not None:
+                logger.log(10, 'WROTE: {} ({} changed fields)'.format(
+                        path, num_written))
+                return
+        new_lines = self.return_lines(lines=lines, fields=fields)
         with open(path, 'w') as f:
-            f.writelines(lines)
+            f.writelines(new_lines)
+        # The byte offsets of ExportedFile come from the template lines. If a
+        # field made a line longer (the template line was too short for it),
+        # every offset after it is wrong, so the file can't be patched later.
+        if all(len(new_lines[row - 1]) == len(lines[row - 1])
+               for row, col in fields):
+            _EXPORTED[os.path.abspath(path)] = ExportedFile(
+                lines, fields, return_stamp(path))
+        else:
+            _EXPORTED.pop(os.path.abspath(path), None)
         logger.log(10, 'WROTE: {}'.format(path))
 
+# Files written by MM3.export_ff in this process. Keys are absolute paths
+# and values are `ExportedFile`.
+_EXPORTED = {}
+
+def return_stamp(path):
+    """
+    Returns the modification time and size of a file, or None if it can't be
+    found.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+class ExportedFile(object):
+    """
+    Remembers what `MM3.export_ff` last wrote to a file, which is the
+    template lines with some parameter fields written over them.
+
+    MM3* parameters have fixed widths, so a new set of parameters can be
+    written into the file at known byte offsets. That costs as much as the
+    number of changed parameters rather than the size of the file.
+
+    Attributes
+    ----------
+    lines : list of strings
+            Template lines.
+    fields : dict
+             Fields written over the template. See `MM3.return_fields`.
+    stamp : tuple
+            Modification time and size of the file after the last write.
+    """
+    __slots__ = ['lines', 'fields', 'stamp', '_offsets']
+    def __init__(self, lines, fields, stamp):
+        self.lines = lines
+        self.fields = fields
+        self.stamp = stamp
+        self._offsets = None
+    @property
+    def offsets(self):
+        """
+        Byte offset of the start of every line.
+        """
+        if self._offsets is None:
+            self._offsets = [0]
+            for line in self.lines:
+                self._offsets.append(self._offsets[-1] + len(line))
+        return self._offsets
+    def matches(self, path, lines):
+        """
+        True if the file still holds what was last written using these lines.
+        """
+        return lines is self.lines and return_stamp(path) == self.stamp
+    def patch(self, path, fields):
+        """
+        Writes the fields that changed since the last write. Fields that were
+        written before but aren't in `fields` go back to the template.
+
+        Returns the number of fields written, or None if it can't be done in
+        place (a field runs past the end of its line). In that case, the
+        file isn't touched.
+        """
+        changes = []
+        for key in set(self.fields) | set(fields):
+            new = fields.get(key)
+            if new == self.fields.get(key):
+                continue
+            row, col = key
+            line = self.lines[row - 1]
+            start, end = P_COLS[col]
+            if len(line) < end or '\n' in line[start:end]:
+                return None
+            if new is None:
+                new = line[start:end]
+            changes.append((self.offsets[row - 1] + start, new))
+        if changes:
+            with open(path, 'r+b') as f:
+                for offset, field in sorted(changes):
+                    f.seek(offset)
+                    f.write(field)
+        self.fields = fields
+        self.stamp = return_stamp(path)
+        return len(changes)
+
 def match_mm3_label(mm3_label):
     """
     Makes sure the MM3* label is recognized.
@@ -696,39 +1170,53 @@ def match_mm3_improper(mm3_label):
 
 def mass_weight_hessian(hess, atoms, reverse=False):
     """
-    Mass weights Hessian. If reverse is True, it un-mass weights
+    Mass weights Hessian in place. If reverse is True, it un-mass weights
     the Hessian.
+
+    Element (i, j) is multiplied by 1 / sqrt(m_i m_j). Works on a stack of
+    Hessians too (any array whose last 2 axes are the Hessian).
+
+    Arguments
+    ---------
+    hess : np.ndarray of floats
+    atoms : list of `filetypes.Atom`
+            Dummy atoms are ignored.
+    reverse : bool
     """
-    masses = [co.MASSES[x.element] for x in atoms if not x.is_dummy]
-    changes = []
-    for mass in masses:
-        changes.extend([1 / np.sqrt(mass)] * 3)
-    x, y = hess.shape
-    for i in xrange(0, x):
-        for j in xrange(0, y):
-            if reverse:
-                hess[i, j] = \
-                    hess[i, j] / changes[i] / changes[j]
-            else:
-                hess[i, j] = \
-                    hess[i, j] * changes[i] * changes[j]
+    masses = np.array(
+        [co.MASSES[x.element] for x in atoms if not x.is_dummy], dtype=float)
+    changes = np.repeat(1 / np.sqrt(masses), 3)
+    # Multiply by the row and then the column, the same order as the loop
+    # this replaced, so the results are identical.
+    if reverse:
+        hess /= changes[:, np.newaxis]
+        hess /= changes
+    else:
+        hess *= changes[:, np.newaxis]
+        hess *= changes
 
 def mass_weight_eigenvectors(evecs, atoms, reverse=False):
     """
-    Mass weights eigenvectors. If reverse is True, it un-mass weights
-    the eigenvectors.
+    Mass weights eigenvectors in place. If reverse is True, it un-mass
+    weights the eigenvectors.
+
+    Every eigenvector (row) is multiplied by sqrt(m). Works on a stack of
+    eigenvector matrices too.
+
+    Arguments
+    ---------
+    evecs : np.ndarray of floats
+    atoms : list of `filetypes.Atom`
+            Dummy atoms are ignored.
+    reverse : bool
     """
-    changes = []
-    for atom in atoms:
-        if not atom.is_dummy:
-            changes.extend([np.sqrt(atom.exact_mass)] * 3)
-    x, y = evecs.shape
-    for i in xrange(0, x):
-        for j in xrange(0, y):
-            if reverse:
-                evecs[i, j] /= changes[j]
-            else:
-                evecs[i, j] *= changes[j]
+    masses = np.array(
+        [x.exact_mass for x in atoms if not x.is_dummy], dtype=float)
+    changes = np.repeat(np.sqrt(masses), 3)
+    if reverse:
+        evecs /= changes
+    else:
+        evecs *= changes
 
 def replace_minimum(array, value=1):
     """
@@ -17,15 +17,22 @@ Note that the atom.typ must be located with your structure files, else the
 Schrodinger jobs will fail.
 """
 from __future__ import print_function
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from string import digits
+import hashlib
 import itertools
 import logging
 import mmap
+import multiprocessing
 import numpy as np
 import math
 import os
 import re
 import subprocess as sp
+import sys
+import tempfile
+import threading
 import time
 
 from schrodinger import structure as sch_str
@@ -61,7 +68,409 @@ class File(object):
         with open(path, 'w') as f:
             for line in lines:
                 f.write(line)
-        
+    def load_from_disk_cache(self, section):
+        """
+        Returns the arrays saved for this section of the file, or None if the
+        disk cache isn't used or doesn't have them.
+        """
+        if DISK_CACHE is None:
+            return None
+        return DISK_CACHE.load(self, section)
+    def save_to_disk_cache(self, section, arrays):
+        if DISK_CACHE is not None:
+            DISK_CACHE.save(self, section, arrays)
+
+class ParseCache(object):
+    """
+    Keeps filetype objects around for the whole session so that files that
+    don't change, such as the reference QM files, are only parsed once.
+
+    Filetype objects parse lazily and hold onto whatever they've read, so
+    storing the object is enough. An object is reused as long as the file's
+    modification time and size are the same as when it was stored.
+
+    Memory is bounded using the sizes of the files on disk. When the total
+    goes over `max_bytes`, the least recently used objects are dropped.
+
+    Attributes
+    ----------
+    max_bytes : int
+    num_bytes : int
+                Total size of the files behind the stored objects.
+    """
+    def __init__(self, max_bytes=co.PARSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        # Keys are (path, class). Values are ((mtime, size), object).
+        self._objects = OrderedDict()
+        self._lock = threading.Lock()
+    def __len__(self):
+        return len(self._objects)
+    def get(self, path, classtype):
+        """
+        Returns the stored object of `classtype` for `path` if the file hasn't
+        changed, or else makes and stores a new one.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime, stat.st_size)
+        key = (path, classtype)
+        with self._lock:
+            old = self._objects.pop(key, None)
+            if old is not None:
+                if old[0] == stamp:
+                    # Move it to the end, marking it most recently used.
+                    self._objects[key] = old
+                    logger.log(5, '  -- Reusing parsed {}.'.format(path))
+                    return old[1]
+                self.num_bytes -= old[0][1]
+            obj = classtype(path)
+            self._store(key, stamp, obj)
+        return obj
+    def has(self, path, classtype):
+        """
+        Returns True if an object of `classtype` is stored for `path` and the
+        file hasn't changed since.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            old = self._objects.get((path, classtype))
+        return old is not None and old[0] == datatypes.return_stamp(path)
+    def add(self, path, classtype, obj, stamp):
+        """
+        Stores an object that was made somewhere else, such as in another
+        process (see `parse_files`).
+
+        Arguments
+        ---------
+        path : string
+        classtype : class
+        obj : instance of `classtype`
+        stamp : tuple
+                Modification time and size of the file from before `obj` was
+                made, so the object is dropped if the file changed while it
+                was being parsed.
+        """
+        key = (os.path.abspath(path), classtype)
+        with self._lock:
+            old = self._objects.pop(key, None)
+            if old is not None:
+                self.num_bytes -= old[0][1]
+            self._store(key, stamp, obj)
+    def _store(self, key, stamp, obj):
+        # Only call while holding the lock.
+        self._objects[key] = (stamp, obj)
+        self.num_bytes += stamp[1]
+        # Always keep the newest object, even if it's over the limit by
+        # itself.
+        while self.num_bytes > self.max_bytes and len(self._objects) > 1:
+            old_key, old = self._objects.popitem(last=False)
+            self.num_bytes -= old[0][1]
+            logger.log(5, '  -- Dropped parsed {}.'.format(old_key[0]))
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+            self.num_bytes = 0
+
+# Shared by everything in this process.
+PARSE_CACHE = ParseCache()
+
+def _parse_file(job):
+    """
+    Parses one file for `parse_files`. Runs in a worker process.
+    """
+    path, classtype, attrs = job
+    stamp = datatypes.return_stamp(path)
+    obj = classtype(path)
+    # Filetypes parse lazily, so ask for everything that will be used.
+    for attr in attrs:
+        getattr(obj, attr)
+    # Cheap to read again if they're ever needed, and they'd only make the
+    # object slower to send back.
+    obj._lines = None
+    return stamp, obj
+
+def parse_files(jobs, processes=1):
+    """
+    Parses files in a pool of processes and stores the objects in
+    `PARSE_CACHE`.
+
+    The files are independent, so each is parsed by whichever process is
+    free. The parsed objects are sent back and stored in the same order as
+    `jobs`, so the contents of the cache don't depend on which process
+    finished first. Files that are already stored and haven't changed are
+    skipped.
+
+    Arguments
+    ---------
+    jobs : list of tuples
+           Each tuple is (path, classtype, attrs), where attrs are the
+           names of the attributes, ex. 'structures', to read in the worker
+           process.
+    processes : int
+
+    Returns
+    -------
+    int
+        Number of files parsed.
+    """
+    jobs = [x for x in jobs if not PARSE_CACHE.has(x[0], x[1])]
+    if not jobs:
+        return 0
+    processes = min(processes, len(jobs))
+    logger.log(10, '  -- Parsing {} files using {} processes.'.format(
+            len(jobs), processes))
+    if processes <= 1:
+        results = [_parse_file(x) for x in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_parse_file, jobs)
+        finally:
+            pool.terminate()
+            pool.join()
+    for (path, classtype, attrs), (stamp, obj) in itertools.izip(
+            jobs, results):
+        PARSE_CACHE.add(path, classtype, obj, stamp)
+    return len(jobs)
+
+class DiskCache(object):
+    """
+    Saves what's parsed from QM files to .npz files so that later sessions
+    can skip reading the original file.
+
+    Saved files are named using the SHA-1 hash of the original file's
+    contents, so a changed file never matches an old entry. The name also
+    includes the filetype class, the section of the file that was read
+    and `DISK_CACHE_VERSION`.
+
+    Attributes
+    ----------
+    directory : string
+    """
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Hashing a big file isn't free, so remember the hash for as long as
+        # the file looks the same.
+        # Keys are (path, mtime, size). Values are hex digests.
+        self._digests = {}
+    def return_digest(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime, stat.st_size)
+        if key not in self._digests:
+            sha = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024**2), ''):
+                    sha.update(chunk)
+            self._digests[key] = sha.hexdigest()
+        return self._digests[key]
+    def return_path(self, obj, section):
+        return os.path.join(
+            self.directory, '{}.{}.{}.v{}.npz'.format(
+                self.return_digest(obj.path), obj.__class__.__name__,
+                section, DISK_CACHE_VERSION))
+    def load(self, obj, section):
+        """
+        Returns a dictionary of arrays or None.
+        """
+        path = self.return_path(obj, section)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as npz:
+                arrays = {key: npz[key] for key in npz.files}
+        except Exception as e:
+            # Don't let a bad cache file stop anything. The original file
+            # is still there to read.
+            logger.warning('Ignoring disk cache {}: {}'.format(path, e))
+            return None
+        logger.log(5, 'READING: {} (disk cache)'.format(obj.filename))
+        return arrays
+    def save(self, obj, section, arrays):
+        path = self.return_path(obj, section)
+        # Write to a temporary file first so other processes never load a
+        # partial file.
+        fd, temp_path = tempfile.mkstemp(suffix='.npz', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.rename(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        logger.log(5, '  -- Wrote {}.'.format(path))
+
+# Changing how any of the QM filetypes are read should increase this, which
+# makes old disk cache files useless.
+DISK_CACHE_VERSION = 2
+# Set by use_disk_cache. By default, nothing is saved to disk.
+DISK_CACHE = None
+
+def use_disk_cache(directory):
+    """
+    Turns on the disk cache for the rest of this process.
+
+    Arguments
+    ---------
+    directory : string
+                Where the .npz files are kept. Made if it doesn't exist.
+    """
+    global DISK_CACHE
+    if DISK_CACHE is None or \
+            DISK_CACHE.directory != os.path.abspath(directory):
+        DISK_CACHE = DiskCache(directory)
+    return DISK_CACHE
+
+def structures_to_arrays(structures):
+    """
+    Packs structures into a dictionary of arrays for `DiskCache`.
+
+    Only keeps what the QM filetypes read, which is the atoms' elements,
+    atomic numbers, exact masses and coordinates along with the structures'
+    properties (as strings) and Hessians.
+    """
+    atoms = [atom for struct in structures for atom in struct.atoms]
+    # None is stored as '', 0 or NaN.
+    arrays = {
+        'num_atoms': np.array(
+            [len(struct.atoms) for struct in structures], dtype=int),
+        'coords': np.array(
+            [[atom.x, atom.y, atom.z] for atom in atoms],
+            dtype=float).reshape(-1, 3),
+        'elements': np.array(
+            [atom._element or '' for atom in atoms], dtype=str),
+        'atomic_nums': np.array(
+            [atom.atomic_num or 0 for atom in atoms], dtype=int),
+        'exact_masses': np.array(
+            [np.nan if atom._exact_mass is None else atom._exact_mass
+             for atom in atoms], dtype=float)}
+    prop_structs = []
+    prop_keys = []
+    prop_values = []
+    for i, struct in enumerate(structures):
+        for key, value in struct.props.iteritems():
+            prop_structs.append(i)
+            prop_keys.append(key)
+            prop_values.append(str(value))
+        if struct.hess is not None:
+            arrays['hess_{}'.format(i)] = struct.hess
+    arrays['prop_structs'] = np.array(prop_structs, dtype=int)
+    arrays['prop_keys'] = np.array(prop_keys, dtype=str)
+    arrays['prop_values'] = np.array(prop_values, dtype=str)
+    return arrays
+
+def arrays_to_structures(arrays):
+    """
+    Opposite of `structures_to_arrays`.
+    """
+    structures = []
+    atoms = itertools.izip(
+        arrays['coords'].tolist(), arrays['elements'].tolist(),
+        arrays['atomic_nums'].tolist(), arrays['exact_masses'].tolist())
+    for i, num_atoms in enumerate(arrays['num_atoms'].tolist()):
+        struct = Structure()
+        for coords, element, atomic_num, exact_mass in \
+                itertools.islice(atoms, num_atoms):
+            struct.atoms.append(
+                Atom(coords=coords,
+                     element=element or None,
+                     atomic_num=atomic_num or None,
+                     exact_mass=None if np.isnan(exact_mass) else exact_mass))
+        struct.hess = arrays.get('hess_{}'.format(i))
+        structures.append(struct)
+    for i, key, value in itertools.izip(
+            arrays['prop_structs'].tolist(), arrays['prop_keys'].tolist(),
+            arrays['prop_values'].tolist()):
+        structures[i].props[key] = value
+    return structures
+
+# Sections of the .fchk used by GaussFormChk.
+FCHK_SECTIONS = ['Atomic numbers',
+                 'Current cartesian coordinates',
+                 'Real atomic weights',
+                 'Cartesian Gradient',
+                 'Cartesian Force Constants']
+# Matches the header of a section in a .fchk. The groups are the name, the
+# type and, for arrays, 'N=' followed by the number of values.
+RE_FCHK_HEADER = re.compile('(\S.*?)\s+([IRCLH])\s+(N=)?\s*(\S+)\s*$')
+# Values per line and width of each value for the array types of a .fchk.
+FCHK_FORMATS = {'I': (6, 12),
+                'R': (5, 16),
+                'C': (5, 12),
+                'H': (9, 8),
+                'L': (72, 1)}
+# Lines read at once when filling an array.
+FCHK_CHUNK_LINES = 4096
+
+def read_fchk_array(f, typ, num):
+    """
+    Reads the data lines of one .fchk section into a preallocated array.
+
+    Arguments
+    ---------
+    f : file
+        Positioned just after the section header.
+    typ : string
+          'I' or 'R'.
+    num : int
+          Number of values in the section.
+
+    Returns
+    -------
+    np.ndarray
+    """
+    dtype = int if typ == 'I' else float
+    per_line = FCHK_FORMATS[typ][0]
+    array = np.empty(num, dtype=dtype)
+    filled = 0
+    while filled < num:
+        num_lines = min(
+            FCHK_CHUNK_LINES, (num - filled + per_line - 1) // per_line)
+        chunk = ''.join(f.readline() for _ in xrange(num_lines))
+        values = np.fromstring(chunk, dtype=dtype, sep=' ')
+        if not len(values):
+            raise Exception(
+                'Ran out of data after {} of {} values in {}.'.format(
+                    filled, num, f.name))
+        array[filled:filled + len(values)] = values
+        filled += len(values)
+    return array
+
+def skip_fchk_array(f, typ, num):
+    """
+    Moves past the data lines of one .fchk section without parsing them.
+
+    Every line except the last is full, so the size of the section is known
+    from the number of values. Seeks straight past it when the line after
+    looks like the next header. Otherwise, reads past it one line at a time.
+
+    Arguments
+    ---------
+    f : file
+        Positioned just after the section header.
+    typ : string
+    num : int
+    """
+    per_line, width = FCHK_FORMATS.get(typ, (None, None))
+    if per_line is None:
+        raise Exception(
+            "Don't know the format of type {} sections in {}.".format(
+                typ, f.name))
+    num_lines = (num + per_line - 1) // per_line
+    start = f.tell()
+    f.seek(start + num * width + num_lines)
+    pos = f.tell()
+    line = f.readline()
+    if not line or RE_FCHK_HEADER.match(line):
+        f.seek(pos)
+        return
+    f.seek(start)
+    for _ in xrange(num_lines):
+        f.readline()
+
 class GaussFormChk(File):
     """
     Used to retrieve data from Gaussian formatted checkpoint files.
@@ -78,23 +487,67 @@ class GaussFormChk(File):
         if self._hess is None:
             self.read_self()
         return self._hess
+    def read_sections(self, names):
+        """
+        Reads arrays out of the .fchk one section at a time.
+
+        Each section starts with a header line giving its name, its type and
+        the number of values, so the size of every array is known before
+        its data is read. The values of the sections in `names` go straight
+        into a preallocated array. The data of every other section is
+        skipped over without being parsed, and reading stops as soon as all
+        of `names` have been found.
+
+        Arguments
+        ---------
+        names : list of strings
+                Names of the sections, ex. 'Cartesian Force Constants'.
+
+        Returns
+        -------
+        dict of np.ndarray
+        """
+        names = set(names)
+        sections = {}
+        with open(self.path, 'r') as f:
+            # The 1st two lines are the title and the job type.
+            f.readline()
+            f.readline()
+            while len(sections) < len(names):
+                line = f.readline()
+                if not line:
+                    break
+                match = RE_FCHK_HEADER.match(line)
+                # Scalars have no data lines.
+                if match is None or not match.group(3):
+                    continue
+                name, typ, num = \
+                    match.group(1), match.group(2), int(match.group(4))
+                if name in names:
+                    sections[name] = read_fchk_array(f, typ, num)
+                else:
+                    skip_fchk_array(f, typ, num)
+        missing = names.difference(sections)
+        if missing:
+            raise Exception(
+                "Couldn't find {} in {}.".format(
+                    ', '.join(sorted(missing)), self.path))
+        return sections
     def read_self(self):
+        arrays = self.load_from_disk_cache('fchk')
+        if arrays is not None:
+            self.atoms = arrays_to_structures(arrays)[0].atoms
+            self.evals = arrays['evals']
+            self.low_tri = arrays['low_tri']
+            self._hess = arrays['hess']
+            return
         logger.log(5, 'READING: {}'.format(self.filename))
-        stuff = re.search(
-            'Atomic numbers\s+I\s+N=\s+(?P<num_atoms>\d+)'
-            '\n\s+(?P<anums>.*?)'
-            'Nuclear charges.*?Current cartesian coordinates.*?\n(?P<coords>.*?)'
-            'Force Field'
-            '.*?Real atomic weights.*?\n(?P<masses>.*?)'
-            'Atom fragment info.*?Cartesian Gradient.*?\n(?P<evals>.*?)'
-            'Cartesian Force Constants.*?\n(?P<hess>.*?)'
-            'Dipole Moment',
-            open(self.path, 'r').read(), flags=re.DOTALL)
-        anums = map(int, stuff.group('anums').split())
-        masses = map(float, stuff.group('masses').split())
-        coords = map(float, stuff.group('coords').split())
-        coords = [coords[i:i+3] for i in range(0, len(coords), 3)]
-        for anum, mass, coord in itertools.izip(anums, masses, coords):
+        sections = self.read_sections(FCHK_SECTIONS)
+        anums = sections['Atomic numbers']
+        masses = sections['Real atomic weights']
+        coords = sections['Current cartesian coordinates'].reshape(-1, 3)
+        for anum, mass, coord in itertools.izip(
+                anums.tolist(), masses.tolist(), coords.tolist()):
             self.atoms.append(
                 Atom(
                     atomic_num = anum,
@@ -102,18 +555,34 @@ class GaussFormChk(File):
                     exact_mass = mass)
                 )
         logger.log(5, '  -- Read {} atoms.'.format(len(self.atoms)))
-        self.evals = np.array(
-            map(float, stuff.group('evals').split()), dtype=float)
+        self.evals = sections['Cartesian Gradient']
         logger.log(5, '  -- Read {} eigenvectors.'.format(len(self.evals)))
-        self.low_tri = np.array(
-            map(float, stuff.group('hess').split()), dtype=float)
+        self.low_tri = sections['Cartesian Force Constants']
         one_dim = len(anums) * 3
-        self._hess = np.empty([one_dim, one_dim], dtype=float)
+        self._hess = np.zeros([one_dim, one_dim], dtype=float)
         self._hess[np.tril_indices_from(self._hess)] = self.low_tri
         self._hess += np.tril(self._hess, -1).T
         # Convert to MacroModel units.
         self._hess *= co.HESSIAN_CONVERSION
         logger.log(5, '  -- Read {} Hessian.'.format(self._hess.shape))
+        struct = Structure()
+        struct.atoms = self.atoms
+        arrays = structures_to_arrays([struct])
+        arrays.update(evals=self.evals, low_tri=self.low_tri, hess=self._hess)
+        self.save_to_disk_cache('fchk', arrays)
+
+# Start of an archive in a Gaussian .log file, " 1\1\".
+ARCHIVE_START = '1\\1\\'
+# Matches everything in between the start and end of an archive.
+# (?s)  - Flag for re.compile which says that . matches all.
+# \\\\  - One single \
+# Start - " 1\1\".
+# End   - Some number of \ followed by @. Not sure how many \ there
+#         are, so this matches as many as possible. Also, this could
+#         get separated by a line break (which would also include
+#         adding in a space since that's how Gaussian starts new lines
+#         in the archive).
+RE_ARCHIVE = re.compile('(?s)(\s1\\\\1\\\\.*?[\\\\\n\s]+@)')
 
 class GaussLog(File):
     """
@@ -127,6 +596,7 @@ class GaussLog(File):
         self._evals = None
         self._evecs = None
         self._structures = None
+        self._archive_read = False
     @property
     def evecs(self):
         if self._evecs is None:
@@ -139,7 +609,9 @@ class GaussLog(File):
         return self._evals
     @property
     def structures(self):
-        if self._structures is None:
+        # read_out also makes structures, but those lack the properties
+        # and Hessian found in the archive.
+        if not self._archive_read:
             # self.read_out()
             self.read_archive()
         return self._structures
@@ -152,10 +624,17 @@ class GaussLog(File):
         This function is more or less a direct copy of someone else's
         code (Elaine?), so I'm not sure how it works.
         """
+        arrays = self.load_from_disk_cache('out')
+        if arrays is not None:
+            self._evals = arrays['evals']
+            self._evecs = arrays['evecs']
+            if not self._archive_read:
+                self._structures = arrays_to_structures(arrays)
+            return
         logger.log(5, 'READING: {}'.format(self.filename))
         self._evals = []
         self._evecs = []
-        self._structures = []
+        structures = []
         weird_nfc = []
         weird_nvec = []
         weird_ne = 0
@@ -169,7 +648,7 @@ class GaussLog(File):
                 except:
                     break
                 if 'orientation:' in line:
-                    self._structures.append(Structure())
+                    structures.append(Structure())
                     fi.next()
                     fi.next()
                     fi.next()
@@ -177,14 +656,14 @@ class GaussLog(File):
                     line = fi.next()
                     while not '---' in line:
                         cols = line.split()
-                        self._structures[-1].atoms.append(
+                        structures[-1].atoms.append(
                             Atom(atomic_num=int(cols[1]),
                                  x=float(cols[3]),
                                  y=float(cols[4]),
                                  z=float(cols[5])))
                         line = fi.next()
                     logger.log(5, '  -- Found {} atoms.'.format(
-                            len(self._structures[-1].atoms)))
+                            len(structures[-1].atoms)))
                 elif 'Harmonic' in line:
                     if past_first_harm:
                         break
@@ -252,29 +731,66 @@ class GaussLog(File):
                 evec[i] *= weird_x
         self._evals = np.array(self._evals)
         self._evecs = np.array(self._evecs)
+        # Don't throw away the structures from the archive. This object may
+        # be shared by many calls to calculate through the parse cache.
+        if not self._archive_read:
+            self._structures = structures
+        arrays = structures_to_arrays(structures)
+        arrays.update(evals=self._evals, evecs=self._evecs)
+        self.save_to_disk_cache('out', arrays)
     # May want to move some attributes assigned to the structure class onto
     # this filetype class.
+    def return_last_archive(self):
+        """
+        Returns the text of the last archive in the Gaussian .log file.
+
+        Memory maps the file and searches backward from the end for the
+        start of an archive. The body of an archive can also hold "1\\1\\",
+        even at the start of a line, so it keeps going back while an earlier
+        start belongs to the same archive (its match ends in the same
+        place). That gives the same archive as matching every archive from
+        the start of the file and keeping the last.
+        """
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                match = None
+                end = len(mm)
+                while True:
+                    start = mm.rfind(ARCHIVE_START, 0, end)
+                    if start < 1:
+                        break
+                    end = start + len(ARCHIVE_START) - 1
+                    # Skip anything that isn't preceded by whitespace, and
+                    # archives that never finish.
+                    earlier = RE_ARCHIVE.match(mm, start - 1)
+                    if earlier is None:
+                        continue
+                    if match is None or earlier.end() == match.end():
+                        match = earlier
+                    else:
+                        # This is the end of the archive before.
+                        break
+                if match is None:
+                    raise Exception(
+                        "Couldn't find an archive in {}.".format(self.path))
+                return match.group(1)
+            finally:
+                mm.close()
     def read_archive(self):
         """
         Only reads last archive found in the Gaussian .log file.
         """
+        arrays = self.load_from_disk_cache('archive')
+        if arrays is not None:
+            self._structures = arrays_to_structures(arrays)
+            self._archive_read = True
+            return
         logger.log(5, 'READING: {}'.format(self.filename))
         struct = Structure()
         self._structures = [struct]
-        # Matches everything in between the start and end.
-        # (?s)  - Flag for re.compile which says that . matches all.
-        # \\\\  - One single \
-        # Start - " 1\1\".
-        # End   - Some number of \ followed by @. Not sure how many \ there
-        #         are, so this matches as many as possible. Also, this could
-        #         get separated by a line break (which would also include
-        #         adding in a space since that's how Gaussian starts new lines
-        #         in the archive).
-        # We pull out the last one [-1] in case there are multiple archives
-        # in a file.
-        arch = re.findall(
-            '(?s)(\s1\\\\1\\\\.*?[\\\\\n\s]+@)', 
-            open(self.path, 'r').read())[-1]
+        self._archive_read = True
+        arch = self.return_last_archive()
         logger.log(5, '  -- Located last archive.')
         # Make it into one string.
         arch = arch.replace('\n ', '')
@@ -380,6 +896,7 @@ class GaussLog(File):
             struct.hess = hess
             # SECTION 6
             # Not sure what this is.
+        self.save_to_disk_cache('archive', structures_to_arrays([struct]))
 
         # stuff = re.search(
         #     '\s1\\\\1\\\\.*?\\\\.*?\\\\.*?\\\\.*?\\\\.*?\\\\(?P<user>.*?)'
@@ -947,6 +1464,15 @@ class JaguarOut(File):
             self.import_file()
         return self._dummy_atom_eigenvector_indices
     def import_file(self):
+        arrays = self.load_from_disk_cache('out')
+        if arrays is not None:
+            self._structures = arrays_to_structures(arrays)
+            self._eigenvalues = arrays['eigenvalues']
+            self._eigenvectors = arrays['eigenvectors']
+            self._frequencies = arrays['frequencies']
+            self._dummy_atom_eigenvector_indices = \
+                arrays['dummy_atom_eigenvector_indices'].tolist()
+            return
         logger.log(10, 'READING: {}'.format(self.filename))
         frequencies = []
         force_constants = []
@@ -1054,6 +1580,14 @@ class JaguarOut(File):
                 len(self.eigenvalues)))
         logger.log(5, '  -- Read {} eigenvectors.'.format(
                 self.eigenvectors.shape))
+        arrays = structures_to_arrays(self._structures)
+        arrays.update(
+            eigenvalues=self._eigenvalues,
+            eigenvectors=self._eigenvectors,
+            frequencies=self._frequencies,
+            dummy_atom_eigenvector_indices=np.array(
+                self._dummy_atom_eigenvector_indices, dtype=int))
+        self.save_to_disk_cache('out', arrays)
         # num_atoms = len(structures[-1].atoms)
         # logger.log(5,
         #            '  -- ({}, {}) eigenvectors expected for linear '
@@ -1249,29 +1783,16 @@ class Mae(SchrodingerFile):
                   Time waited in between lookups of Schrodinger license
                   tokens.
         """
-        current_directory = os.getcwd()
-        os.chdir(self.directory)
         current_timeout = 0
         current_fails = 0
         licenses_available = False
         if check_tokens is True:
             logger.log(5, "  -- Checking Schrodinger tokens.")
             while True:
-                token_string = sp.check_output(
-                    '$SCHRODINGER/utilities/licutil -available', shell=True)
-                if 'SUITE' not in token_string:
+                suite_tokens, macro_tokens = return_available_tokens()
+                if suite_tokens is None:
                     licenses_available = True
                     break
-                suite_tokens = re.search(co.LIC_SUITE, token_string)
-                macro_tokens = re.search(co.LIC_MACRO, token_string)
-                if not suite_tokens or not macro_tokens:
-                    raise Exception(
-                        'The command "$SCHRODINGER/utilities/licutil '
-                        '-available" is not working with the current '
-                        'regex in calculate.py.\nOUTPUT:\n{}'.format(
-                            token_string))
-                suite_tokens = int(suite_tokens.group(1))
-                macro_tokens = int(macro_tokens.group(1))
                 if suite_tokens > co.MIN_SUITE_TOKENS and \
                         macro_tokens > co.MIN_MACRO_TOKENS:
                     licenses_available = True
@@ -1296,9 +1817,13 @@ class Mae(SchrodingerFile):
             while True:
                 try:
                     logger.log(5, 'RUNNING: {}'.format(self.name_com))
+                    # Use cwd rather than os.chdir. The working directory is
+                    # shared by every thread in the process, so changing it
+                    # here would break run_pool.
                     sp.check_output(
                         'bmin -WAIT {}'.format(
-                            os.path.splitext(self.name_com)[0]), shell=True)
+                            os.path.splitext(self.name_com)[0]), shell=True,
+                        cwd=self.directory)
                     break
                 except sp.CalledProcessError:
                     logger.warning('Call to MacroModel failed and I have no '
@@ -1309,7 +1834,80 @@ class Mae(SchrodingerFile):
                         continue
                     else:
                         raise
-        os.chdir(current_directory)
+
+def return_available_tokens():
+    """
+    Checks the number of available Schrodinger license tokens.
+
+    Returns
+    -------
+    tuple of (int, int) or (None, None)
+        Available Schrodinger Suite and MacroModel tokens. Returns
+        (None, None) if the license server doesn't report tokens for the
+        suite, which means there is no limit to worry about.
+    """
+    token_string = sp.check_output(
+        '$SCHRODINGER/utilities/licutil -available', shell=True)
+    if 'SUITE' not in token_string:
+        return None, None
+    suite_tokens = re.search(co.LIC_SUITE, token_string)
+    macro_tokens = re.search(co.LIC_MACRO, token_string)
+    if not suite_tokens or not macro_tokens:
+        raise Exception(
+            'The command "$SCHRODINGER/utilities/licutil '
+            '-available" is not working with the current '
+            'regex in calculate.py.\nOUTPUT:\n{}'.format(
+                token_string))
+    return int(suite_tokens.group(1)), int(macro_tokens.group(1))
+
+def run_pool(maes, jobs=1, check_tokens=True, **kwargs):
+    """
+    Runs the MacroModel calculations for many Mae objects at the same time.
+
+    Each job is a separate `bmin -WAIT` subprocess, so a pool of threads is
+    plenty to keep several of them going at once. The number of simultaneous
+    jobs is capped by the Schrodinger tokens available when the pool starts.
+    Every job still checks the tokens again before it launches, just like
+    it does when run serially.
+
+    Doesn't return until every calculation has finished.
+
+    Arguments
+    ---------
+    maes : list of Mae
+    jobs : int
+           Maximum number of MacroModel calculations running at once.
+    check_tokens : bool
+                   If False, skip looking for tokens and use `jobs` as is.
+    kwargs : passed to Mae.run
+    """
+    jobs = min(jobs, len(maes))
+    if check_tokens is True and jobs > 1:
+        suite_tokens, macro_tokens = return_available_tokens()
+        if suite_tokens is not None:
+            spare_tokens = min(suite_tokens - co.MIN_SUITE_TOKENS,
+                               macro_tokens - co.MIN_MACRO_TOKENS)
+            if spare_tokens < jobs:
+                logger.log(10, '  -- Only {} spare tokens. Reducing jobs from '
+                           '{} to {}.'.format(
+                        spare_tokens, jobs, max(spare_tokens, 1)))
+                jobs = max(spare_tokens, 1)
+    if jobs <= 1:
+        for mae in maes:
+            mae.run(check_tokens=check_tokens, **kwargs)
+        return
+    logger.log(10, '  -- Running {} MacroModel calculations using {} '
+               'jobs.'.format(len(maes), jobs))
+    pool = ThreadPool(jobs)
+    try:
+        # Using map_async and a timeout lets KeyboardInterrupt through to
+        # the main thread while we wait.
+        pool.map_async(
+            lambda mae: mae.run(check_tokens=check_tokens, **kwargs),
+            maes).get(timeout=sys.maxint)
+    finally:
+        pool.terminate()
+        pool.join()
 
 def pretty_timeout(current_timeout, macro_tokens, suite_tokens, end=False,
                    level=10, name_com=None):
@@ -1343,6 +1941,79 @@ def pretty_timeout(current_timeout, macro_tokens, suite_tokens, end=False,
     if end is True:
         logger.log(level, '-' * 50)
         
+def find_word(text, word, start=0):
+    """
+    Like str.find, but only finds word when it's surrounded by whitespace
+    or the ends of text. A regex would do the same, but it's much slower on
+    long text.
+    """
+    i = text.find(word, start)
+    while i != -1:
+        end = i + len(word)
+        if (i == 0 or text[i - 1].isspace()) and \
+                (end == len(text) or text[end].isspace()):
+            return i
+        i = text.find(word, i + 1)
+    return -1
+
+# Start of each row of the Hessian, "Element <row number> :".
+RE_MACRO_HESS_ROW = re.compile('(?<!\S)Element\s+(\d+)\s+:')
+# Stands in for "Element" when the whole Hessian is read as numbers.
+MACRO_ROW_MARKER = -1e300
+
+def read_macromodel_hessian(text, hessian):
+    """
+    Fills in a Hessian from the mass-weighted Hessian section of a
+    MacroModel log.
+
+    Column numbers and elements take turns. Normally, each "Element" is
+    swapped for a marker and each ":" is dropped, and then the whole section
+    is converted at once with np.fromstring. Pairs starting with the marker
+    give the row of the pairs that follow them.
+
+    Elements are the words with a decimal point, or NaN. If the numbers
+    don't line up that way, each row is read one word at a time instead.
+
+    Arguments
+    ---------
+    text : string
+           Section of the log between "Mass-weighted" and "Eigenvalues:".
+    hessian : np.ndarray
+              Changed in place.
+    """
+    first = find_word(text, 'Element')
+    if first == -1:
+        return
+    text = text[first:]
+    num_rows = text.count('Element')
+    num_elements = text.count('.') + text.count('NaN')
+    numbers = np.fromstring(
+        text.replace('Element', ' {!r} '.format(MACRO_ROW_MARKER)).replace(
+            ':', ' '),
+        dtype=float, sep=' ')
+    if len(numbers) == 2 * (num_rows + num_elements):
+        pairs = numbers.reshape(-1, 2)
+        is_row = pairs[:, 0] == MACRO_ROW_MARKER
+        row_nums = pairs[is_row, 1]
+        # Row number of every pair, counting the row markers seen so far.
+        row_nums = row_nums[np.cumsum(is_row) - 1][~is_row]
+        col_nums = pairs[~is_row, 0]
+        elements = pairs[~is_row, 1]
+        if is_row[0] and np.all(col_nums == np.floor(col_nums)) and \
+                np.all(col_nums >= 1) and \
+                np.all(col_nums <= hessian.shape[1]):
+            hessian[row_nums.astype(int) - 1, col_nums.astype(int) - 1] = \
+                elements
+            return
+    logger.log(5, '  -- Reading Hessian one word at a time.')
+    rows = RE_MACRO_HESS_ROW.split(text)
+    for row_num, row in itertools.izip(rows[1::2], rows[2::2]):
+        words = row.split()
+        col_nums = [int(x) for x in words if '.' not in x and x != 'NaN']
+        elements = [float(x) for x in words if '.' in x or x == 'NaN']
+        for col_num, element in zip(col_nums, elements):
+            hessian[int(row_num) - 1, col_num - 1] = element
+
 class MacroModelLog(File):
     """
     Used to retrieve data from MacroModel log files.
@@ -1361,52 +2032,15 @@ class MacroModelLog(File):
 
             hessian = np.zeros([num_atoms * 3, num_atoms * 3], dtype=float)
             logger.log(5, '  -- Creating {} Hessian matrix.'.format(hessian.shape))
-            words = lines.split()
-            section_hessian = False
-            start_row = False
-            start_col = False
-            for i, word in enumerate(words):
-                # 1. Start of Hessian section.
-                if word == 'Mass-weighted':
-                    section_hessian = True
-                    continue
-                # 5. End of Hessian. Add last row of Hessian and break.
-                if word == 'Eigenvalues:':
-                    for col_num, element in zip(col_nums, elements):
-                        hessian[row_num - 1, col_num - 1] = element
-                    section_hessian = False
-                    break
-                # 4. End of a Hessian row. Add to matrix and reset.
-                if section_hessian and start_col and word == 'Element':
-                    for col_num, element in zip(col_nums, elements):
-                        hessian[row_num - 1, col_num - 1] = element
-                    start_col = False
-                    start_row = True
-                    row_num = int(words[i + 1])
-                    col_nums = []
-                    elements = []
-                    continue
-                # 2. Start of a Hessian row.
-                if section_hessian and word == 'Element':
-                    row_num = int(words[i + 1])
-                    col_nums = []
-                    elements = []
-                    start_row = True
-                    continue
-                # 3. Okay, made it through the row number. Now look for columns
-                #    and elements.
-                if section_hessian and start_row and word == ':':
-                    start_row = False
-                    start_col = True
-                    continue
-                if section_hessian and start_col and '.' not in word and \
-                        word != 'NaN':
-                    col_nums.append(int(word))
-                    continue
-                if section_hessian and start_col and '.' in word or \
-                        word == 'NaN':
-                    elements.append(float(word))
-                    continue
+            # Jump straight to the Hessian section. Everything before and
+            # after it is ignored.
+            start = find_word(lines, 'Mass-weighted')
+            if start != -1:
+                start += len('Mass-weighted')
+                end = find_word(lines, 'Eigenvalues:', start)
+                if end == -1:
+                    end = len(lines)
+                read_macromodel_hessian(lines[start:end], hessian)
             self._hessian = hessian
             logger.log(5, '  -- Creating {} Hessian matrix.'.format(hessian.shape))
         return self._hessian
@@ -1418,97 +2052,238 @@ class MacroModel(File):
     def __init__(self, path):
         super(MacroModel, self).__init__(path)
         self._structures = None
+        self.comments = []
     @property
     def structures(self):
+        """
+        Reads the bonds, angles and torsions of every structure.
+
+        The lines that start structures and sections are found first with
+        a single regex search through the whole file. Then the rows of each
+        section are pulled out in one go with `MMO_ROWS`. The numbers in all
+        the rows of a type are converted together, and split into record
+        arrays for each structure (`Structure.records`). The bond, angle and
+        torsion objects are only made if something asks for them.
+
+        Comments (substructure names) are shared by many rows, so each is
+        stored once in `comments`. The records keep the index.
+        """
         if self._structures is None:
             logger.log(10, 'READING: {}'.format(self.filename))
             self._structures = []
+            self.comments = []
             with open(self.path, 'r') as f:
-                count_current = 0
-                count_input = 0
-                count_structure = 0
-                count_previous = 0
-                section = None
-                for line in f:
-                    if 'Input filename' in line:
-                        count_input += 1
-                    if 'Input Structure Name' in line:
-                        count_structure += 1
-                    count_previous = count_current
-                    # Sometimes only one of the above ("Input filename" and
-                    # "Input Structure Name") is used, sometimes both are used.
-                    # count_current will make sure you catch both.
-                    count_current = max(count_input, count_structure)
-                    # If these don't match, then we reached the end of a
-                    # structure.
-                    if count_current != count_previous:
-                        current_structure = Structure()
-                        self._structures.append(current_structure)
-                    # For each structure we come across, look for sections that
-                    # we are interested in: those pertaining to bonds, angles,
-                    # and torsions. Of course more could be added. We set the
-                    # section to None to mark the end of a section, and we leave
-                    # it None for parts of the file we don't care about.
-                    if 'BOND LENGTHS AND STRETCH ENERGIES' in line:
-                        section = 'bond'
-                    if 'ANGLES, BEND AND STRETCH BEND ENERGIES' in line:
-                        section = 'angle'
-                    if 'BEND-BEND ANGLES AND ENERGIES' in line:
-                        section = None
-                    if 'DIHEDRAL ANGLES AND TORSIONAL ENERGIES' in line:
-                        section = 'torsion'
-                    if 'DIHEDRAL ANGLES AND TORSIONAL CROSS-TERMS' in line:
-                        section = None
-                    if section == 'bond':
-                        bond = self.read_line_for_bond(line)
-                        if bond is not None:
-                            current_structure.bonds.append(bond)
-                    if section == 'angle':
-                        angle = self.read_line_for_angle(line)
-                        if angle is not None:
-                            current_structure.angles.append(angle)
-                    if section == 'torsion':
-                        torsion = self.read_line_for_torsion(line)
-                        if torsion is not None:
-                            current_structure.torsions.append(torsion)
+                text = f.read()
+            # Sometimes only one of "Input filename" and "Input Structure
+            # Name" is used, sometimes both are used. A structure starts
+            # whenever the larger of the two counts goes up.
+            count_input = 0
+            count_structure = 0
+            section = None
+            # For each type, the rows found and the index of the structure
+            # each row belongs to.
+            rows = dict((typ, []) for typ in MMO_ROWS)
+            owners = dict((typ, []) for typ in MMO_ROWS)
+            line_start = None
+            # Every line with a marker on it, in order, along with its
+            # markers.
+            lines = []
+            for match in RE_MMO_MARKER.finditer(text):
+                start = text.rfind('\n', 0, match.start()) + 1
+                if start == line_start:
+                    lines[-1][1].append(match.group(0))
+                else:
+                    lines.append((start, [match.group(0)]))
+                    line_start = start
+            lines.append((len(text), []))
+            for (start, markers), (end, _) in itertools.izip(
+                    lines[:-1], lines[1:]):
+                count_previous = max(count_input, count_structure)
+                count_input += markers.count('Input filename')
+                count_structure += markers.count('Input Structure Name')
+                if max(count_input, count_structure) != count_previous:
+                    self._structures.append(Structure())
+                # Markers are checked in the same order as MMO_SECTIONS.
+                for marker in MMO_SECTIONS:
+                    if marker in markers:
+                        section = MMO_SECTIONS[marker]
+                # The marker line counts as part of the section, just like
+                # the lines after it.
+                if section is None or not self._structures:
+                    continue
+                found = MMO_ROWS[section][1].findall(text, start, end)
+                rows[section].extend(found)
+                owners[section].extend(
+                    [len(self._structures) - 1] * len(found))
+            com_ids = {}
+            for typ, (num_atoms, _) in MMO_ROWS.iteritems():
+                records = self.rows_to_records(rows[typ], num_atoms, com_ids)
+                num_rows = np.bincount(
+                    np.array(owners[typ], dtype=int),
+                    minlength=len(self._structures))
+                ends = np.cumsum(num_rows)
+                for struct, start, end in itertools.izip(
+                        self._structures, (ends - num_rows).tolist(),
+                        ends.tolist()):
+                    struct.records[typ] = records[start:end]
+                    struct.comments = self.comments
             logger.log(5, '  -- Imported {} structure(s).'.format(
                     len(self._structures)))
         return self._structures
-    def read_line_for_bond(self, line):
-        match = co.RE_BOND.match(line)
-        if match:
-            atom_nums = map(int, [match.group(1), match.group(2)])
-            value = float(match.group(3))
-            comment = match.group(4).strip()
-            ff_row = int(match.group(5))
-            return Bond(atom_nums=atom_nums, comment=comment, value=value,
-                        ff_row=ff_row)
-        else:
-            return None
-    def read_line_for_angle(self, line):
-        match = co.RE_ANGLE.match(line)
-        if match:
-            atom_nums = map(int, [match.group(1), match.group(2),
-                                  match.group(3)])
-            value = float(match.group(4))
-            comment = match.group(5).strip()
-            ff_row = int(match.group(6))
-            return Angle(atom_nums=atom_nums, comment=comment, value=value,
-                         ff_row=ff_row)
-        else:
-            return None
-    def read_line_for_torsion(self, line):
-        match = co.RE_TORSION.match(line)
-        if match:
-            atom_nums = map(int, [match.group(1), match.group(2),
-                                  match.group(3), match.group(4)])
-            value = float(match.group(5))
-            comment = match.group(6).strip()
-            ff_row = int(match.group(7))
-            return Torsion(atom_nums=atom_nums, comment=comment, value=value,
-                           ff_row=ff_row)
+    def rows_to_records(self, rows, num_atoms, com_ids):
+        """
+        Turns rows read by `structures` into a record array.
+
+        All the numbers are joined and converted at once with
+        np.fromstring. Comments are added to `comments` the first time
+        they're seen.
+
+        Arguments
+        ---------
+        rows : list of tuples of strings
+               Groups matched by the regex in `MMO_ROWS`, which are the atom
+               numbers, value, comment and FF row.
+        num_atoms : int
+        com_ids : dict
+                  Index of each comment in `comments`. Updated in place.
+
+        Returns
+        -------
+        np.ndarray
+            See `return_records_dtype`.
+        """
+        records = np.empty(len(rows), dtype=return_records_dtype(num_atoms))
+        if not rows:
+            return records
+        numbers = np.fromstring(
+            ' '.join(' '.join(row[:num_atoms + 1]) + ' ' + row[-1]
+                     for row in rows),
+            dtype=float, sep=' ')
+        if len(numbers) != len(rows) * (num_atoms + 2):
+            raise Exception(
+                "Couldn't read the numbers in {}. Expected {} but found "
+                "{}.".format(
+                    self.path, len(rows) * (num_atoms + 2), len(numbers)))
+        numbers = numbers.reshape(len(rows), num_atoms + 2)
+        for i in xrange(num_atoms):
+            records['atm_{}'.format(i + 1)] = numbers[:, i]
+        records['value'] = numbers[:, num_atoms]
+        records['ff_row'] = numbers[:, num_atoms + 1]
+        for i, row in enumerate(rows):
+            comment = row[num_atoms + 1].strip()
+            com_id = com_ids.get(comment)
+            if com_id is None:
+                com_id = com_ids[comment] = len(self.comments)
+                self.comments.append(comment)
+            records['com_id'][i] = com_id
+        return records
+
+def return_records_dtype(num_atoms):
+    """
+    Returns the dtype of the record arrays used for bonds (2 atoms), angles
+    (3) or torsions (4).
+
+    Fields are atm_1, atm_2, etc., value, ff_row and com_id, the index of
+    the comment in `Structure.comments`.
+    """
+    return np.dtype(
+        [('atm_{}'.format(i + 1), int) for i in xrange(num_atoms)] +
+        [('value', float), ('ff_row', int), ('com_id', int)])
+
+class AngleIndex(object):
+    """
+    Finds the values of angles from their atom numbers.
+
+    Each angle is keyed by its sorted atom numbers packed into one int64,
+    so any order of the same 3 atoms finds it. The keys are sorted, and
+    lookups use np.searchsorted. If more than one angle has the same atoms,
+    the first one in the records is found.
+
+    Arguments
+    ---------
+    records : np.ndarray
+              Angle records. See `return_records_dtype`.
+    """
+    __slots__ = ['records', 'keys', 'values']
+    # Bits used for each atom number in a key.
+    bits = 21
+    def __init__(self, records):
+        self.records = records
+        keys = self.return_keys(np.column_stack(
+                [records['atm_1'], records['atm_2'], records['atm_3']]))
+        # Stable, so equal keys stay in the order of the records.
+        order = np.argsort(keys, kind='mergesort')
+        self.keys = keys[order]
+        self.values = records['value'][order]
+    @classmethod
+    def return_keys(cls, atoms):
+        """
+        Returns the key for each row of an array of 3 atom numbers.
+        """
+        atoms = np.sort(atoms, axis=1).astype(np.int64)
+        return (atoms[:, 0] << (2 * cls.bits)) | \
+            (atoms[:, 1] << cls.bits) | atoms[:, 2]
+    def find(self, atoms):
+        """
+        Looks up the angles made by each row of an array of 3 atom numbers.
+
+        Returns
+        -------
+        tuple of (np.ndarray of floats, np.ndarray of bools)
+            Values of the angles, and whether each was found. Values of
+            angles that weren't found are NaN.
+        """
+        keys = self.return_keys(atoms)
+        indices = np.searchsorted(self.keys, keys)
+        indices[indices == len(self.keys)] = 0
+        if len(self.keys):
+            found = self.keys[indices] == keys
         else:
-            return None
+            found = np.zeros(len(keys), dtype=bool)
+        values = np.empty(len(keys), dtype=float)
+        values.fill(np.nan)
+        values[found] = self.values[indices[found]]
+        return values, found
+
+def return_lines_regex(regex):
+    """
+    Makes a version of one of the .mmo regex (see constants) that finds
+    every matching row in a block of lines at once.
+
+    The originals are matched against one line at a time. Against a block
+    of lines, their whitespace could run across line breaks, so here it's
+    limited to spaces and tabs. Every match starts at the beginning of a
+    line, so each match is still exactly one line.
+    """
+    pattern = regex.pattern.replace('[\\w\\s', '[\\w \\t')
+    pattern = pattern.replace('\\s', '[ \\t]')
+    return re.compile('^' + pattern, re.MULTILINE)
+
+# Lines of a .mmo file that start structures or sections.
+RE_MMO_MARKER = re.compile(
+    'Input filename|'
+    'Input Structure Name|'
+    'BOND LENGTHS AND STRETCH ENERGIES|'
+    'ANGLES, BEND AND STRETCH BEND ENERGIES|'
+    'BEND-BEND ANGLES AND ENERGIES|'
+    'DIHEDRAL ANGLES AND TORSIONAL ENERGIES|'
+    'DIHEDRAL ANGLES AND TORSIONAL CROSS-TERMS')
+# Sections of the .mmo we are interested in: those pertaining to bonds,
+# angles, and torsions. Of course more could be added. None marks the end
+# of a section, and is left that way for parts of the file we don't care
+# about.
+MMO_SECTIONS = OrderedDict([
+        ('BOND LENGTHS AND STRETCH ENERGIES', 'bonds'),
+        ('ANGLES, BEND AND STRETCH BEND ENERGIES', 'angles'),
+        ('BEND-BEND ANGLES AND ENERGIES', None),
+        ('DIHEDRAL ANGLES AND TORSIONAL ENERGIES', 'torsions'),
+        ('DIHEDRAL ANGLES AND TORSIONAL CROSS-TERMS', None)])
+# Number of atoms and the regex used for the rows of each section. The
+# groups are the atom numbers, value, comment and FF row.
+MMO_ROWS = OrderedDict([
+        ('bonds', (2, return_lines_regex(co.RE_BOND))),
+        ('angles', (3, return_lines_regex(co.RE_ANGLE))),
+        ('torsions', (4, return_lines_regex(co.RE_TORSION)))])
 
 def select_structures(structures, indices, label):
         """
@@ -1580,14 +2355,101 @@ class Structure(object):
     """
     Data for a single structure/conformer/snapshot.
     """
-    __slots__ = ['atoms', 'bonds', 'angles', 'torsions', 'hess', 'props']
+    __slots__ = ['atoms', '_bonds', '_angles', '_torsions', 'hess', 'props',
+                 'records', 'comments', '_angle_index']
     def __init__(self):
         self.atoms = []
-        self.bonds = []
-        self.angles = []
-        self.torsions = []
+        self._bonds = None
+        self._angles = None
+        self._torsions = None
         self.hess = None
         self.props = {}
+        # Record arrays of bonds, angles and torsions, keyed by 'bonds',
+        # 'angles' and 'torsions'. Only used by `MacroModel`. See
+        # `return_records_dtype`.
+        self.records = {}
+        self.comments = []
+        self._angle_index = None
+    @property
+    def bonds(self):
+        if self._bonds is None:
+            self._bonds = self.records_to_objects('bonds')
+        return self._bonds
+    @bonds.setter
+    def bonds(self, value):
+        self._bonds = value
+    @property
+    def angles(self):
+        if self._angles is None:
+            self._angles = self.records_to_objects('angles')
+        return self._angles
+    @angles.setter
+    def angles(self, value):
+        self._angles = value
+    @property
+    def torsions(self):
+        if self._torsions is None:
+            self._torsions = self.records_to_objects('torsions')
+        return self._torsions
+    @torsions.setter
+    def torsions(self, value):
+        self._torsions = value
+    def records_to_objects(self, typ):
+        """
+        Makes `Bond`, `Angle` or `Torsion` objects from the record arrays.
+
+        Arguments
+        ---------
+        typ : string
+              'bonds', 'angles', or 'torsions'.
+
+        Returns
+        -------
+        list
+        """
+        records = self.records.get(typ)
+        if records is None:
+            return []
+        cls = STRUCTURAL_CLASSES[typ]
+        num_atoms = MMO_ROWS[typ][0]
+        return [cls(atom_nums=list(row[:num_atoms]),
+                    comment=self.comments[row[-1]],
+                    value=row[-3],
+                    ff_row=row[-2])
+                for row in records.tolist()]
+    def return_records(self, typ):
+        """
+        Returns the record arrays of bonds, angles or torsions, along with
+        the comments their com_id refer to.
+
+        Structures that weren't read from a .mmo don't have records, so
+        they're made from the objects.
+
+        Arguments
+        ---------
+        typ : string
+              'bonds', 'angles', or 'torsions'.
+
+        Returns
+        -------
+        tuple of (np.ndarray, list of strings)
+        """
+        if typ in self.records:
+            return self.records[typ], self.comments
+        things = getattr(self, typ)
+        num_atoms = MMO_ROWS[typ][0]
+        comments = []
+        com_ids = {}
+        records = np.empty(
+            len(things), dtype=return_records_dtype(num_atoms))
+        for i, thing in enumerate(things):
+            com_id = com_ids.get(thing.comment)
+            if com_id is None:
+                com_id = com_ids[thing.comment] = len(comments)
+                comments.append(thing.comment)
+            records[i] = tuple(thing.atom_nums) + \
+                (thing.value, thing.ff_row or 0, com_id)
+        return records, comments
     @property
     def coords(self):
         """
@@ -1680,67 +2542,83 @@ class Structure(object):
                     In .mmo files, the comment corresponds to the substructures
                     name. This way, we only fit bonds, angles, and torsions that
                     directly depend on our parameters.
+
+        Selection is done with masks on the record arrays (see
+        `return_records`), so Datum objects are only made for what's kept.
         """
-        data = []
         logger.log(1, '>>> typ: {}'.format(typ))
-        for thing in getattr(self, typ):
-            if (com_match and any(x in thing.comment for x in com_match)) or \
-                    com_match is None:
-                datum = thing.as_data(**kwargs)
-                # If it's a torsion we have problems.
-                # Have to check whether an angle inside the torsion is near 0 or 180.
-                if typ == 'torsions':
-                    atom_nums = [datum.atm_1, datum.atm_2, datum.atm_3, datum.atm_4]
-                    angle_atoms_1 = [atom_nums[0], atom_nums[1], atom_nums[2]]
-                    angle_atoms_2 = [atom_nums[1], atom_nums[2], atom_nums[3]]
-                    for angle in self.angles:
-                        if set(angle.atom_nums) == set(angle_atoms_1):
-                            angle_1 = angle.value
-                            break
-                    for angle in self.angles:
-                        if set(angle.atom_nums) == set(angle_atoms_2):
-                            angle_2 = angle.value
-                            break
-                    try:
-                        logger.log(1, '>>> atom_nums: {}'.format(atom_nums))
-                        logger.log(1, '>>> angle_1: {} / angle_2: {}'.format(
-                                angle_1, angle_2))
-                    except UnboundLocalError:
-                        logger.error('>>> atom_nums: {}'.format(atom_nums))
-                        logger.error(
-                            '>>> angle_atoms_1: {}'.format(angle_atoms_1))
-                        logger.error(
-                            '>>> angle_atoms_2: {}'.format(angle_atoms_2))
-                        if 'angle_1' not in locals():
-                            logger.error("Can't identify angle_1!")
-                        else:
-                            logger.error(">>> angle_1: {}".format(angle_1))
-                        if 'angle_2' not in locals():
-                            logger.error("Can't identify angle_2!")
-                        else:
-                            logger.error(">>> angle_2: {}".format(angle_2))
-                        raise
-                    if -5. < angle_1 < 5. or 175. < angle_1 < 185. or \
-                            -5. < angle_2 < 5. or 175. < angle_2 < 185.:
-                        logger.log(
-                            1, '>>> angle_1 or angle_2 is too close to 0 or 180!')
-                        pass
-                    else:
-                        data.append(datum)
-                    # atom_coords = [x.coords for x in atoms]
-                    # tor_1 = geo_from_points(atom_coords[0], atom_coords[1], atom_coords[2])
-                    # tor_2 = geo_from_points(atom_coords[1], atom_coords[2], atom_coords[3])
-                    # logger.log(1, '>>> tor_1: {} / tor_2: {}'.format(tor_1, tor_2))
-                    # if -5. < tor_1 < 5. or 175. < tor_1 < 185. or \
-                    #         -5. < tor_2 < 5. or 175. < tor_2 < 185.:
-                    #     logger.log(1, '>>> tor_1 or tor_2 is too close to 0 or 180!')
-                    #     pass
-                    # else:
-                    #     data.append(datum)
-                else:
-                    data.append(datum)
+        records, comments = self.return_records(typ)
+        if com_match is not None:
+            com_ids = [i for i, comment in enumerate(comments)
+                       if any(x in comment for x in com_match)]
+            records = records[np.in1d(records['com_id'], com_ids)]
+        if typ == 'torsions':
+            records = records[self.return_torsion_mask(records)]
+        num_atoms = MMO_ROWS[typ][0]
+        data = []
+        for row in records.tolist():
+            datum = datatypes.Datum(
+                val=row[num_atoms], typ=typ[0], ff_row=row[num_atoms + 1])
+            for i, atom_num in enumerate(row[:num_atoms]):
+                setattr(datum, 'atm_{}'.format(i+1), atom_num)
+            for k, v in kwargs.iteritems():
+                setattr(datum, k, v)
+            data.append(datum)
         assert data, "No data actually retrieved!"
         return data
+    def return_torsion_mask(self, records):
+        """
+        Returns a mask that is False for torsions where an angle inside the
+        torsion is near 0 or 180.
+
+        Arguments
+        ---------
+        records : np.ndarray
+                  Torsion records. See `return_records_dtype`.
+
+        Returns
+        -------
+        np.ndarray of bools
+        """
+        index = self.return_angle_index()
+        atoms = np.column_stack(
+            [records['atm_{}'.format(i + 1)] for i in xrange(4)])
+        angle_1, found_1 = index.find(atoms[:, :3])
+        angle_2, found_2 = index.find(atoms[:, 1:])
+        missing = ~(found_1 & found_2)
+        if missing.any():
+            for atom_nums, has_1, has_2 in itertools.izip(
+                    atoms[missing].tolist(), found_1[missing].tolist(),
+                    found_2[missing].tolist()):
+                logger.error('>>> atom_nums: {}'.format(atom_nums))
+                if not has_1:
+                    logger.error("Can't identify angle_1!")
+                if not has_2:
+                    logger.error("Can't identify angle_2!")
+            raise Exception(
+                "Can't find the angles inside {} torsion(s).".format(
+                    np.count_nonzero(missing)))
+        near_linear = \
+            ((-5. < angle_1) & (angle_1 < 5.)) | \
+            ((175. < angle_1) & (angle_1 < 185.)) | \
+            ((-5. < angle_2) & (angle_2 < 5.)) | \
+            ((175. < angle_2) & (angle_2 < 185.))
+        logger.log(
+            1, '>>> {} torsion(s) have angle_1 or angle_2 too close to 0 or '
+            '180!'.format(np.count_nonzero(near_linear)))
+        return ~near_linear
+    def return_angle_index(self):
+        """
+        Returns an `AngleIndex` of this structure's angles.
+
+        For structures read from a .mmo, the index is only made once.
+        """
+        if 'angles' not in self.records:
+            return AngleIndex(self.return_records('angles')[0])
+        if self._angle_index is None or \
+                self._angle_index.records is not self.records['angles']:
+            self._angle_index = AngleIndex(self.records['angles'])
+        return self._angle_index
     def get_aliph_hyds(self):
         """
         Returns the atom numbers of aliphatic hydrogens. These hydrogens
@@ -1907,7 +2785,7 @@ class Bond(object):
             typ = 'a'
         elif self.__class__.__name__.lower() == 'torsion':
             typ = 't'
-        datum = datatypes.Datum(val=self.value, typ=typ)
+        datum = datatypes.Datum(val=self.value, typ=typ, ff_row=self.ff_row)
         for i, atom_num in enumerate(self.atom_nums):
             setattr(datum, 'atm_{}'.format(i+1), atom_num)
         for k, v in kwargs.iteritems():
@@ -1930,6 +2808,9 @@ class Torsion(Bond):
                  ff_row=None):
         super(Torsion, self).__init__(atom_nums, comment, order, value, ff_row)
 
+# Class used for each type of structural data.
+STRUCTURAL_CLASSES = {'bonds': Bond, 'angles': Angle, 'torsions': Torsion}
+
 def return_filetypes_parser():
     """
     Returns an argument parser for filetypes module.
@@ -2,9 +2,7 @@
 """
 General code related to all optimization techniques.
 """
-import copy
 import collections
-import csv
 import glob
 import itertools
 import logging
@@ -68,6 +66,20 @@ class Gradient(opt.Optimizer):
     svd_cutoffs : list of None
                   Default is [0.1, 10.].
     svd_radii : list or None
+    sparse : bool
+             If True, only the elements of the Jacobian allowed by
+             `Dependencies` are calculated and stored, and differentiated
+             FFs are scored using only the data their parameter can change.
+             Default is False.
+    stop_margin : float or None
+                  If a float, trial FFs stop being scored as soon as one
+                  scores lower than the initial FF's score by more than this
+                  fraction, ex. 0.1 for 10%. The trial FFs that weren't
+                  scored are dropped. Default is None, which scores them all.
+                  With more than 1 process, the trial FFs are handed to the
+                  workers one batch of `processes` at a time, so stopping
+                  skips the batches that haven't started. The batch that
+                  gets there is always finished.
     """
     def __init__(self,
                  direc=None,
@@ -110,6 +122,10 @@ class Gradient(opt.Optimizer):
         self.svd_factors = [0.001, 0.01, 0.1, 1., 10.]
         self.svd_cutoffs = [0.1, 10.]
         self.svd_radii = None
+        # SPARSE JACOBIAN
+        self.sparse = False
+        # EVALUATING TRIAL FFS
+        self.stop_margin = None
 
     # Don't worry that self.ff isn't included in self.new_ffs.
     # opt.catch_run_errors will know what to do if self.new_ffs
@@ -126,6 +142,14 @@ class Gradient(opt.Optimizer):
         Ensure that the attributes in __init__ are set as you desire before
         using this function.
 
+        Parameters
+        ----------
+        ref_data : `datatypes.DataSet`, optional
+        restart : string, optional
+                  Differentiation file (par_diff_XXX.npy, or
+                  par_diff_XXX.txt from older versions) in the directory to
+                  use rather than differentiating again.
+
         Returns
         -------
         `datatypes.FF` (or subclass)
@@ -133,7 +157,8 @@ class Gradient(opt.Optimizer):
         """
         # We need reference data if you didn't provide it.
         if ref_data is None:
-            ref_data = opt.return_ref_data(self.args_ref)
+            ref_data = opt.return_ref_data(
+                self.args_ref, processes=self.processes)
 
         # We need the initial FF data.
         if self.ff.data is None:
@@ -151,6 +176,9 @@ class Gradient(opt.Optimizer):
         logger.log(20, 'INIT FF SCORE: {}'.format(self.ff.score))
         opt.pretty_ff_results(self.ff, level=20)
 
+        if self.sparse:
+            deps = Dependencies(self.ff.params, self.ff.data)
+
         logger.log(20, '~~ CENTRAL DIFFERENTIATION ~~'.rjust(79, '~'))
         if restart:
             par_file = restart
@@ -158,42 +186,45 @@ class Gradient(opt.Optimizer):
                        'differentiation file {}.'.format(par_file))
         else:
             # We need a file to hold the differentiated parameter data.
-            par_files = glob.glob(os.path.join(self.direc, 'par_diff_???.txt'))
+            # Numbering continues from the older text files too.
+            par_files = glob.glob(os.path.join(self.direc, 'par_diff_???.*'))
             if par_files:
                 par_files.sort()
                 most_recent_par_file = par_files[-1]
                 most_recent_par_file = most_recent_par_file.split('/')[-1]
                 most_recent_num = most_recent_par_file[9:12]
                 num = int(most_recent_num) + 1
-                par_file = 'par_diff_{:03d}.txt'.format(num)
+                par_file = 'par_diff_{:03d}.npy'.format(num)
             else:
-                par_file = 'par_diff_001.txt'
+                par_file = 'par_diff_001.npy'
             logger.log(20, '  -- Generating central differentiation '
                        'file {}.'.format(par_file))
-            f = open(os.path.join(self.direc, par_file), 'w')
-            csv_writer = csv.writer(f)
-            # Row 1 - Labels
-            # Row 2 - Weights
-            # Row 3 - Reference data values
-            # Row 4 - Initial FF data values
-            csv_writer.writerow([x.lbl for x in ref_data])
-            csv_writer.writerow([x.wht for x in ref_data])
-            csv_writer.writerow([x.val for x in ref_data])
-            csv_writer.writerow([x.val for x in self.ff.data])
             logger.log(20, '~~ DIFFERENTIATING PARAMETERS ~~'.rjust(79, '~'))
             # Save many FFs, each with their own parameter sets.
             ffs = opt.differentiate_ff(self.ff)
+            store = open_par_store(
+                os.path.join(self.direc, par_file), ref_data, self.ff.data,
+                len(ffs))
             logger.log(20, '~~ SCORING DIFFERENTIATED PARAMETERS ~~'.rjust(79, '~'))
-            for ff in ffs:
-                ff.export_ff(lines=self.ff.lines)
-                logger.log(20, '  -- Calculating {}.'.format(ff))
-                data = calculate.main(self.args_ff)
-                ff.score = compare.compare_data(ref_data, data)
+            # Results come back in the same order as ffs, even when they are
+            # calculated at the same time, so the rows are always written in
+            # the same order.
+            for i, (ff, data) in enumerate(opt.calculate_ffs(
+                    ffs, self.args_ff, lines=self.ff.lines,
+                    processes=self.processes)):
+                logger.log(20, '  -- Calculated {}.'.format(ff))
+                if self.sparse:
+                    # Central differentiation, so 2 FFs per parameter.
+                    ff.score = deps.score(
+                        ref_data, self.ff.data, self.ff.score, data, i // 2)
+                else:
+                    ff.score = compare.compare_data(ref_data, data)
                 opt.pretty_ff_results(ff)
                 # Write the data rather than storing it in memory. For large parameter
                 # sets, this could consume GBs of memory otherwise!
-                csv_writer.writerow([x.val for x in data])
-            f.close()
+                store[PAR_STORE_HEADER_ROWS + i] = data.val
+                store.flush()
+            del store
 
             # Make sure we have derivative information. Used for NR.
             #
@@ -210,21 +241,23 @@ class Gradient(opt.Optimizer):
                 self.do_svd:
             logger.log(20, '~~ JACOBIAN AND RESIDUAL VECTOR ~~'.rjust(79, '~'))
             # Setup the residual vector.
-            num_d = len(ref_data)
-            resid = np.empty((num_d, 1), dtype=float)
-            for i in xrange(0, num_d):
-                resid[i, 0] = ref_data[i].wht * (ref_data[i].val - self.ff.data[i].val)
+            resid = return_residual(ref_data, self.ff.data)
             # logger.log(5, 'RESIDUAL VECTOR:\n{}'.format(resid))
             logger.log(20, '  -- Formed {} residual vector.'.format(resid.shape))
             # Setup the Jacobian.
-            num_p = len(self.ff.params)
-            # Maybe should be a part of the Jacobian function.
-            jacob = np.empty((num_d, num_p), dtype=float)
-            jacob = return_jacobian(jacob, os.path.join(self.direc, par_file))
-            # logger.log(5, 'JACOBIAN:\n{}'.format(jacob))
-            logger.log(20, '  -- Formed {} Jacobian.'.format(jacob.shape))
-            ma = jacob.T.dot(jacob)
-            vb = jacob.T.dot(resid)
+            whts, par_data = read_par_file(os.path.join(self.direc, par_file))
+            if self.sparse:
+                jacob = return_sparse_jacobian(whts, par_data, deps)
+                logger.log(20, '  -- Formed {} Jacobian with {} stored '
+                           'elements.'.format(jacob.shape, len(jacob.values)))
+                ma = jacob.gram()
+                vb = jacob.rdot(resid)
+            else:
+                jacob = return_jacobian(whts, par_data)
+                # logger.log(5, 'JACOBIAN:\n{}'.format(jacob))
+                logger.log(20, '  -- Formed {} Jacobian.'.format(jacob.shape))
+                ma = jacob.T.dot(jacob)
+                vb = jacob.T.dot(resid)
             # We need these for most optimization methods.
             logger.log(5, ' MATRIX A AND VECTOR B '.center(79, '-'))
             # logger.log(5, 'A:\n{}'.format(ma))
@@ -245,22 +278,24 @@ class Gradient(opt.Optimizer):
             cleanup(self.new_ffs, self.ff, changes)
         if self.do_lagrange:
             logger.log(20, '~~ LAGRANGE ~~'.rjust(79, '~'))
-            for factor in sorted(self.lagrange_factors):
-                changes = do_lagrange(ma, vb, factor,
-                                      radii=self.lagrange_radii,
-                                      cutoffs=self.lagrange_cutoffs)
-                cleanup(self.new_ffs, self.ff, changes)
+            changes = do_lagrange(ma, vb, sorted(self.lagrange_factors),
+                                  radii=self.lagrange_radii,
+                                  cutoffs=self.lagrange_cutoffs)
+            cleanup(self.new_ffs, self.ff, changes)
         if self.do_levenberg:
             logger.log(20, '~~ LEVENBERG ~~'.rjust(79, '~'))
-            for factor in sorted(self.levenberg_factors):
-                changes = do_levenberg(ma, vb, factor,
-                                       radii=self.levenberg_radii,
-                                       cutoffs=self.levenberg_cutoffs)
-                cleanup(self.new_ffs, self.ff, changes)
+            changes = do_levenberg(ma, vb, sorted(self.levenberg_factors),
+                                   radii=self.levenberg_radii,
+                                   cutoffs=self.levenberg_cutoffs)
+            cleanup(self.new_ffs, self.ff, changes)
         if self.do_svd:
             logger.log(20, '~~ SINGULAR VALUE DECOMPOSITION ~~'.rjust(79, '~'))
             # J = U . s . VT
-            mu, vs, mvt = return_svd(jacob)
+            if self.sparse:
+                # The SVD still needs the whole matrix.
+                mu, vs, mvt = return_svd(jacob.toarray())
+            else:
+                mu, vs, mvt = return_svd(jacob)
             logger.log(1, '>>> mu.shape: {}'.format(mu.shape))
             logger.log(1, '>>> vs.shape: {}'.format(vs.shape))
             logger.log(1, '>>> mvt.shape: {}'.format(mvt.shape))
@@ -281,12 +316,35 @@ class Gradient(opt.Optimizer):
         if self.new_ffs:
             logger.log(20, '~~ EVALUATING TRIAL FF(S) ~~'.rjust(79, '~'))
             for ff in self.new_ffs:
-                data = opt.cal_ff(ff, self.args_ff, parent_ff=self.ff)
-                # Shouldn't need to zero anymore.
-                ff.score = compare.compare_data(ref_data, data)
-                opt.pretty_ff_results(ff)
+                ff.path = self.ff.path
+            # With more than 1 process, the trial FFs are scored at the same
+            # time, each in its own scratch workspace. Batches let stopping
+            # early skip work rather than throw away results.
+            results = opt.calculate_ffs(
+                self.new_ffs, self.args_ff, lines=self.ff.lines,
+                processes=self.processes,
+                in_batches=self.stop_margin is not None)
+            scored_ffs = []
+            try:
+                for ff, data in results:
+                    # Shouldn't need to zero anymore.
+                    ff.score = compare.compare_data(ref_data, data)
+                    opt.pretty_ff_results(ff)
+                    scored_ffs.append(ff)
+                    if self.stop_margin is not None and \
+                            ff.score < self.ff.score * (1. - self.stop_margin):
+                        logger.log(
+                            20, '  -- {} improved the score by more than {}. '
+                            'Skipping {} trial FF(s).'.format(
+                                ff, self.stop_margin,
+                                len(self.new_ffs) - len(scored_ffs)))
+                        break
+            finally:
+                # Removes the workspaces right away, even after stopping
+                # early.
+                results.close()
             self.new_ffs = sorted(
-                self.new_ffs, key=lambda x: x.score)
+                scored_ffs, key=lambda x: x.score)
             # Check for improvement.
             if self.new_ffs[0].score < self.ff.score:
                 ff = self.new_ffs[0]
@@ -403,7 +461,7 @@ def do_method(func):
     return wrapper
 
 @do_method
-def do_lagrange(ma, vb, factor):
+def do_lagrange(ma, vb, factors):
     """
     Lagrange multipliers.
 
@@ -411,18 +469,15 @@ def do_lagrange(ma, vb, factor):
     ----------
     ma : NumPy matrix
     vb : NumPy vector
-    factor : float
+    factors : list of floats
     """
-    mac = copy.deepcopy(ma)
-    ind = np.diag_indices_from(mac)
-    logger.log(5, 'A:\n{}'.format(mac))
-    mac[ind] = mac[ind] + factor
-    logger.log(5, 'A:\n{}'.format(mac))
-    changes = solver(mac, vb)
-    return [('LAGRANGE F{}'.format(factor), changes)]
+    logger.log(5, 'A:\n{}'.format(ma))
+    all_changes = return_damped_changes(ma, vb, factors)
+    return [('LAGRANGE F{}'.format(factor), changes)
+            for factor, changes in itertools.izip(factors, all_changes)]
 
 @do_method
-def do_levenberg(ma, vb, factor):
+def do_levenberg(ma, vb, factors):
     """
     Lagrange multipliers.
 
@@ -430,14 +485,42 @@ def do_levenberg(ma, vb, factor):
     ----------
     ma : NumPy matrix
     vb : NumPy vector
-    factor : float
+    factors : list of floats
     """
-    mac = copy.deepcopy(ma)
-    ind = np.diag_indices_from(mac)
-    mac[ind] = mac[ind] + factor
-    logger.log(5, 'A:\n{}'.format(mac))
-    changes = solver(mac, vb)
-    return [('LM {}'.format(factor), changes)]
+    logger.log(5, 'A:\n{}'.format(ma))
+    all_changes = return_damped_changes(ma, vb, factors)
+    return [('LM {}'.format(factor), changes)
+            for factor, changes in itertools.izip(factors, all_changes)]
+
+def return_damped_changes(ma, vb, factors, rcond=10**-12):
+    """
+    Solves (A + factor * I) . x = b for many factors at once.
+
+    A is symmetric, so A = V . w . V^T, and adding a factor to the diagonal
+    only shifts the eigenvalues. A is decomposed once, and each solution is
+    V . (w + factor)^-1 . V^T . b. Like `solver`, shifted eigenvalues
+    smaller than rcond times the largest are left out rather than inverted.
+
+    Parameters
+    ----------
+    ma : NumPy matrix
+    vb : NumPy vector
+    factors : list of floats
+    rcond : float
+
+    Returns
+    -------
+    np.ndarray
+        One row of parameter changes for each factor.
+    """
+    evals, evecs = np.linalg.eigh(ma)
+    proj = evecs.T.dot(vb).flatten()
+    shifted = evals + np.array(factors, dtype=float)[:, np.newaxis]
+    size = np.abs(shifted)
+    is_big = size > rcond * size.max(axis=1)[:, np.newaxis]
+    inverted = np.zeros(shifted.shape, dtype=float)
+    inverted[is_big] = 1. / shifted[is_big]
+    return (inverted * proj).dot(evecs.T)
 
 @do_method
 def do_lstsq(ma, vb):
@@ -489,129 +572,111 @@ def do_newton(params):
 
 @do_method
 def do_svd_w_thresholds(mu, vs, mvt, resid, factors):
-    logger.log(1, '>>> do_svd_w_thresholds <<<')
-    factors.sort(reverse=True)
-    all_changes = []
+    """
+    Truncated SVD, dropping the inverted singular values above each factor.
+
+    Factors are used from largest to smallest, so each drops at least the
+    values dropped by the one before. A factor that drops nothing new is
+    skipped, and the factors stop once everything is dropped.
 
+    Parameters
+    ----------
+    mu, vs, mvt : np.ndarray
+                  From `return_svd`.
+    resid : np.ndarray
+    factors : list of floats
+    """
+    logger.log(1, '>>> do_svd_w_thresholds <<<')
+    factors = sorted(factors, reverse=True)
     # The largest values come 1st in the array vs.
     # When we invert it, the smallest values come 1st.
     vsi = invert_vector(vs)
-    msi = np.diag(vsi)
-
-    # For reduced SVD.
-    # The largest values come 1st in this array.
-    # ms = np.diag(vs)
-    # When we invert it, the smallest values come 1st.
-    # msi = np.linalg.inv(ms)
-
-    logger.log(10, ' NO FACTORS '.center(79, '-'))
-    logger.log(1, '>>> msi:\n{}'.format(msi))
-    changes = mvt.T.dot(msi.dot(mu.T.dot(resid)))
-    changes = changes.flatten()
-    logger.log(1, '>>> changes:\n{}'.format(changes))
-
+    # Which inverted singular values each factor keeps.
+    keep = vsi <= np.array(factors)[:, np.newaxis]
+    num_kept = (keep & (vsi != 0.)).sum(axis=1)
+    selected = []
     for i, factor in enumerate(factors):
         logger.log(10, ' FACTOR: {} '.format(factor).center(79, '-'))
-        old_msi = copy.deepcopy(msi)
-        logger.log(1, '>>> msi:\n{}'.format(msi))
-        logger.log(1, '>>> old_msi:\n{}'.format(old_msi))
-        for i in xrange(0, len(vs)):
-            if msi[i, i] > factor:
-                msi[i, i] = 0.
-        logger.log(1, '>>> msi:\n{}'.format(msi))
-        logger.log(1, '>>> old_msi:\n{}'.format(old_msi))
         # Start checking after the first factor.
         # If there's no change in the vector, skip to next higher factor.
-        if i != 0 and np.all(msi == old_msi):
+        if i != 0 and num_kept[i] == num_kept[i - 1]:
             logger.warning('  -- No change with factor {}. Skipping.'.format(
                     factor))
             continue
         # If the vector is all zeros, quit.
-        if np.all(msi == np.zeros(msi.shape)):
+        if num_kept[i] == 0:
             logger.log(10, '  -- Vector is all zeros. Breaking.')
             break
-
-        # Old code.
-        # reform = mu.dot(np.diag(vs)).dot(mv)
-        # logger.log(1, '>>> reform:\n{}'.format(reform))
-        # changes = solver(reform, vb)
-        # For full SVD.
-        # m = mu.shape[0]
-        # n = mv.shape[0]
-        # ms = np.zeros((m, n), dtype=float)
-        # ms[:n, :n] = np.diag(vs)
-        # For reduced SVD.
-        # ms = np.diag(vs)
-        
-        changes = mvt.T.dot(msi.dot(mu.T.dot(resid)))
-        # We need this to be shaped like a list so transpose the parameter
-        # changes.
-        changes = changes.flatten()
-        logger.log(1, '>>> changes:\n{}'.format(changes))
-        all_changes.append(('SVD T{}'.format(factor), changes))
+        selected.append(i)
+    changes = return_svd_changes(mu, vsi, mvt, resid, keep[selected])
+    all_changes = [('SVD T{}'.format(factors[i]), x)
+                   for i, x in itertools.izip(selected, changes)]
     logger.log(1, '>>> all_changes:\n{}'.format(all_changes))
     return all_changes
 
 @do_method
 def do_svd_wo_thresholds(mu, vs, mvt, resid):
+    """
+    Truncated SVD, dropping 0, 1, 2, etc. of the smallest singular values
+    (the largest inverted values). Truncations that drop a value that was
+    already zero are skipped.
+
+    Parameters
+    ----------
+    mu, vs, mvt : np.ndarray
+                  From `return_svd`.
+    resid : np.ndarray
+    """
     logger.log(1, '>>> do_svd_wo_thresholds <<<')
-    all_changes = []
     logger.log(1, '>>> vs:\n{}'.format(vs))
-
     # The largest values come 1st in the array vs.
     # When we invert it, the smallest values come 1st.
     vsi = invert_vector(vs)
-    msi = np.diag(vsi)
-
-    # For reduced SVD.
-    # The largest values come 1st in this array.
-    # ms = np.diag(vs)
-    # When we invert it, the smallest values come 1st.
-    # msi = np.linalg.inv(ms)
-
-
-    logger.log(10, ' ZEROED 0 ELEMENTS '.center(79, '-'))
-    logger.log(1, '>>> msi:\n{}'.format(msi))
-    changes = mvt.T.dot(msi.dot(mu.T.dot(resid)))
-    changes = changes.flatten()
-    logger.log(1, '>>> changes:\n{}'.format(changes))
-    all_changes.append(('SVD Z0', changes))
-
-    for i in xrange(0, len(vs) - 1):
-        # Save a copy to check whether or not anything actually changes after
-        # zeroing.
-        old_msi = copy.deepcopy(msi)
-        logger.log(10, ' ZEROED {} ELEMENTS '.format(i + 1).center(79, '-'))
-        # We are zeroing the largest values.
-        msi[-(i + 1), -(i + 1)] = 0.
-        logger.log(1, '>>> msi:\n{}'.format(msi))
-        if np.allclose(msi, old_msi):
+    num = len(vs)
+    # Row i keeps all but the last i inverted singular values.
+    keep = np.arange(num) < (num - np.arange(num))[:, np.newaxis]
+    selected = [0]
+    for i in xrange(1, num):
+        logger.log(10, ' ZEROED {} ELEMENTS '.format(i).center(79, '-'))
+        if np.isclose(0., vsi[-i]):
             logger.warning('  -- No change with zeroing {} elements. '
-                           'Skipping'.format(i + 1))
+                           'Skipping'.format(i))
             continue
-
-        # Old code.
-        # reform = mu.dot(np.diag(vs)).dot(mv)
-        # logger.log(1, '>>> reform:\n{}'.format(reform))
-        # changes = solver(reform, vb)
-        # For full SVD.
-        # m = mu.shape[0]
-        # n = mv.shape[0]
-        # ms = np.zeros((m, n), dtype=float)
-        # ms[:n, :n] = np.diag(vs)
-        # For reduced SVD.
-        # ms = np.diag(vs)
-        
-        changes = mvt.T.dot(msi.dot(mu.T.dot(resid)))
-        # We need this to be shaped like a list so transpose the parameter
-        # changes.
-        changes = changes.flatten()
-        logger.log(1, '>>> changes:\n{}'.format(changes))
-        all_changes.append(('SVD Z{}'.format(i + 1), changes))
-
+        selected.append(i)
+    changes = return_svd_changes(mu, vsi, mvt, resid, keep[selected])
+    all_changes = [('SVD Z{}'.format(i), x)
+                   for i, x in itertools.izip(selected, changes)]
     logger.log(1, '>>> all_changes:\n{}'.format(all_changes))
     return all_changes
 
+def return_svd_changes(mu, vsi, mvt, resid, keep):
+    """
+    Parameter changes from many truncations of one SVD at once.
+
+    For J = U . s . VT, the changes are VT^T . s^-1 . U^T . r. U^T . r and
+    s^-1 are the same for every truncation, so they're only worked out
+    once. Each truncation just picks which terms are kept, and all of the
+    changes come from a single matrix product.
+
+    Parameters
+    ----------
+    mu, mvt : np.ndarray
+              From `return_svd`.
+    vsi : np.ndarray
+          Inverted singular values (see `invert_vector`).
+    resid : np.ndarray
+    keep : np.ndarray of bools
+           One row for each truncation. True for the inverted singular
+           values it keeps.
+
+    Returns
+    -------
+    np.ndarray
+        One row of parameter changes for each truncation.
+    """
+    proj = vsi * mu.T.dot(resid).flatten()
+    return (keep * proj).dot(mvt)
+
 def invert_vector(vector, threshold=0.0001):
     """
     Inverts a vector. If the absolute value of an element in the vector is
@@ -627,13 +692,9 @@ def invert_vector(vector, threshold=0.0001):
     -------
     np.array
     """
-    new_vector = np.empty(vector.shape, dtype=float)
-    for i, x in enumerate(vector):
-        if abs(x) < threshold:
-            new_x = 0.
-        else:
-            new_x = 1. / x
-        new_vector[i] = new_x
+    new_vector = np.zeros(vector.shape, dtype=float)
+    is_big = np.abs(vector) >= threshold
+    new_vector[is_big] = 1. / vector[is_big]
     return new_vector
 
 def return_ff(orig_ff, changes, method):
@@ -642,36 +703,297 @@ def return_ff(orig_ff, changes, method):
     """
     new_ff = orig_ff.__class__()
     new_ff.method = method
-    new_ff.params = copy.deepcopy(orig_ff.params)
+    vector = orig_ff.param_vector.copy()
     try:
-        update_params(new_ff.params, changes)
+        update_params(vector, changes)
     except datatypes.ParamError as e:
         logger.warning(e)
     else:
+        new_ff.param_vector = vector
         return new_ff 
 
-def return_jacobian(jacob, par_file):
+# Rows at the start of a differentiation file: weights, reference values and
+# the values of the FF that was differentiated.
+PAR_STORE_HEADER_ROWS = 3
+
+def open_par_store(path, ref_data, ff_data, num_ffs):
+    """
+    Makes the binary file that holds the results of differentiation and
+    returns it memory mapped, ready to be filled one row at a time.
+
+    It's a .npy file with one row for each of `PAR_STORE_HEADER_ROWS`
+    followed by one row for each differentiated FF. The rows of the FFs
+    start as NaN, so a file from a run that stopped early can be spotted.
+
+    Parameters
+    ----------
+    path : string
+    ref_data : `datatypes.DataSet`
+    ff_data : `datatypes.DataSet`
+    num_ffs : int
+
+    Returns
+    -------
+    np.memmap
+    """
+    store = np.lib.format.open_memmap(
+        path, mode='w+', dtype=float,
+        shape=(PAR_STORE_HEADER_ROWS + num_ffs, len(ref_data)))
+    store[0] = ref_data.wht
+    store[1] = ref_data.val
+    store[2] = ff_data.val
+    store[PAR_STORE_HEADER_ROWS:] = np.nan
+    store.flush()
+    return store
+
+def read_par_file(par_file):
+    """
+    Reads the results of differentiation.
+
+    Binary .npy files (see `open_par_store`) are memory mapped rather than
+    read. Text files, which were used before, can still be read so that
+    older files can be restarted from.
+
+    Parameters
+    ----------
+    par_file : string
+
+    Returns
+    -------
+    whts : np.ndarray of floats
+    par_data : np.ndarray of floats
+               One row of data for each differentiated FF, in the order they
+               were made. For central differentiation, rows 2 * i and
+               2 * i + 1 are the forward and backward steps of parameter i.
+    """
+    logger.log(15, 'READING: {}'.format(par_file))
+    if os.path.splitext(par_file)[1] == '.npy':
+        store = np.load(par_file, mmap_mode='r')
+        par_data = store[PAR_STORE_HEADER_ROWS:]
+        missing = np.where(np.isnan(par_data).all(axis=1))[0]
+        assert len(missing) == 0, \
+            '{} is missing the data of {} FFs. Did differentiation ' \
+            'finish?'.format(par_file, len(missing))
+        # Views of the file, but as plain arrays.
+        return np.asarray(store[0]), np.asarray(par_data)
     with open(par_file, 'r') as f:
-        logger.log(15, 'READING: {}'.format(par_file))
         f.readline() # Labels.
-        whts = map(float, f.readline().split(',')) # Weights.
+        whts = np.array(map(float, f.readline().split(','))) # Weights.
         f.readline() # Reference values.
         f.readline() # Original values.
-        # This is only for central differentiation.
-        ff_ind = 0
-        while True:
-            l1 = f.readline()
-            l2 = f.readline()
-            if not l2:
-                break
-            inc_data = map(float, l1.split(','))
-            dec_data = map(float, l2.split(','))
-            for data_ind, (inc_datum, dec_datum) in \
-                    enumerate(itertools.izip(inc_data, dec_data)):
-                dydp = (inc_datum - dec_datum) / 2
-                jacob[data_ind, ff_ind] = whts[data_ind] * dydp
-            ff_ind += 1
-    return jacob
+        par_data = np.array([map(float, line.split(',')) for line in f])
+    return whts, par_data
+
+def return_residual(r_data, c_data):
+    """
+    Returns the weighted residual vector, w * (x_r - x_c), as a column.
+
+    Parameters
+    ----------
+    r_data : `datatypes.DataSet`
+    c_data : `datatypes.DataSet`
+
+    Returns
+    -------
+    np.ndarray of floats
+        Shape is (number of data points, 1).
+    """
+    resid = r_data.wht * (r_data.val - c_data.val)
+    return resid.reshape((len(r_data), 1))
+
+def return_jacobian(whts, par_data):
+    """
+    Forms the Jacobian from central differentiation.
+
+    Parameters
+    ----------
+    whts : np.ndarray of floats
+    par_data : np.ndarray of floats
+               See `read_par_file`.
+
+    Returns
+    -------
+    np.ndarray of floats
+        Shape is (number of data points, number of parameters).
+    """
+    num_p = len(par_data) // 2
+    inc_data = par_data[0:2 * num_p:2]
+    dec_data = par_data[1:2 * num_p:2]
+    dydp = (inc_data - dec_data) / 2
+    return (whts * dydp).T
+
+def return_sparse_jacobian(whts, par_data, deps):
+    """
+    Like `return_jacobian`, but only keeps the elements of each column that
+    `deps` allows.
+
+    Parameters
+    ----------
+    whts : np.ndarray of floats
+    par_data : np.ndarray of floats
+               See `read_par_file`.
+    deps : `Dependencies`
+
+    Returns
+    -------
+    `SparseJacobian`
+    """
+    assert len(par_data) >= 2 * len(deps.rows), \
+        'Differentiation data for {} parameters, but expected {}.'.format(
+        len(par_data) // 2, len(deps.rows))
+    columns = []
+    # This is only for central differentiation.
+    for ff_ind, rows in enumerate(deps.rows):
+        inc_data = par_data[2 * ff_ind][rows]
+        dec_data = par_data[2 * ff_ind + 1][rows]
+        dydp = (inc_data - dec_data) / 2
+        columns.append((rows, whts[rows] * dydp))
+    return SparseJacobian(len(whts), columns)
+
+class Dependencies(object):
+    """
+    Which data points each parameter can change.
+
+    Bonds, angles and torsions read from .mmo files record the row of the FF
+    they use (`datatypes.DataSet.ff_row`). These are taken to depend only on
+    the parameters in that row. That's exact when the geometry is fixed, but
+    an approximation for optimized geometries, where any parameter can move
+    the atoms a little. Every other data point, such as energies and Hessian
+    elements, may depend on every parameter.
+
+    Attributes
+    ----------
+    rows : list of np.ndarray of ints
+           For each parameter, the sorted indices of the data points it can
+           change.
+    """
+    def __init__(self, params, data):
+        every_param = np.where(data.ff_row == 0)[0]
+        # Sorted by FF row, so the data points for one row are a slice.
+        order = np.argsort(data.ff_row, kind='mergesort')
+        ff_rows = data.ff_row[order]
+        self.rows = []
+        for param in params:
+            mm3_row = getattr(param, 'mm3_row', None)
+            if mm3_row:
+                start, end = np.searchsorted(ff_rows, [mm3_row, mm3_row + 1])
+                self.rows.append(np.union1d(every_param, order[start:end]))
+            else:
+                self.rows.append(np.arange(len(data)))
+        num = sum(len(x) for x in self.rows)
+        logger.log(20, '  -- {} of {} Jacobian elements can be '
+                   'nonzero.'.format(num, len(data) * len(params)))
+    def score(self, r_data, base_data, base_score, c_data, param_index):
+        """
+        Scores FF data that differs from the base FF's data only in the
+        parameter at `param_index`. Only the data points that parameter can
+        change are compared.
+
+        Arguments
+        ---------
+        r_data : `datatypes.DataSet`
+        base_data : `datatypes.DataSet`
+                    Data of the FF that was differentiated.
+        base_score : float
+        c_data : `datatypes.DataSet`
+        param_index : int
+
+        Returns
+        -------
+        float
+        """
+        compare.correlate_energies(r_data, c_data)
+        rows = self.rows[param_index]
+        wht = r_data.wht[rows]
+        r_val = r_data.val[rows]
+        is_tor = r_data.typ[rows] == 't'
+        old = compare.objective_function(
+            wht, r_val, base_data.val[rows], is_tor)
+        new = compare.objective_function(
+            wht, r_val, c_data.val[rows], is_tor)
+        return base_score - old + new
+
+class SparseJacobian(object):
+    """
+    Jacobian that only stores the elements allowed by `Dependencies`.
+
+    Laid out like a compressed sparse column matrix. Only has what the
+    gradient methods need.
+
+    Attributes
+    ----------
+    shape : tuple of ints
+    indptr : np.ndarray of ints
+             Column j is indptr[j]:indptr[j + 1] of indices and values.
+    indices : np.ndarray of ints
+              Row of each stored element.
+    values : np.ndarray of floats
+    """
+    def __init__(self, num_rows, columns):
+        self.shape = (num_rows, len(columns))
+        self.indptr = np.zeros(len(columns) + 1, dtype=int)
+        self.indptr[1:] = np.cumsum([len(x[0]) for x in columns])
+        if columns:
+            self.indices = np.concatenate([x[0] for x in columns])
+            self.values = np.concatenate([x[1] for x in columns])
+        else:
+            self.indices = np.array([], dtype=int)
+            self.values = np.array([], dtype=float)
+    def column(self, j):
+        """
+        Returns the rows and values of the stored elements in column j.
+        """
+        start, end = self.indptr[j], self.indptr[j + 1]
+        return self.indices[start:end], self.values[start:end]
+    def toarray(self):
+        matrix = np.zeros(self.shape, dtype=float)
+        cols = np.repeat(np.arange(self.shape[1]), np.diff(self.indptr))
+        matrix[self.indices, cols] = self.values
+        return matrix
+    def gram(self):
+        """
+        Returns J^T . J.
+
+        Data points stored in every column (ex. energies) are done as one
+        dense block. The rest only pair up the elements that share a data
+        point, which are summed into J^T . J with np.add.at.
+        """
+        num_p = self.shape[1]
+        cols = np.repeat(np.arange(num_p), np.diff(self.indptr))
+        counts = np.bincount(self.indices, minlength=self.shape[0])
+        ma = np.zeros((num_p, num_p), dtype=float)
+        is_full = counts[self.indices] == num_p
+        if is_full.any():
+            full_rows = np.flatnonzero(counts == num_p)
+            block = np.zeros((len(full_rows), num_p), dtype=float)
+            block[np.searchsorted(full_rows, self.indices[is_full]),
+                  cols[is_full]] = self.values[is_full]
+            ma += block.T.dot(block)
+        # Sorted by data point, so the elements sharing one are a slice.
+        order = np.argsort(self.indices[~is_full], kind='mergesort')
+        rows = self.indices[~is_full][order]
+        cols = cols[~is_full][order]
+        values = self.values[~is_full][order]
+        # Every element is paired with every element in its slice,
+        # including itself.
+        lengths = counts[rows]
+        starts = np.searchsorted(rows, rows)
+        left = np.repeat(np.arange(len(rows)), lengths)
+        right = np.repeat(starts, lengths) + (
+            np.arange(len(left)) - np.repeat(np.cumsum(lengths) - lengths,
+                                             lengths))
+        np.add.at(ma, (cols[left], cols[right]), values[left] * values[right])
+        return ma
+    def rdot(self, vector):
+        """
+        Returns J^T . vector.
+        """
+        cols = np.repeat(np.arange(self.shape[1]), np.diff(self.indptr))
+        result = np.zeros((self.shape[1],) + vector.shape[1:], dtype=float)
+        np.add.at(result, cols,
+                  self.values.reshape((-1,) + (1,) * (vector.ndim - 1)) *
+                  vector[self.indices])
+        return result
 
 def return_svd(matrix, check=False):
     """
@@ -709,20 +1031,21 @@ def solver(ma, vb):
         np.linalg.lstsq(ma, vb, rcond=10**-12)
     return np.concatenate(changes).tolist()
 
-def update_params(params, changes):
+def update_params(vector, changes):
     """
     Takes the parameters and the unscaled changes, determines the properly
     scaled parameter changes, and increments the parameter values by them.
 
     Parameters
     ----------
-    params : list of `datatypes.Param` (or subclass)
+    vector : `datatypes.ParamVector`
     changes : list of floats
                     Unscaled changes to the parameter values.
     """
     try:
-        for param, change in itertools.izip(params, changes):
-            param.value += change * param.step
+        vector.values += np.asarray(changes, dtype=float) * \
+            vector.return_steps()
+        vector.check()
     except datatypes.ParamError as e:
         logger.warning(e.message)
         raise
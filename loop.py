@@ -29,6 +29,7 @@ class Loop(object):
         self.args_ff = None
         self.args_ref = None
         self.loop_lines = None
+        self.processes = 1
         self.ref_data = None
     def opt_loop(self):
         change = None
@@ -98,6 +99,7 @@ class Loop(object):
                 loop.ff = self.ff
                 loop.args_ff = self.args_ff
                 loop.args_ref = self.args_ref
+                loop.processes = self.processes
                 loop.ref_data = self.ref_data
                 loop.loop_lines = inner_loop_lines
                 # Log commands.
@@ -113,7 +115,8 @@ class Loop(object):
                     20, '~~ CALCULATING REFERENCE DATA ~~'.rjust(79, '~'))
                 if len(cols) > 1:
                     self.args_ref = ' '.join(cols[1:]).split()
-                self.ref_data = opt.return_ref_data(self.args_ref)
+                self.ref_data = opt.return_ref_data(
+                    self.args_ref, processes=self.processes)
             if cols[0] == 'CDAT':
                 logger.log(
                     20, '~~ CALCULATING FF DATA ~~'.rjust(79, '~'))
@@ -132,20 +135,39 @@ class Loop(object):
                     compare.pretty_data_comp(
                         self.ref_data,
                         self.ff.data)
+            # GRAD -m 0.1 stops scoring trial FFs once one is 10% better than
+            # the current FF (see Gradient.stop_margin). GRAD -s only
+            # calculates the parts of the Jacobian each parameter can change
+            # (see Gradient.sparse).
             if cols[0] == 'GRAD':
                 grad = gradient.Gradient(
                     direc=self.direc,
                     ff=self.ff,
                     ff_lines=self.ff.lines,
                     args_ff=self.args_ff)
+                grad.processes = self.processes
+                if '-m' in cols:
+                    grad.stop_margin = float(cols[cols.index('-m') + 1])
+                if '-s' in cols:
+                    grad.sparse = True
                 self.ff = grad.run(ref_data=self.ref_data)
+            # SIMP -s scores all of the trial points of each cycle at the
+            # same time (see Simplex.speculative). Needs PROC above 1.
             if cols[0] == 'SIMP':
                 simp = simplex.Simplex(
                     direc=self.direc,
                     ff=self.ff,
                     ff_lines=self.ff.lines,
                     args_ff=self.args_ff)
+                simp.processes = self.processes
+                if '-s' in cols:
+                    simp.speculative = True
                 self.ff = simp.run(r_data=self.ref_data)
+            # Number of trial FFs scored at the same time by the optimizers.
+            # Also the number of processes used to parse the reference files
+            # for RDAT, if it comes first.
+            if cols[0] == 'PROC':
+                self.processes = int(cols[1])
             if cols[0] == 'WGHT':
                 data_type = cols[1]
                 co.WEIGHTS[data_type] = float(cols[2])
@@ -2,13 +2,16 @@
 """
 General code related to all optimization techniques.
 """
-import copy
 import collections
 import itertools
 import logging
 import logging.config
+import multiprocessing
 import numpy as np
+import os
 import re
+import shutil
+import tempfile
 import textwrap
 
 import calculate
@@ -63,7 +66,7 @@ class Optimizer(object):
     args_ref : list
                Arguments for `calculate.main` used to calculate the reference
                data set.
-    ref_data : list of `datatypes.Datum`
+    ref_data : `datatypes.DataSet`
     restore : bool, optional
               If True, will write the initial force field after the optimization
               is complete. If False, will write the best force field from the
@@ -74,6 +77,10 @@ class Optimizer(object):
     new_ffs : list
               Contains the new force field subclasses and parameters generated
               during the optimization.
+    processes : int
+                Number of trial force fields scored at the same time. If
+                greater than 1, each one is scored inside its own scratch
+                copy of the calculate directory. Default is 1.
 
     Returns
     -------
@@ -97,14 +104,141 @@ class Optimizer(object):
         self.args_ff = args_ff
         self.args_ref = args_ref
         self.new_ffs = []
+        self.processes = 1
         # We should do away with the ff_lines attribute.
         # It's specific to MM3*. This sort of stuff should be
         # encapsulated in export_ff and import_ff type functions.
         if self.ff_lines is None and self.ff.lines:
             self.ff_lines = self.ff.lines
 
-def return_ref_data(args_ref):
+# Holds the scratch directory and settings of a worker process started by
+# calculate_ffs.
+_WORKER = {}
+
+def setup_workspace(direc, root, skip=None):
+    """
+    Makes a scratch directory where force fields can be calculated without
+    touching the files in `direc`.
+
+    Every file in `direc` is symlinked into the scratch directory, except
+    those made by Q2MM when it runs MacroModel (*.q2mm.*) and any filenames
+    in `skip`. That way the trial FF and the MacroModel output belong to the
+    scratch directory alone.
+
+    Parameters
+    ----------
+    direc : string
+            Directory to mirror.
+    root : string
+           The scratch directory is created inside this directory.
+    skip : list of strings, optional
+           Filenames that aren't linked, such as mm3.fld.
+
+    Returns
+    -------
+    string
+        Path to the scratch directory.
+    """
+    if skip is None:
+        skip = []
+    direc = os.path.abspath(direc)
+    path = tempfile.mkdtemp(dir=root)
+    for filename in os.listdir(direc):
+        if filename in skip or '.q2mm.' in filename:
+            continue
+        source = os.path.join(direc, filename)
+        if os.path.isfile(source):
+            os.symlink(source, os.path.join(path, filename))
+    logger.log(5, '  -- Setup workspace {}.'.format(path))
+    return path
+
+def _init_worker(root, direc, ff_filename, lines, args_ff):
+    """
+    Starts a worker process used by `calculate_ffs`. Each worker gets its own
+    workspace.
+    """
+    path = setup_workspace(direc, root, skip=[ff_filename])
+    _WORKER['path'] = path
+    _WORKER['ff_path'] = os.path.join(path, ff_filename)
+    _WORKER['lines'] = lines
+    _WORKER['args_ff'] = calculate.replace_directory(args_ff, path)
+
+def _calculate_ff_in_workspace(ff):
+    ff.export_ff(path=_WORKER['ff_path'], lines=_WORKER['lines'])
+    return calculate.main(_WORKER['args_ff'])
+
+def calculate_ffs(ffs, args_ff, lines=None, processes=1, in_batches=False):
+    """
+    Calculates the data for many force fields.
+
+    With one process, each FF is exported to its own path and calculated in
+    turn. With more processes, a pool of workers is started. Each worker
+    has a private workspace (see `setup_workspace`) that mirrors the
+    calculate directory, so the trial FFs don't overwrite each other.
+
+    Either way, the results come back in the same order as `ffs`. The
+    workspaces are removed once the generator is finished or closed.
+
+    Normally every FF is handed to the workers right away, so closing the
+    generator early saves little. With in_batches, only as many FFs as
+    there are processes are handed out at a time, and the next batch isn't
+    started until the last one has been yielded. Closing the generator then
+    skips every FF that wasn't handed out yet.
+
+    Parameters
+    ----------
+    ffs : list of `datatypes.FF` (or subclass)
+    args_ff : list
+              Arguments for `calculate.main`.
+    lines : list of strings, optional
+            Passed to `datatypes.FF.export_ff`.
+    processes : int
+    in_batches : bool
+
+    Yields
+    ------
+    tuple of (`datatypes.FF`, data)
+    """
+    if processes <= 1 or len(ffs) <= 1:
+        for ff in ffs:
+            ff.export_ff(lines=lines)
+            yield ff, calculate.main(args_ff)
+        return
+    processes = min(processes, len(ffs))
+    direc = calculate.return_directory(args_ff)
+    root = tempfile.mkdtemp(prefix='q2mm_scratch_', dir=direc)
+    logger.log(10, '  -- Calculating {} FFs using {} processes.'.format(
+            len(ffs), processes))
+    pool = multiprocessing.Pool(
+        processes, _init_worker,
+        (root, direc, os.path.basename(ffs[0].path), lines, args_ff))
+    try:
+        if in_batches:
+            for i in xrange(0, len(ffs), processes):
+                batch = ffs[i:i + processes]
+                for ff, data in itertools.izip(
+                        batch,
+                        pool.map(_calculate_ff_in_workspace, batch, 1)):
+                    yield ff, data
+        else:
+            for ff, data in itertools.izip(
+                    ffs, pool.imap(_calculate_ff_in_workspace, ffs)):
+                yield ff, data
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(root, ignore_errors=True)
+
+def return_ref_data(args_ref, processes=1):
+    """
+    Calculates the reference data and imports its weights.
+
+    With more than one process, the reference files are parsed in a pool
+    of processes first (see `calculate.preload`).
+    """
     logger.log(20, '~~ GATHERING REFERENCE DATA ~~'.rjust(79, '~'))
+    if processes > 1:
+        calculate.preload(args_ref, processes=processes)
     ref_data = calculate.main(args_ref)
     compare.import_weights(ref_data)
     return ref_data
@@ -120,8 +254,8 @@ def differentiate_ff(ff, central=True):
     Performs central or forward differentiation of parameters.
 
     For more description, see `differentiate_params`, which this is more
-    or less a wrapper of. This just returns FF objects instead of lists
-    of `datatypes.Param`.
+    or less a wrapper of. This just returns FF objects instead of
+    `datatypes.ParamVector`.
 
     Parameters
     ----------
@@ -136,17 +270,19 @@ def differentiate_ff(ff, central=True):
     ffs = []
     for i, param_set in enumerate(param_sets):
         new_ff = ff.__class__()
-        new_ff.params = param_set
+        new_ff.param_vector = param_set
         new_ff.path = ff.path
         if central and i % 2 == 1:
             logger.log(1, '>>> i / i % 2: {} {}'.format(i, i % 2))
-            new_ff.method = 'BACKWARD {}'.format(param_set[int(np.floor(i/2.))])
+            new_ff.method = 'BACKWARD {}'.format(
+                param_set.return_param(int(np.floor(i/2.))))
         else:
             logger.log(1, '>>> i / i % 2: {} {}'.format(i, i % 2))
             if central:
-                new_ff.method = 'FORWARD {}'.format(param_set[int(np.floor(i/2.))])
+                new_ff.method = 'FORWARD {}'.format(
+                    param_set.return_param(int(np.floor(i/2.))))
             else:
-                new_ff.method = 'FORWARD {}'.format(param_set[i])
+                new_ff.method = 'FORWARD {}'.format(param_set.return_param(i))
         ffs.append(new_ff)
     return ffs
 
@@ -161,7 +297,8 @@ def differentiate_params(params, central=True):
 
     Returns
     -------
-    list of lists of `datatypes.Param`
+    list of `datatypes.ParamVector`
+        Each is a copy of the values of `params` with one value changed.
     """
     if central:
         logger.log(
@@ -171,17 +308,22 @@ def differentiate_params(params, central=True):
         logger.log(
             20, '~~ FORWARD DIFFERENTIATION ON {} PARAMS ~~'.format(
                 len(params)).rjust(79, '~'))
+    vector = datatypes.ParamVector.from_params(params)
     param_sets = []
     for i, param in enumerate(params):
         while True:
             original_value = param.value
-            forward_params = copy.deepcopy(params)
+            forward_params = vector.copy()
             if central:
-                backward_params = copy.deepcopy(params)
+                backward_params = vector.copy()
             try:
-                forward_params[i].value = original_value + param.step
+                forward_params.values[i] = original_value + param.step
+                # Only the stepped parameter is checked. Changing the step
+                # can't fix any other parameter that's out of range.
+                forward_params.check(index=i)
                 if central:
-                    backward_params[i].value = original_value - param.step
+                    backward_params.values[i] = original_value - param.step
+                    backward_params.check(index=i)
             except datatypes.ParamError as e:
                 logger.warning(e.message)
                 old_step = param.step
@@ -4,7 +4,6 @@ Simplex optimization.
 """
 import copy
 import collections
-import itertools
 import logging
 import logging.config
 import numpy as np
@@ -44,6 +43,15 @@ class Simplex(opt.Optimizer):
 
     max_params : int
                  Maximum number of parameters used in a single simplex cycle.
+    speculative : bool
+                  If True and there's more than 1 process, each cycle scores
+                  the reflection, expansion and both contraction points at
+                  the same time, then keeps whichever the usual rules pick.
+                  This scores points that aren't needed, but a cycle only
+                  takes as long as one FF calculation. Default is False.
+    vertices : `Vertices`
+               The simplex while it's running. Before then, the vertices are
+               held as FFs in `new_ffs`.
     """
     def __init__(self,
                  direc=None,
@@ -58,8 +66,16 @@ class Simplex(opt.Optimizer):
         self.do_weighted_reflection = True
         self.max_cycles = 100
         self.max_params = 10
+        self.speculative = False
+        self.vertices = None
     @property
     def best_ff(self):
+        if self.vertices is not None:
+            self.vertices.sort()
+            if self.vertices.scores[0] < self.ff.score:
+                return restore_simp_ff(self.vertices.return_ff(0), self.ff)
+            else:
+                return self.ff
         # Typically, self.new_ffs would include the original FF, self.ff,
         # but this can be changed by massive contractions.
         if self.new_ffs:
@@ -87,8 +103,10 @@ class Simplex(opt.Optimizer):
         `datatypes.FF` (or subclass)
             Contains the best parameters.
         """
+        self.vertices = None
         if r_data is None:
-            r_data = opt.return_ref_data(self.args_ref)
+            r_data = opt.return_ref_data(
+                self.args_ref, processes=self.processes)
 
         if self.ff.score is None:
             logger.log(20, '~~ CALCULATING INITIAL FF SCORE ~~'.rjust(79, '~'))
@@ -107,6 +125,11 @@ class Simplex(opt.Optimizer):
         logger.log(20, 'INIT FF SCORE: {}'.format(self.ff.score))
         opt.pretty_ff_results(self.ff, level=20)
 
+        # The trial FFs may only hold some of the parameters. Every trial FF
+        # is written on top of these lines, so the rest of the parameters
+        # come from the initial FF.
+        self.ff_lines = self.ff.return_lines(lines=self.ff_lines)
+
         if self.max_params and len(self.ff.params) > self.max_params:
             logger.log(20, '  -- More parameters than the maximum allowed.')
             logger.log(5, 'CURRENT PARAMS: {}'.format(len(self.ff.params)))
@@ -132,12 +155,7 @@ class Simplex(opt.Optimizer):
                 # derivatives only from forward differentiation.
                 ffs = opt.differentiate_ff(self.ff, central=True)
                 # We have to score to get the derivatives.
-                for ff in ffs:
-                    ff.export_ff(lines=self.ff_lines)
-                    logger.log(20, '  -- Calculating {}.'.format(ff))
-                    data = calculate.main(self.args_ff)
-                    ff.score = compare.compare_data(r_data, data)
-                    opt.pretty_ff_results(ff)
+                self.score_ffs(ffs, r_data)
                 # Add the derivatives to your original FF.
                 opt.param_derivs(self.ff, ffs)
                 # Only keep the forward differentiated FFs.
@@ -169,7 +187,7 @@ class Simplex(opt.Optimizer):
             # Make a copy of your original FF that has less parameters.
             ff_copy = copy.deepcopy(self.ff)
             new_params = []
-            for param in ff.params:
+            for param in ff_copy.params:
                 if param.mm3_row in ff_rows and param.mm3_col in ff_cols:
                     new_params.append(param)
             ff_copy.params = new_params
@@ -181,13 +199,7 @@ class Simplex(opt.Optimizer):
             # Still make that FF copy.
             ff_copy = copy.deepcopy(self.ff)
         # Double check and make sure they're all scored.
-        for ff in self.new_ffs:
-            if ff.score is None:
-                ff.export_ff(lines=self.ff_lines)
-                logger.log(20, '  -- Calculating {}.'.format(ff))
-                data = calculate.main(self.args_ff)
-                ff.score = compare.compare_data(r_data, data)
-                opt.pretty_ff_results(ff)
+        self.score_ffs([x for x in self.new_ffs if x.score is None], r_data)
         # Add your copy of the orignal to FF to the forward differentiated FFs.
         self.new_ffs = sorted(self.new_ffs + [ff_copy], key=lambda x: x.score)
         # Allow 3 cycles w/o change for each parameter present. Remember that
@@ -196,19 +208,23 @@ class Simplex(opt.Optimizer):
         wrapper = textwrap.TextWrapper(width=79)
         # Shows all FFs parameters.
         opt.pretty_ff_params(self.new_ffs)
+        # From here on, the simplex is only a matrix of parameter values and
+        # the scores. FFs are made when a vertex has to be written.
+        self.vertices = Vertices.from_ffs(self.ff, self.new_ffs)
+        self.new_ffs = []
+        vertices = self.vertices
         # Start the simplex cycles.
         current_cycle = 0
         cycles_wo_change = 0
         while current_cycle < self.max_cycles \
                 and cycles_wo_change < self._max_cycles_wo_change:
             current_cycle += 1
-            last_best = self.new_ffs[0].score
-            best_ff = self.new_ffs[0]
+            last_best = vertices.scores[0]
             logger.log(20, '~~ START SIMPLEX CYCLE {} ~~'.format(
                     current_cycle).rjust(79, '~'))
             logger.log(20, 'ORDERED FF SCORES:')
             logger.log(20, wrapper.fill('{}'.format(
-                    ' '.join('{:15.4f}'.format(x.score) for x in self.new_ffs))))
+                    ' '.join('{:15.4f}'.format(x) for x in vertices.scores))))
 
             # !!! FOR TESTING !!!
 
@@ -218,34 +234,24 @@ class Simplex(opt.Optimizer):
             # the best FF afterwards.
 
             # if current_cycle == 5:
-            #     self.new_ffs[-1].export_ff(
+            #     vertices.return_ff(-1).export_ff(
             #         path='ref_methanol_flds/mm3_worst.fld',
             #         lines=self.ff.lines)
-            #     self.new_ffs[0].export_ff(
+            #     vertices.return_ff(0).export_ff(
             #         path='ref_methanol_flds/mm3_best.fld',
             #         lines=self.ff.lines)
-            #     self.new_ffs[-1].export_ff(
+            #     vertices.return_ff(-1).export_ff(
             #         path='ref_methanol/mm3.fld',
             #         lines=self.ff.lines)
             #     raise opt.OptError
 
             # !!! END TESTING !!!
 
-            inv_ff = self.ff.__class__()
-            if self.do_weighted_reflection:
-                inv_ff.method = 'WEIGHTED INVERSION'
-            else:
-                inv_ff.method = 'INVERSION'
-            inv_ff.params = copy.deepcopy(best_ff.params)
-            ref_ff = self.ff.__class__()
-            ref_ff.method = 'REFLECTION'
-            ref_ff.params = copy.deepcopy(best_ff.params)
             # Need score difference sum for weighted inversion.
-            # Calculate this value before going into loop.
             if self.do_weighted_reflection:
+                whts = vertices.scores[:-1] - vertices.scores[-1]
+                score_diff_sum = whts.sum()
                 # If zero, should break.
-                score_diff_sum = sum([x.score - self.new_ffs[-1].score
-                                      for x in self.new_ffs[:-1]])
                 if score_diff_sum == 0.:
                     logger.warning(
                         'No difference between force field scores. '
@@ -256,107 +262,76 @@ class Simplex(opt.Optimizer):
                     raise opt.OptError(
                         'No difference between force field scores. '
                         'Exiting simplex.')
-            for i in xrange(0, len(best_ff.params)):
-                if self.do_weighted_reflection:
-                    inv_val = (
-                        sum([x.params[i].value * 
-                             (x.score - self.new_ffs[-1].score)
-                             for x in self.new_ffs[:-1]])
-                        / score_diff_sum)
-                else:
-                    inv_val = (
-                        sum([x.params[i].value for x in self.new_ffs[:-1]])
-                        /
-                        len(self.new_ffs[:-1]))
-                inv_ff.params[i].value = inv_val
-                ref_ff.params[i].value = (
-                    2 * inv_val - self.new_ffs[-1].params[i].value)
+                inv_vals = whts.dot(vertices.values[:-1]) / score_diff_sum
+            else:
+                inv_vals = vertices.values[:-1].mean(axis=0)
+            datatypes.ParamVector(vertices.table, inv_vals).check()
             # The inversion point does not need to be scored.
+            # Every trial point lies on the line from the worst vertex through
+            # the inversion point.
+            worst_vals = vertices.values[-1]
+            points = TrialPoints(self, r_data, vertices.table, zip(
+                    ['REFLECTION', 'EXPANSION', 'CONTRACTION',
+                     'OUTSIDE CONTRACTION'],
+                    worst_vals + np.outer(
+                        [2., 3., 0.5, 1.5], inv_vals - worst_vals)))
+            if self.speculative and self.processes > 1:
+                logger.log(20, '  -- Scoring all trial points at once.')
+                points.score_all()
             # Calculate score for reflected parameters.
-            self.ff.export_ff(self.ff.path, params=ref_ff.params)
-            data = calculate.main(self.args_ff)
-            ref_ff.score = compare.compare_data(r_data, data)
-            opt.pretty_ff_results(ref_ff)
-            if ref_ff.score < self.new_ffs[0].score:
+            ref_ff = points['REFLECTION']
+            if ref_ff.score < vertices.scores[0]:
                 logger.log(20, '~~ ATTEMPTING EXPANSION ~~'.rjust(79, '~'))
-                exp_ff = self.ff.__class__()
-                exp_ff.method = 'EXPANSION'
-                exp_ff.params = copy.deepcopy(best_ff.params)
-                for i in xrange(0, len(self.new_ffs[0].params)):
-                    exp_ff.params[i].value = (
-                        3 * inv_ff.params[i].value -
-                        2 * self.new_ffs[-1].params[i].value)
-                self.ff.export_ff(self.ff.path, exp_ff.params)
-                data = calculate.main(self.args_ff)
-                exp_ff.score = compare.compare_data(r_data, data)
-                opt.pretty_ff_results(exp_ff)
+                exp_ff = points['EXPANSION']
                 if exp_ff.score < ref_ff.score:
-                    self.new_ffs[-1] = exp_ff
+                    vertices.replace(-1, exp_ff)
                     logger.log(
                         20, '  -- Expansion succeeded. Keeping expanded '
                         'parameters.')
                 else:
-                    self.new_ffs[-1] = ref_ff
+                    vertices.replace(-1, ref_ff)
                     logger.log(
                         20, '  -- Expansion failed. Keeping reflected parameters.')
-            elif ref_ff.score < self.new_ffs[-2].score:
+            elif ref_ff.score < vertices.scores[-2]:
                 logger.log(20, '  -- Keeping reflected parameters.')
-                self.new_ffs[-1] = ref_ff
+                vertices.replace(-1, ref_ff)
             else:
                 logger.log(20, '~~ ATTEMPTING CONTRACTION ~~'.rjust(79, '~'))
-                con_ff = self.ff.__class__()
-                con_ff.method = 'CONTRACTION'
-                con_ff.params = copy.deepcopy(best_ff.params)
-                for i in xrange(0, len(best_ff.params)):
-                    if ref_ff.score > self.new_ffs[-1].score:
-                        con_val = (
-                            (inv_ff.params[i].value +
-                             self.new_ffs[-1].params[i].value) / 2)
-                    else:
-                        con_val = (
-                            (3 * inv_ff.params[i].value -
-                             self.new_ffs[-1].params[i].value) / 2)
-                    con_ff.params[i].value = con_val
-                self.ff.export_ff(self.ff.path, params=con_ff.params)
-                data = calculate.main(self.args_ff)
-                con_ff.score = compare.compare_data(r_data, data)
-                opt.pretty_ff_results(con_ff)
+                if ref_ff.score > vertices.scores[-1]:
+                    con_ff = points['CONTRACTION']
+                else:
+                    con_ff = points['OUTSIDE CONTRACTION']
                 # This change was made to reflect the 1998 Q2MM publication.
-                # if con_ff.score < self.new_ffs[-1].score:
-                if con_ff.score < self.new_ffs[-2].score:
+                # if con_ff.score < vertices.scores[-1]:
+                if con_ff.score < vertices.scores[-2]:
                     logger.log(20, '  -- Contraction succeeded.')
-                    self.new_ffs[-1] = con_ff
+                    vertices.replace(-1, con_ff)
                 elif self.do_massive_contraction:
                     logger.log(
                         20, '~~ DOING MASSIVE CONTRACTION ~~'.rjust(79, '~'))
-                    for ff_num, ff in enumerate(self.new_ffs[1:]):
-                        for i in xrange(0, len(best_ff.params)):
-                            ff.params[i].value = (
-                                (ff.params[i].value +
-                                 self.new_ffs[0].params[i].value) / 2)
-                        self.ff.export_ff(self.ff.path, params=ff.params)
-                        data = calculate.main(self.args_ff)
-                        ff.score = compare.compare_data(r_data, data)
-                        ff.method += ' MC'
-                        opt.pretty_ff_results(ff)
+                    # Each vertex is independent, so they can be scored at
+                    # the same time.
+                    ffs = vertices.contract()
+                    self.score_ffs(ffs, r_data)
+                    vertices.scores[1:] = [x.score for x in ffs]
                 else:
                     logger.log(
                         20, '  -- Contraction failed. Keeping parmaeters '
                         'anyway.')
-                    self.new_ffs[-1] = con_ff
-            self.new_ffs = sorted(self.new_ffs, key=lambda x: x.score)
-            if self.new_ffs[0].score < last_best:
+                    vertices.replace(-1, con_ff)
+            vertices.sort()
+            if vertices.scores[0] < last_best:
                 cycles_wo_change = 0
             else:
                 cycles_wo_change += 1
                 logger.log(20, '  -- {} cycles without improvement out of {} '
                            'allowed.'.format(
                         cycles_wo_change, self._max_cycles_wo_change))
-            best_ff = self.new_ffs[0]
             logger.log(20, 'BEST:')
-            opt.pretty_ff_results(self.new_ffs[0], level=20)
+            opt.pretty_ff_results(vertices.return_ff(0), level=20)
             logger.log(20, '~~ END SIMPLEX CYCLE {} ~~'.format(
                     current_cycle).rjust(79, '~'))
+        best_ff = vertices.return_ff(0)
         if best_ff.score < self.ff.score:
             logger.log(20, '~~ SIMPLEX FINISHED WITH IMPROVEMENTS ~~'.rjust(
                     79, '~'))
@@ -367,9 +342,154 @@ class Simplex(opt.Optimizer):
         opt.pretty_ff_results(self.ff, level=20)
         opt.pretty_ff_results(best_ff, level=20)
         logger.log(20, '  -- Writing best force field from simplex.')
-        best_ff.export_ff(best_ff.path)
+        best_ff.export_ff(best_ff.path, lines=self.ff_lines)
         return best_ff
 
+    def score_ffs(self, ffs, r_data):
+        """
+        Scores FFs using `opt.calculate_ffs`, so they're scored at the same
+        time if there's more than 1 process.
+        """
+        for ff in ffs:
+            ff.path = self.ff.path
+        for ff, data in opt.calculate_ffs(
+                ffs, self.args_ff, lines=self.ff_lines,
+                processes=self.processes):
+            logger.log(20, '  -- Calculated {}.'.format(ff))
+            ff.score = compare.compare_data(r_data, data)
+            opt.pretty_ff_results(ff)
+
+class Vertices(object):
+    """
+    A simplex held as one matrix of parameter values, with a row for each
+    vertex, and an array of their scores. Kept sorted from best to worst
+    by `sort`.
+
+    Parameters
+    ----------
+    ff : `datatypes.FF` (or subclass)
+         FFs made from the vertices are this class and share its path.
+    table : `datatypes.ParamTable`
+    values : np.ndarray of floats, shape (number of vertices, parameters)
+    scores : np.ndarray of floats
+    methods : list of strings
+    """
+    __slots__ = ['ff', 'table', 'values', 'scores', 'methods']
+    def __init__(self, ff, table, values, scores, methods):
+        self.ff = ff
+        self.table = table
+        self.values = np.array(values, dtype=float)
+        self.scores = np.array(scores, dtype=float)
+        self.methods = list(methods)
+    def __len__(self):
+        return len(self.scores)
+    @classmethod
+    def from_ffs(cls, ff, ffs):
+        """
+        Every FF must have the same parameters in the same order.
+        """
+        vectors = [x.param_vector for x in ffs]
+        vertices = cls(
+            ff, vectors[0].table, [x.values for x in vectors],
+            [x.score for x in ffs], [x.method for x in ffs])
+        vertices.sort()
+        return vertices
+    def contract(self):
+        """
+        Moves every vertex but the best halfway towards the best. Returns the
+        moved vertices as FFs, which still have to be scored. Their scores are
+        NaN until they're stored in `scores[1:]`.
+
+        Raises ParamError without moving any vertex if any of the new
+        values are outside of their allowed ranges.
+        """
+        vectors = [datatypes.ParamVector(self.table, x)
+                   for x in (self.values[1:] + self.values[0]) / 2]
+        for vector in vectors:
+            vector.check()
+        self.values[1:] = [x.values for x in vectors]
+        self.scores[1:] = np.nan
+        self.methods[1:] = [x + ' MC' for x in self.methods[1:]]
+        ffs = [self.return_ff(i) for i in xrange(1, len(self))]
+        for ff in ffs:
+            ff.score = None
+        return ffs
+    def replace(self, i, ff):
+        """
+        Replaces vertex i with a scored FF.
+        """
+        self.values[i] = ff.param_vector.values
+        self.scores[i] = ff.score
+        self.methods[i] = ff.method
+    def return_ff(self, i):
+        ff = self.ff.__class__()
+        ff.path = self.ff.path
+        ff.method = self.methods[i]
+        ff.score = self.scores[i]
+        ff.param_vector = datatypes.ParamVector(self.table, self.values[i])
+        return ff
+    def sort(self):
+        # Stable, like sorting the FFs was.
+        order = np.argsort(self.scores, kind='mergesort')
+        self.values = self.values[order]
+        self.scores = self.scores[order]
+        self.methods = [self.methods[x] for x in order]
+
+class TrialPoints(object):
+    """
+    The points a simplex cycle may move the worst FF to. Each is made and
+    scored the first time it's asked for, unless `score_all` already did.
+
+    Parameters
+    ----------
+    simplex : `Simplex`
+    r_data : `datatypes.DataSet`
+    table : `datatypes.ParamTable`
+    points : list of tuples
+             Each tuple is a name, which is also used as the method of the
+             FF, and the parameter values.
+    """
+    def __init__(self, simplex, r_data, table, points):
+        self.simplex = simplex
+        self.r_data = r_data
+        self.table = table
+        self.points = collections.OrderedDict(points)
+        # Values are FFs or the datatypes.ParamError raised making them.
+        self._ffs = {}
+    def __getitem__(self, name):
+        if name not in self._ffs:
+            ff = self.make_ff(name)
+            self.simplex.score_ffs([ff], self.r_data)
+            self._ffs[name] = ff
+        ff = self._ffs[name]
+        # Points outside the parameter ranges only stop the simplex once
+        # they're actually needed.
+        if isinstance(ff, datatypes.ParamError):
+            raise ff
+        return ff
+    def make_ff(self, name):
+        ff = self.simplex.ff.__class__()
+        ff.method = name
+        ff.param_vector = datatypes.ParamVector(self.table, self.points[name])
+        ff.param_vector.check()
+        return ff
+    def score_all(self):
+        """
+        Scores every point that isn't scored yet at the same time.
+        """
+        ffs = []
+        for name in self.points:
+            if name in self._ffs:
+                continue
+            try:
+                ff = self.make_ff(name)
+            except datatypes.ParamError as e:
+                self._ffs[name] = e
+            else:
+                self._ffs[name] = ff
+                ffs.append(ff)
+        self.simplex.score_ffs(ffs, self.r_data)
+
 # Sorting based upon the 2nd derivative isn't such a good criterion. This should
 # be updated soon.
 def select_simp_params_on_derivs(params, max_params=10):
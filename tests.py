@@ -0,0 +1,220 @@
+#!/usr/bin/python
+"""
+Checks that the faster versions of Q2MM's steps give the same answers as
+the code they replaced, along with a few cases that used to go wrong.
+
+Like benchmark.py, this uses made up data, so no reference or MacroModel
+files are required.
+
+Ex.) Run every check.
+
+python tests.py
+
+Ex.) Run the objective function checks.
+
+python -m unittest tests.TestObjectiveFunction
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import benchmark
+import compare
+import constants as co
+import datatypes
+import filetypes
+import gradient
+import opt
+import re
+
+def return_random_data(num_data, seed=0):
+    """
+    Returns reference and FF `datatypes.DataSet` that look like
+    `benchmark.benchmark_score`'s, with about a third of them torsions.
+    """
+    random = np.random.RandomState(seed)
+    r_data = datatypes.DataSet(num_data)
+    c_data = datatypes.DataSet(num_data)
+    r_data.typ[:] = random.choice(['b', 'a', 't', 'h', 'eig'], size=num_data)
+    c_data.typ[:] = r_data.typ
+    r_data.wht[:] = [co.WEIGHTS.get(x, 0.05) for x in r_data.typ]
+    r_data.val[:] = random.uniform(-180., 180., size=num_data)
+    c_data.val[:] = r_data.val + random.normal(scale=20., size=num_data)
+    c_data.val[c_data.val > 180.] -= 360.
+    c_data.val[c_data.val < -180.] += 360.
+    return r_data, c_data
+
+class TestObjectiveFunction(unittest.TestCase):
+    def test_score_matches_loop(self):
+        r_data, c_data = return_random_data(5000)
+        score = compare.objective_function(
+            r_data.wht, r_data.val, c_data.val, r_data.typ == 't')
+        self.assertEqual(
+            score,
+            benchmark.score_loop(
+                r_data.wht.tolist(), r_data.val.tolist(),
+                c_data.val.tolist(), r_data.typ.tolist()))
+    def test_score_same_with_resid(self):
+        r_data, c_data = return_random_data(500)
+        score = compare.calculate_score(r_data, c_data)
+        self.assertEqual(
+            compare.calculate_score(r_data, c_data, return_resid=True)[0],
+            score)
+    def test_resid_matches_gradient(self):
+        # Without any torsions that need wrapping, these are the residuals
+        # the gradient methods use.
+        r_data, c_data = return_random_data(500)
+        c_data.val[:] = r_data.val + np.random.RandomState(1).normal(
+            scale=20., size=len(r_data))
+        score, resid = compare.calculate_score(
+            r_data, c_data, return_resid=True)
+        np.testing.assert_allclose(
+            resid, gradient.return_residual(r_data, c_data).flatten(),
+            rtol=0., atol=1e-12)
+    def test_resid_wraps_torsions(self):
+        wht = np.array([2., 2., 2., 2., 2.])
+        r_val = np.array([179., -179., 10., -90., 1.])
+        c_val = np.array([-179., 179., -170., 90., 3.])
+        is_tor = np.array([True, True, True, True, False])
+        score, resid = compare.objective_function(
+            wht, r_val, c_val, is_tor, return_resid=True)
+        np.testing.assert_allclose(resid, [-4., 4., 360., 360., -4.])
+        self.assertEqual(score, sum(x**2 for x in resid))
+
+class TestExportFF(unittest.TestCase):
+    def setUp(self):
+        self.direc = tempfile.mkdtemp()
+        self.path = os.path.join(self.direc, 'mm3.fld')
+    def tearDown(self):
+        shutil.rmtree(self.direc)
+    def return_ff(self, values):
+        ff = datatypes.MM3(self.path)
+        ff.params = [
+            datatypes.ParamMM3(
+                mm3_row=row, mm3_col=col, ptype='bf', value=value)
+            for (row, col), value in zip([(2, 2), (3, 1)], values)]
+        return ff
+    def test_short_line(self):
+        # Line 2 ends before its 2nd parameter column, so writing that
+        # parameter makes the line longer and moves line 3.
+        lines = [' C\n',
+                 ' 1 ' + ' ' * 30 + '\n',
+                 ' 1 ' + ' ' * 60 + '\n']
+        for values in ([1., 2.], [1., 3.], [4., 5.]):
+            ff = self.return_ff(values)
+            ff.export_ff(lines=lines)
+            with open(self.path, 'r') as f:
+                self.assertEqual(
+                    f.read(), ''.join(ff.return_lines(lines=lines)))
+    def test_patch(self):
+        lines = [' C\n'] + [' 1 ' + ' ' * 60 + '\n'] * 2
+        for values in ([1., 2.], [1., 3.], [4., 5.]):
+            ff = self.return_ff(values)
+            ff.export_ff(lines=lines)
+            with open(self.path, 'r') as f:
+                self.assertEqual(
+                    f.read(), ''.join(ff.return_lines(lines=lines)))
+        self.assertEqual(
+            datatypes._EXPORTED[os.path.abspath(self.path)].fields,
+            ff.return_fields())
+
+class TestDifferentiateParams(unittest.TestCase):
+    def test_other_param_out_of_range(self):
+        # A force constant that's already negative shouldn't stop the other
+        # parameters from being differentiated. Its own forward step takes it
+        # back in range.
+        params = [
+            datatypes.ParamMM3(mm3_row=i + 1, mm3_col=1, ptype='bf', value=1.)
+            for i in xrange(3)]
+        params[0]._value = -0.05
+        vectors = opt.differentiate_params(params, central=False)
+        values = np.array([x.value for x in params])
+        np.testing.assert_allclose(
+            [x.values - values for x in vectors],
+            np.diag([x.step for x in params]))
+
+class TestSparseJacobian(unittest.TestCase):
+    def setUp(self):
+        # 3 bond parameters, one per FF row, and data that either uses one
+        # of those rows or depends on everything (ff_row of 0).
+        random = np.random.RandomState(0)
+        self.ff = datatypes.MM3('mm3.fld')
+        self.ff.params = [
+            datatypes.ParamMM3(mm3_row=i + 1, mm3_col=1, ptype='bf', value=1.)
+            for i in xrange(3)]
+        ff_rows = np.array([0, 0, 1, 1, 1, 2, 2, 3, 3, 3, 1, 2])
+        self.r_data = datatypes.DataSet(len(ff_rows))
+        self.r_data.typ[:] = 'b'
+        self.r_data.ff_row[:] = ff_rows
+        self.r_data.wht[:] = random.uniform(0.5, 2., size=len(ff_rows))
+        self.r_data.val[:] = random.uniform(1., 2., size=len(ff_rows))
+        self.ff.data = datatypes.DataSet(len(ff_rows))
+        self.ff.data.typ[:] = 'b'
+        self.ff.data.val[:] = self.r_data.val + random.normal(
+            scale=0.1, size=len(ff_rows))
+        self.ff.score = compare.compare_data(self.r_data, self.ff.data)
+        # Each differentiated FF only changes the data its parameter can.
+        self.par_data = np.tile(self.ff.data.val, (6, 1))
+        for i in xrange(6):
+            rows = (ff_rows == 0) | (ff_rows == i // 2 + 1)
+            self.par_data[i, rows] += random.normal(
+                scale=0.05, size=rows.sum())
+        self.deps = gradient.Dependencies(self.ff.params, self.r_data)
+    def test_jacobian(self):
+        dense = gradient.return_jacobian(self.r_data.wht, self.par_data)
+        sparse = gradient.return_sparse_jacobian(
+            self.r_data.wht, self.par_data, self.deps)
+        np.testing.assert_array_equal(sparse.toarray(), dense)
+        np.testing.assert_allclose(
+            sparse.gram(), dense.T.dot(dense), rtol=1e-12)
+        resid = gradient.return_residual(self.r_data, self.ff.data)
+        np.testing.assert_allclose(
+            sparse.rdot(resid), dense.T.dot(resid), rtol=1e-12)
+    def test_derivatives(self):
+        ffs_dense = []
+        ffs_sparse = []
+        for i, val in enumerate(self.par_data):
+            data = datatypes.DataSet(len(val))
+            data.typ[:] = 'b'
+            data.val[:] = val
+            ff = datatypes.MM3('mm3.fld')
+            ff.score = compare.compare_data(self.r_data, data)
+            ffs_dense.append(ff)
+            ff = datatypes.MM3('mm3.fld')
+            ff.score = self.deps.score(
+                self.r_data, self.ff.data, self.ff.score, data, i // 2)
+            ffs_sparse.append(ff)
+        opt.param_derivs(self.ff, ffs_dense)
+        dense = [(x.d1, x.d2) for x in self.ff.params]
+        opt.param_derivs(self.ff, ffs_sparse)
+        sparse = [(x.d1, x.d2) for x in self.ff.params]
+        np.testing.assert_allclose(sparse, dense, rtol=1e-9)
+
+class TestGaussLogArchive(unittest.TestCase):
+    def setUp(self):
+        self.direc = tempfile.mkdtemp()
+        self.path = os.path.join(self.direc, 'x.log')
+    def tearDown(self):
+        shutil.rmtree(self.direc)
+    def test_start_marker_in_body(self):
+        # The last archive wraps so that "1\1\" from its body starts a
+        # line, just like the start of an archive does.
+        first = (' 1\\1\\GINC-A\\FOpt\\RB3LYP\\6-31G\\C1H4\\ME\\'
+                 '01-Jan-2000\\0\\\\@')
+        last = (' 1\\1\\GINC-B\\Freq\\RB3LYP\\6-31G\\C1H4\\ME\\'
+                '01-Jan-2000\\0\\\\#\n'
+                ' 1\\1\\2\\\\Title\\\\0,1\\C,0.,0.,0.\\\\Version=x\\\\@')
+        with open(self.path, 'w') as f:
+            f.write('Some output\n' + first + '\n\nMore output\n' + last +
+                    '\n Normal termination\n')
+        with open(self.path, 'r') as f:
+            expected = re.findall(
+                '(?s)(\s1\\\\1\\\\.*?[\\\\\n\s]+@)', f.read())[-1]
+        archive = filetypes.GaussLog(self.path).return_last_archive()
+        self.assertEqual(archive, expected)
+        self.assertTrue(archive.startswith(' 1\\1\\GINC-B'))
+
+if __name__ == '__main__':
+    unittest.main()